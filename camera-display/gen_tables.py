@@ -1,3 +1,29 @@
+#!/usr/bin/env python
+
+# Lookup table generator.
+#
+#   python gen_tables.py                     # 8 to 5/6 bit tables for src/main.rs (bits is the default)
+#
+# Also generates and analyzes stepper ramp tables, so a faster ramp can be designed and compared
+# offline before it goes on the motor. Profiles are delay-per-step curves over a ramp of ramp_n
+# steps; "sine" is what gpio-motor-control.zig's step_n() computes with @sin on every step today.
+#
+#   python gen_tables.py ramp --profile sine --lengths 1000,28400 --format zig
+#   python gen_tables.py ramp --profile trapezoid --format bin --output ramps.bin
+#   python gen_tables.py analyze --profile sine,rate-cosine,trapezoid --lengths 1000,40600,466000
+#   python gen_tables.py analyze --bin ramps.bin --lengths 40600
+#
+
+import os
+import sys
+import struct
+import argparse
+
+import numpy
+
+# Ramp constants live next to the model the webserver uses
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import motion_profile
 
 
 def gen_table(wide_max, thin_max):
@@ -13,9 +39,240 @@ def gen_table(wide_max, thin_max):
       num_on_line = 0
   print(']')
 
-print('8 to 5 bits:')
-gen_table(256, 2 ** 5)
 
-print('8 to 6 bits:')
-gen_table(256, 2 ** 6)
+# Ramp profiles: f(i, ramp_n, fastest_us, slowest_us) -> float delay_us per step index i (numpy array).
+# i runs 0..ramp_n-1 on the way up; the way down mirrors it with i = ramp_n..1, like step_n().
+
+def sine_profile(i, ramp_n, fastest_us, slowest_us):
+  # step_n(): starts at fastest + 2*(slowest - fastest) and eases down to fastest
+  return fastest_us + (slowest_us - fastest_us) * (numpy.sin((numpy.pi / ramp_n) * i + (numpy.pi / 2.0)) + 1.0)
+
+def rate_cosine_profile(i, ramp_n, fastest_us, slowest_us):
+  # Raised cosine on the step *rate* from 1/slowest to 1/fastest; gentle at both ends
+  w = (1.0 - numpy.cos(numpy.pi * i / ramp_n)) / 2.0
+  rate = (1.0 / slowest_us) + ((1.0 / fastest_us) - (1.0 / slowest_us)) * w
+  return 1.0 / rate
+
+def trapezoid_profile(i, ramp_n, fastest_us, slowest_us):
+  # Constant acceleration: rate^2 grows linearly with distance, so delay = 1/sqrt(...)
+  v0 = 1.0 / slowest_us
+  v1 = 1.0 / fastest_us
+  return 1.0 / numpy.sqrt(v0 * v0 + (v1 * v1 - v0 * v0) * (i / ramp_n))
+
+RAMP_PROFILES = {
+  'sine': sine_profile,
+  'rate-cosine': rate_cosine_profile,
+  'trapezoid': trapezoid_profile,
+}
+# Index into RAMP_PROFILES order, stored in the binary format
+RAMP_PROFILE_IDS = {name: i for i, name in enumerate(RAMP_PROFILES)}
+# Acceleration and jerk come from the untruncated profile, averaged over this many steps; on the
+# integer delays the 1us truncation and the cruise's fastest/fastest+1 alternation swamp the profile's own shape
+SMOOTHING_STEPS = 64
+
+
+def ramp_plan(n, level, ramp_steps=motion_profile.RAMP_UP_STEPS, fastest_us=motion_profile.FASTEST_US):
+  # (ramp_n, fastest_us) the way step_n() shortens the ramp for short moves
+  if level == motion_profile.HIGH:
+    fastest_us += motion_profile.HIGH_DIRECTION_OFFSET_US
+  if n < ramp_steps:
+    return max(0, (n // 2) - 1), motion_profile.FASTEST_US
+  return ramp_steps, fastest_us
+
+def ramp_profile_us(profile, ramp_n, fastest_us, slowest_us=motion_profile.SLOWEST_US):
+  # Float delays for i = 0..ramp_n (ramp_n+1 entries covers both the up and the mirrored down ramp)
+  if ramp_n < 1:
+    return numpy.zeros((0, ), dtype=numpy.float64)
+  i = numpy.arange(0, ramp_n + 1, dtype=numpy.float64)
+  return RAMP_PROFILES[profile](i, ramp_n, fastest_us, slowest_us)
+
+def ramp_table(profile, ramp_n, fastest_us, slowest_us=motion_profile.SLOWEST_US):
+  # ramp_profile_us() truncated and clamped like step_n() does before calling step_once()
+  if ramp_n < 1:
+    return numpy.zeros((0, ), dtype=numpy.uint16)
+  d = ramp_profile_us(profile, ramp_n, fastest_us, slowest_us)
+  return numpy.clip(d.astype(numpy.int64), 1, 0xffff).astype(numpy.uint16)
+
+def move_delays_us(table, n, fastest_us):
+  # Per-step delay_us for a whole move of n steps built from a ramp table (ramp_n = len(table)-1).
+  # A float table (ramp_profile_us()) gives the untruncated move, cruising at exactly fastest_us.
+  ramp_n = max(0, len(table) - 1)
+  if table.dtype.kind == 'f':
+    up = table[:ramp_n]
+    cruise = numpy.full((max(0, n - 2 * ramp_n), ), float(fastest_us))
+  else:
+    up = table[:ramp_n].astype(numpy.int64)
+    cruise = fastest_us + (numpy.arange(ramp_n, n - ramp_n) % 2)
+  down = table[1:ramp_n+1][::-1].astype(up.dtype) if ramp_n > 0 else up
+  return numpy.concatenate((up, cruise, down))
+
+def analyze_delays(delays_us, exact_delays_us=None, step_overhead_us=motion_profile.STEP_OVERHEAD_US, smoothing_steps=SMOOTHING_STEPS):
+  # Move time and peak rate from the integer delays: step_once() busy-waits 2 * (d / 2), plus the
+  # per-step overhead. Accel/jerk from exact_delays_us, the same move before truncation.
+  dt_s = (2 * (delays_us // 2) + step_overhead_us) / 1e6
+  if len(dt_s) < 1:
+    return {'steps': 0, 'seconds': 0.0, 'peak_rate': 0.0, 'peak_accel': 0.0, 'peak_jerk': 0.0}
+  rate = 1.0 / dt_s
+  exact_dt_s = dt_s if exact_delays_us is None else (exact_delays_us + step_overhead_us) / 1e6
+  # Finite differences of the smoothed rate against the (smoothed) time of each step
+  w = max(1, min(smoothing_steps, len(exact_dt_s)))
+  kernel = numpy.full((w, ), 1.0 / w)
+  rate_s = numpy.convolve(1.0 / exact_dt_s, kernel, mode='valid')
+  t_s = numpy.convolve(numpy.cumsum(exact_dt_s), kernel, mode='valid')
+  accel = numpy.diff(rate_s) / numpy.diff(t_s)
+  jerk = numpy.diff(accel) / numpy.diff(t_s)[1:]
+  return {
+    'steps': len(dt_s),
+    'seconds': float(dt_s.sum()),
+    'peak_rate': float(rate.max()),
+    'peak_accel': float(numpy.abs(accel).max()) if len(accel) > 0 else 0.0,
+    'peak_jerk': float(numpy.abs(jerk).max()) if len(jerk) > 0 else 0.0,
+  }
+
+
+# Output formats
+
+RAMP_BIN_MAGIC = b'RAMP'
+RAMP_BIN_VERSION = 1
+# magic, version, num_tables
+RAMP_BIN_HEADER = struct.Struct('<4sHH')
+# profile id, ramp_n, fastest_us, slowest_us, data offset (bytes from file start), num entries
+RAMP_BIN_ENTRY = struct.Struct('<HIHHII')
+
+def ramp_tables_to_bin(tables):
+  # tables: [(profile, ramp_n, fastest_us, slowest_us, uint16 array)], little-endian u16 data after the index
+  offset = RAMP_BIN_HEADER.size + RAMP_BIN_ENTRY.size * len(tables)
+  index = [RAMP_BIN_HEADER.pack(RAMP_BIN_MAGIC, RAMP_BIN_VERSION, len(tables))]
+  data = []
+  for profile, ramp_n, fastest_us, slowest_us, table in tables:
+    index.append(RAMP_BIN_ENTRY.pack(RAMP_PROFILE_IDS[profile], ramp_n, fastest_us, slowest_us, offset, len(table)))
+    data.append(table.astype('<u2').tobytes())
+    offset += len(table) * 2
+  return b''.join(index + data)
+
+def ramp_tables_from_bin(b):
+  magic, version, num_tables = RAMP_BIN_HEADER.unpack_from(b, 0)
+  if magic != RAMP_BIN_MAGIC or version != RAMP_BIN_VERSION:
+    raise Exception(f'Not a version {RAMP_BIN_VERSION} ramp table file')
+  names = list(RAMP_PROFILES)
+  tables = []
+  for t in range(0, num_tables):
+    profile_id, ramp_n, fastest_us, slowest_us, offset, count = RAMP_BIN_ENTRY.unpack_from(b, RAMP_BIN_HEADER.size + t * RAMP_BIN_ENTRY.size)
+    tables.append((names[profile_id], ramp_n, fastest_us, slowest_us, numpy.frombuffer(b, dtype='<u2', count=count, offset=offset).copy()))
+  return tables
+
+def format_source(values, per_line=17, indent='  '):
+  lines = []
+  for i in range(0, len(values), per_line):
+    lines.append(indent + ','.join(str(int(v)) for v in values[i:i+per_line]) + ',')
+  return '\n'.join(lines)
+
+def ramp_tables_to_source(tables, lang):
+  out = []
+  for profile, ramp_n, fastest_us, slowest_us, table in tables:
+    name = f'RAMP_{profile.upper().replace("-", "_")}_{ramp_n}_{fastest_us}US'
+    comment = f'// {profile} ramp, ramp_n = {ramp_n}, fastest_us = {fastest_us}, slowest_us = {slowest_us}; index i up, ramp_n+1-i down'
+    if lang == 'zig':
+      out.append(f'{comment}\nconst {name} = [_]u16{{\n{format_source(table)}\n}};\n')
+    else:
+      out.append(f'{comment}\nconst {name}: [u16; {len(table)}] = [\n{format_source(table)}\n];\n')
+  return '\n'.join(out)
+
+
+def parse_lengths(s):
+  return [int(x) for x in s.split(',') if len(x.strip()) > 0]
+
+def build_tables(profiles, lengths, levels, slowest_us):
+  # One table per distinct (profile, ramp_n, fastest_us); most lengths share the full RAMP_UP_STEPS ramp
+  tables = []
+  seen = set()
+  for profile in profiles:
+    for n in lengths:
+      for level in levels:
+        ramp_n, fastest_us = ramp_plan(n, level)
+        if (profile, ramp_n, fastest_us) in seen or ramp_n < 1:
+          continue
+        seen.add((profile, ramp_n, fastest_us))
+        tables.append((profile, ramp_n, fastest_us, slowest_us, ramp_table(profile, ramp_n, fastest_us, slowest_us)))
+  return tables
+
+
+def main(args=sys.argv):
+  parser = argparse.ArgumentParser(description='Generate bit-depth and stepper ramp lookup tables')
+  sub = parser.add_subparsers(dest='cmd')
+  sub.add_parser('bits', help='8 to 5/6 bit tables for src/main.rs')
+
+  ramp_p = sub.add_parser('ramp', help='Step-delay ramp tables')
+  ramp_p.add_argument('--profile', default='sine', help=f'Comma separated, of {",".join(RAMP_PROFILES)}')
+  ramp_p.add_argument('--lengths', default=f'{motion_profile.RAMP_UP_STEPS * 2}', help='Move lengths in steps; short moves get their own shorter ramp')
+  ramp_p.add_argument('--slowest-us', type=int, default=motion_profile.SLOWEST_US)
+  ramp_p.add_argument('--format', choices=['zig', 'rust', 'bin'], default='zig')
+  ramp_p.add_argument('--output', default=None, help='Default stdout (required for bin)')
+
+  analyze_p = sub.add_parser('analyze', help='Move time, peak step rate, acceleration and jerk per profile')
+  analyze_p.add_argument('--profile', default=','.join(RAMP_PROFILES))
+  analyze_p.add_argument('--bin', default=None, help='Analyze tables from a ramp --format bin file instead')
+  analyze_p.add_argument('--lengths', default='1000,14200,40600,466000')
+  analyze_p.add_argument('--slowest-us', type=int, default=motion_profile.SLOWEST_US)
+  analyze_p.add_argument('--step-overhead-us', type=float, default=motion_profile.STEP_OVERHEAD_US)
+  opts = parser.parse_args(args[1:])
+
+  # Units: steps/s, steps/s^2, steps/s^3
+  if opts.cmd is None or opts.cmd == 'bits':
+    print('8 to 5 bits:')
+    gen_table(256, 2 ** 5)
+
+    print('8 to 6 bits:')
+    gen_table(256, 2 ** 6)
+    return 0
+
+  levels = (motion_profile.LOW, motion_profile.HIGH)
+  lengths = parse_lengths(opts.lengths)
+
+  if opts.cmd == 'ramp':
+    tables = build_tables(opts.profile.split(','), lengths, levels, opts.slowest_us)
+    if opts.format == 'bin':
+      if opts.output is None:
+        print('--format bin needs --output')
+        return 1
+      b = ramp_tables_to_bin(tables)
+      with open(opts.output, 'wb') as fd:
+        fd.write(b)
+      print(f'Wrote {len(tables)} tables, {len(b)} bytes to {opts.output}')
+      return 0
+    source = ramp_tables_to_source(tables, opts.format)
+    if opts.output is None:
+      print(source)
+    else:
+      with open(opts.output, 'w') as fd:
+        fd.write(source)
+      print(f'Wrote {len(tables)} tables to {opts.output}')
+    return 0
+
+  # analyze
+  if opts.bin is not None:
+    with open(opts.bin, 'rb') as fd:
+      tables = ramp_tables_from_bin(fd.read())
+  else:
+    tables = build_tables(opts.profile.split(','), lengths, levels, opts.slowest_us)
+  by_key = {(profile, ramp_n, fastest_us): (table, slowest_us) for profile, ramp_n, fastest_us, slowest_us, table in tables}
+  profiles = list(dict.fromkeys(t[0] for t in tables))
+  print(f'{"profile":>12} {"steps":>7} {"driven":>7} {"dir":>4} {"seconds":>9} {"vs step_n":>9} {"peak steps/s":>12} {"peak accel":>11} {"peak jerk":>11}')
+  for profile in profiles:
+    for n in lengths:
+      for level in levels:
+        ramp_n, fastest_us = ramp_plan(n, level)
+        table, slowest_us = by_key.get((profile, ramp_n, fastest_us), (None, opts.slowest_us))
+        if table is None and ramp_n > 0:
+          continue
+        delays = move_delays_us(table if table is not None else numpy.zeros((0, ), dtype=numpy.uint16), n, fastest_us)
+        exact_delays = move_delays_us(ramp_profile_us(profile, ramp_n, fastest_us, slowest_us), n, fastest_us)
+        stats = analyze_delays(delays, exact_delays, opts.step_overhead_us)
+        # Against the model webserver.py predicts ETAs with; sine should be ~0
+        baseline_s = motion_profile.step_n_us(n, level, opts.step_overhead_us) / 1e6
+        print(f'{profile:>12} {n:>7} {stats["steps"]:>7} {"HIGH" if level == motion_profile.HIGH else "LOW":>4} {stats["seconds"]:>9.3f} {stats["seconds"] - baseline_s:>+9.3f} {stats["peak_rate"]:>12.0f} {stats["peak_accel"]:>11.3g} {stats["peak_jerk"]:>11.3g}')
+  return 0
+
 
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+# Binary command ring in a memory-mapped file (CMD_FILE, /mnt/usb1/cmd.bin), so a command from
+# gpio_motor_webui.py is a few stores into a page the controller already has mapped instead of
+# a spool file that has to be created, found by a directory scan and parsed as text.
+#
+# Layout (little-endian, default C alignment, mirrored by extern structs on the controller side):
+#   CmdRingHeader   magic, version, num_slots, record_size, head, tail   (padded to HEADER_BYTES)
+#   CmdRecord * num_slots
+#
+# One producer (the web UI) and one consumer (the controller). The producer only writes head
+# and the records, the consumer only writes tail. head and tail are sequence numbers that only
+# grow; record seq lives in slot seq % num_slots. The producer fills a record, stores its seq
+# last, then bumps head; the consumer trusts a record only if its seq is the one it expected.
+# A full ring refuses the command rather than overwriting one that has not been run yet.
+#
+# Run directly for a stand-in consumer that prints what the controller would do, or to push
+# one command by hand:
+#
+#   python cmd_ring.py consume --cmd-file /tmp/cmd.bin
+#   python cmd_ring.py push move 3 --cmd-file /tmp/cmd.bin
+#   python cmd_ring.py push jog -400 --cmd-file /tmp/cmd.bin
+#
+
+import os
+import sys
+import time
+import mmap
+import ctypes
+import argparse
+import traceback
+
+CMD_FILE = "/mnt/usb1/cmd.bin"
+
+CMD_RING_MAGIC = 0x31444D43 # b'CMD1'
+CMD_RING_VERSION = 1
+DEFAULT_NUM_SLOTS = 64
+HEADER_BYTES = 64
+# The controller's main loop ticks every 6ms; the stand-in consumer polls at the same rate
+CONSUMER_POLL_S = 0.006
+
+# Opcodes, one per thing the keypad/dial can ask the controller for
+CMD_NOP = 0
+CMD_MOVE_TO_POSITION = 1 # arg = position 1..12, same as typing N + enter
+CMD_JOG = 2              # arg = signed steps, + is towards position 0 like a clockwise dial click
+CMD_SET_STEP_SIZE = 3    # arg = dial steps per click 1..800, same as typing 1000+N + enter
+CMD_SAVE_POSITION = 4    # arg unused, same as pressing the dial down / '='
+CMD_STOP = 5             # arg unused, same as escape
+
+CMD_NAMES = {
+  CMD_NOP: 'nop',
+  CMD_MOVE_TO_POSITION: 'move',
+  CMD_JOG: 'jog',
+  CMD_SET_STEP_SIZE: 'step_size',
+  CMD_SAVE_POSITION: 'save_position',
+  CMD_STOP: 'stop',
+}
+CMD_OPCODES = {name: op for op, name in CMD_NAMES.items()}
+
+# Checked before a command goes into the ring; the controller re-checks anyway
+MAX_POSITION = 12
+MAX_JOG_STEPS = 20000
+MAX_STEP_SIZE = 800
+
+
+class CmdRingHeader(ctypes.Structure):
+  _fields_ = [
+    ('magic', ctypes.c_uint32),
+    ('version', ctypes.c_uint32),
+    ('num_slots', ctypes.c_uint32),
+    ('record_size', ctypes.c_uint32),
+    ('head', ctypes.c_uint64), # next seq the producer will write
+    ('tail', ctypes.c_uint64), # next seq the consumer will run
+  ]
+
+class CmdRecord(ctypes.Structure):
+  _fields_ = [
+    ('seq', ctypes.c_uint64),
+    ('op', ctypes.c_uint32),
+    ('arg', ctypes.c_int32),
+    ('issued_us', ctypes.c_uint64), # CLOCK_REALTIME, for queue latency
+  ]
+
+assert ctypes.sizeof(CmdRingHeader) <= HEADER_BYTES and ctypes.sizeof(CmdRecord) == 24
+
+
+def check_command(op, arg):
+  # Returns an error string, or None if (op, arg) is something the controller accepts
+  if op == CMD_MOVE_TO_POSITION and not (1 <= arg <= MAX_POSITION):
+    return f'position must be 1..{MAX_POSITION}, not {arg}'
+  if op == CMD_JOG and not (0 < abs(arg) <= MAX_JOG_STEPS):
+    return f'jog must be 1..{MAX_JOG_STEPS} steps either way, not {arg}'
+  if op == CMD_SET_STEP_SIZE and not (1 <= arg <= MAX_STEP_SIZE):
+    return f'step size must be 1..{MAX_STEP_SIZE}, not {arg}'
+  if op not in CMD_NAMES or op == CMD_NOP:
+    return f'unknown op {op}'
+  return None
+
+
+class CommandRing:
+  def __init__(self, path=CMD_FILE, num_slots=DEFAULT_NUM_SLOTS):
+    size = HEADER_BYTES + num_slots * ctypes.sizeof(CmdRecord)
+    self.path = path
+    self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+    if os.fstat(self.fd).st_size < size:
+      os.ftruncate(self.fd, size)
+    self.mm = mmap.mmap(self.fd, size)
+    self.header = CmdRingHeader.from_buffer(self.mm, 0)
+    h = self.header
+    if h.magic != CMD_RING_MAGIC or h.version != CMD_RING_VERSION or h.num_slots != num_slots or h.record_size != ctypes.sizeof(CmdRecord):
+      print(f'Initialising command ring {path} with {num_slots} slots')
+      ctypes.memset(ctypes.addressof(h), 0, size)
+      h.num_slots = num_slots
+      h.record_size = ctypes.sizeof(CmdRecord)
+      h.version = CMD_RING_VERSION
+      h.magic = CMD_RING_MAGIC
+    self.num_slots = num_slots
+    self.records = (CmdRecord * num_slots).from_buffer(self.mm, HEADER_BYTES)
+    # Counters
+    self.num_pushed = 0
+    self.num_full = 0
+    self.num_consumed = 0
+
+  def pending(self):
+    return self.header.head - self.header.tail
+
+  # Producer side
+
+  def push(self, op, arg=0):
+    # Returns the command's seq, or None if the consumer is num_slots commands behind
+    h = self.header
+    seq = h.head
+    if seq - h.tail >= self.num_slots:
+      self.num_full += 1
+      return None
+    r = self.records[seq % self.num_slots]
+    r.op = op
+    r.arg = arg
+    r.issued_us = time.time_ns() // 1000
+    r.seq = seq
+    h.head = seq + 1
+    self.num_pushed += 1
+    return seq
+
+  # Consumer side
+
+  def pop(self):
+    # Returns the next CmdRecord (a copy) or None
+    h = self.header
+    seq = h.tail
+    if seq >= h.head:
+      return None
+    r = CmdRecord.from_buffer_copy(self.records[seq % self.num_slots])
+    h.tail = seq + 1
+    if r.seq != seq:
+      print(f'Command slot {seq % self.num_slots} holds seq {r.seq}, expected {seq}; skipped')
+      return None
+    self.num_consumed += 1
+    return r
+
+  def close(self):
+    # ctypes views pin the mmap, drop them before closing it
+    self.header = None
+    self.records = None
+    self.mm.close()
+    os.close(self.fd)
+
+
+def format_record(r):
+  latency_ms = (time.time_ns() // 1000 - r.issued_us) / 1000.0
+  return f'#{r.seq} {CMD_NAMES.get(r.op, r.op)} {r.arg} (queued {latency_ms:.1f}ms)'
+
+
+def consume_forever(ring):
+  # Stand-in for the controller: runs nothing, tracks where the table would be
+  step_position = 0
+  step_size = 40
+  while True:
+    r = ring.pop()
+    if r is None:
+      time.sleep(CONSUMER_POLL_S)
+      continue
+    if r.op == CMD_JOG:
+      step_position -= r.arg
+    elif r.op == CMD_SET_STEP_SIZE:
+      step_size = r.arg
+    print(f'{format_record(r)}  step_position={step_position} step_size={step_size}')
+
+
+def main(args=sys.argv):
+  parser = argparse.ArgumentParser(description='Push to or consume from the controller command ring')
+  parser.add_argument('mode', choices=['consume', 'push'])
+  parser.add_argument('command', nargs='?', choices=sorted(CMD_OPCODES.keys()))
+  parser.add_argument('arg', nargs='?', type=int, default=0)
+  parser.add_argument('--cmd-file', default=CMD_FILE)
+  opts = parser.parse_args(args[1:])
+
+  ring = CommandRing(opts.cmd_file)
+  if opts.mode == 'push':
+    op = CMD_OPCODES.get(opts.command, CMD_NOP)
+    error = check_command(op, opts.arg)
+    if error is not None:
+      print(error)
+      return 1
+    seq = ring.push(op, opts.arg)
+    print(f'Pushed #{seq}' if seq is not None else f'Command ring full ({ring.pending()} pending)')
+    return 0 if seq is not None else 1
+
+  print(f'Consuming {opts.cmd_file}, {ring.pending()} pending')
+  try:
+    consume_forever(ring)
+  except KeyboardInterrupt:
+    pass
+  except:
+    traceback.print_exc()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
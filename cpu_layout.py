@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+
+# Which cores and scheduling priority each of webserver.py's threads runs with, applied with
+# os.sched_setaffinity / os.setpriority / os.sched_setscheduler per thread id instead of one
+# `taskset -cp 0,1,2` for the whole process. CPU 3 stays free for gpio-motor-control, which pins
+# its busy-wait step loop there (PREFERRED_CPU in gpio-motor-control.zig).
+#
+# Roles:
+#   process    every thread that exists when webserver.py starts, and the mask new threads inherit
+#   http       the event loop thread with --vision-process, where it only serves HTTP
+#   combined   the event loop thread without --vision-process: HTTP plus capture, detection and JPEG
+#              encoding, and OpenCV's worker threads inherit its mask, so it keeps every non-controller core
+#   vision     the --vision-process worker's main thread: capture, detection, JPEG encoding
+#   camera     multi_camera.py's extra camera threads
+#   executor   the event loop's default executor (camera probing, log flushes)
+#
+# Each role takes cpus (list), nice (int) and policy ('other', 'batch', 'idle', 'fifo', 'rr') with
+# priority for fifo/rr. Override any of them in CPU_LAYOUT_FILE (env CPU_LAYOUT_FILE), eg
+#
+#   {"vision": {"cpus": [2], "nice": -10}, "executor": {"nice": 10}}
+#
+# Cores this process is not allowed to use are dropped from a role; failures (no root for a negative
+# nice, a single-core dev box) are logged and counted, never fatal. A spawned child (the vision worker)
+# starts on the mask of the thread that started it, so it adopt()s the parent's allowed_cpus instead
+# of reading its own; check that with
+#
+#   python cpu_layout.py --check-spawn
+#
+# Capture-interval jitter with the loaders and the capture thread unpinned, pinned apart (affinity only),
+# and pinned with the 'vision' role's priority on top:
+#
+#   python cpu_layout.py --bench --seconds 10 --load 3
+#
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import traceback
+import multiprocessing
+
+CPU_LAYOUT_FILE = os.environ.get('CPU_LAYOUT_FILE', '/mnt/usb1/webserver-cpu-layout.json')
+# Keep in sync with PREFERRED_CPU in gpio-motor-control.zig
+CONTROLLER_CPU = 3
+DEFAULT_LAYOUT = {
+  'process': {'cpus': [0, 1, 2]},
+  'http': {'cpus': [0], 'nice': 0},
+  'combined': {'cpus': [0, 1, 2], 'nice': 0},
+  'vision': {'cpus': [1], 'nice': -5},
+  'camera': {'cpus': [1, 2], 'nice': 0},
+  'executor': {'cpus': [0, 2], 'nice': 5},
+}
+POLICIES = {
+  'other': getattr(os, 'SCHED_OTHER', 0),
+  'batch': getattr(os, 'SCHED_BATCH', 3),
+  'idle': getattr(os, 'SCHED_IDLE', 5),
+  'fifo': getattr(os, 'SCHED_FIFO', 1),
+  'rr': getattr(os, 'SCHED_RR', 2),
+}
+
+
+class CpuLayout:
+  def __init__(self, layout=None, allowed_cpus=None):
+    self.layout = {role: dict(settings) for role, settings in DEFAULT_LAYOUT.items()}
+    for role, settings in (layout or {}).items():
+      self.layout.setdefault(role, {}).update(settings)
+    self.allowed_cpus = set(os.sched_getaffinity(0) if allowed_cpus is None else allowed_cpus)
+    self.lock = threading.Lock()
+    self.applied = {} # tid -> (role, thread name, description)
+    # Counters
+    self.num_applied = 0
+    self.num_failed = 0
+
+  @classmethod
+  def load(cls, path=CPU_LAYOUT_FILE):
+    layout = None
+    try:
+      if os.path.exists(path):
+        with open(path, 'r') as fd:
+          layout = json.load(fd)
+    except:
+      traceback.print_exc()
+    return cls(layout)
+
+  def adopt(self, allowed_cpus):
+    # In a spawned child: resolve roles against the parent's process-wide set, not the (eg 'http') mask
+    # of the parent thread this process inherited
+    self.allowed_cpus = set(allowed_cpus)
+
+  def cpus_for(self, role):
+    wanted = set(self.layout.get(role, {}).get('cpus', self.layout['process']['cpus']))
+    cpus = wanted & self.allowed_cpus
+    # Nothing of the role's cores is usable here, run anywhere we may rather than fail
+    return cpus if len(cpus) > 0 else set(self.allowed_cpus)
+
+  def apply(self, role, tid=None):
+    # Applies role to a thread (default the calling one); returns a description of what was set
+    tid = threading.get_native_id() if tid is None else tid
+    settings = self.layout.get(role, {})
+    done = []
+    errors = []
+    try:
+      cpus = self.cpus_for(role)
+      os.sched_setaffinity(tid, cpus)
+      done.append(f'cpus {sorted(cpus)}')
+    except OSError as e:
+      errors.append(f'affinity: {e}')
+    policy = settings.get('policy', None)
+    if policy is not None:
+      try:
+        priority = int(settings.get('priority', 0)) if policy in ('fifo', 'rr') else 0
+        os.sched_setscheduler(tid, POLICIES[policy], os.sched_param(priority))
+        done.append(f'{policy} {priority}')
+      except (OSError, KeyError) as e:
+        errors.append(f'policy {policy}: {e}')
+    if 'nice' in settings:
+      try:
+        # Linux keeps nice per thread, PRIO_PROCESS with a tid sets just that thread
+        os.setpriority(os.PRIO_PROCESS, tid, int(settings['nice']))
+        done.append(f'nice {settings["nice"]}')
+      except OSError as e:
+        errors.append(f'nice {settings["nice"]}: {e}')
+    description = ', '.join(done + [f'FAILED {e}' for e in errors])
+    with self.lock:
+      name = threading.current_thread().name if tid == threading.get_native_id() else str(tid)
+      self.applied[tid] = (role, name, description)
+      self.num_applied += 1
+      self.num_failed += 1 if len(errors) > 0 else 0
+    if len(errors) > 0:
+      print(f'CPU layout {role} for thread {tid}: {description}')
+    return description
+
+  def apply_process(self):
+    # Every thread of this process so far, then the calling thread keeps the process mask too
+    for tid in sorted(int(t) for t in os.listdir('/proc/self/task')):
+      self.apply('process', tid)
+
+  def thread_initializer(self, role):
+    # For ThreadPoolExecutor(initializer=...)
+    def initializer():
+      self.apply(role)
+    return initializer
+
+  def render_prometheus(self, prefix):
+    lines = [
+      f'# TYPE {prefix}_cpu_layout_applied_total counter',
+      f'{prefix}_cpu_layout_applied_total {self.num_applied}',
+      f'# TYPE {prefix}_cpu_layout_failed_total counter',
+      f'{prefix}_cpu_layout_failed_total {self.num_failed}',
+    ]
+    return '\n'.join(lines) + '\n'
+
+  def stats_s(self):
+    with self.lock:
+      lines = [f'allowed cpus {sorted(self.allowed_cpus)} (controller on {CONTROLLER_CPU}), {self.num_applied} applied, {self.num_failed} with failures']
+      for tid, (role, name, description) in sorted(self.applied.items()):
+        lines.append(f'  {tid} {name}: {role}: {description}')
+    return os.linesep.join(lines)
+
+
+# Spawned-child check
+
+def spawned_cpus_for(allowed_cpus, role, queue):
+  # What a spawned child resolves role to, set up like webserver.vision_process_main()
+  layout = CpuLayout.load()
+  inherited = sorted(layout.allowed_cpus)
+  layout.adopt(allowed_cpus)
+  queue.put((inherited, sorted(layout.cpus_for(role))))
+
+def check_spawn(allowed_cpus, parent_role='http', role='vision'):
+  # The parent pins its thread to parent_role first, like webserver.py does before it starts the worker
+  parent = CpuLayout(allowed_cpus=allowed_cpus)
+  parent.apply(parent_role)
+  expect = sorted(parent.cpus_for(role))
+  ctx = multiprocessing.get_context('spawn')
+  queue = ctx.Queue()
+  p = ctx.Process(target=spawned_cpus_for, args=(sorted(parent.allowed_cpus), role, queue))
+  p.start()
+  inherited, got = queue.get(timeout=30)
+  p.join()
+  print(f'parent allowed {sorted(parent.allowed_cpus)}, {parent_role} -> {sorted(parent.cpus_for(parent_role))}; child inherited {inherited}, {role} -> {got} (expected {expect})')
+  ok = got == expect
+  print('OK' if ok else 'FAILED')
+  return 0 if ok else 1
+
+
+# Jitter benchmark
+
+def load_worker(cpus, stop_at):
+  # Pure CPU load in its own process, so it competes for cores and not for our GIL
+  if cpus is not None:
+    os.sched_setaffinity(0, cpus)
+  x = 0
+  while time.monotonic() < stop_at:
+    for i in range(0, 10000):
+      x += i * i
+
+def capture_intervals(interval_s, seconds, layout, mode, role='vision'):
+  # Sleeps to each frame deadline like a camera read loop does, returns the actual intervals
+  if mode == 'pinned':
+    # Cores only, so the comparison with 'unpinned' is not mixed up with the role's nice/policy
+    os.sched_setaffinity(0, layout.cpus_for(role))
+  elif mode == 'pinned+prio':
+    layout.apply(role)
+  intervals = []
+  next_s = time.monotonic() + interval_s
+  last_s = time.monotonic()
+  stop_at = last_s + seconds
+  while last_s < stop_at:
+    time.sleep(max(0.0, next_s - time.monotonic()))
+    now = time.monotonic()
+    intervals.append(now - last_s)
+    last_s = now
+    next_s += interval_s
+  return intervals
+
+def summarize(intervals, interval_s):
+  n = len(intervals)
+  mean = sum(intervals) / n
+  stdev = (sum((x - mean) ** 2 for x in intervals) / n) ** 0.5
+  ordered = sorted(intervals)
+  late = sum(1 for x in intervals if x > interval_s + 0.002)
+  return f'{n} frames, mean {mean*1000:.2f}ms, stdev {stdev*1000:.3f}ms, p99 {ordered[int(0.99*(n-1))]*1000:.2f}ms, max {ordered[-1]*1000:.2f}ms, {late} over +2ms'
+
+def bench(seconds, interval_s, num_load, layout):
+  # pinned+prio runs last, it changes this thread's priority for good
+  results = {}
+  capture_cpus = layout.cpus_for('vision')
+  for mode in ('unpinned', 'pinned', 'pinned+prio'):
+    stop_at = time.monotonic() + seconds + 0.5
+    # Pinned: the loaders stay off the capture core whenever there is another core to put them on
+    load_cpus = None
+    if mode != 'unpinned':
+      load_cpus = (layout.allowed_cpus - capture_cpus) or set(layout.allowed_cpus)
+    ctx = multiprocessing.get_context('spawn')
+    loaders = [ctx.Process(target=load_worker, args=(load_cpus, stop_at), daemon=True) for _ in range(0, num_load)]
+    for p in loaders:
+      p.start()
+    time.sleep(0.2)
+    intervals = capture_intervals(interval_s, seconds, layout, mode)
+    for p in loaders:
+      p.join()
+    results[mode] = summarize(intervals, interval_s)
+    detail = ''
+    if mode == 'pinned':
+      detail = f' (capture on {sorted(capture_cpus)}, load on {sorted(load_cpus)})'
+    elif mode == 'pinned+prio':
+      detail = f' (vision role: {layout.applied.get(threading.get_native_id(), (None, None, None))[2]})'
+    print(f'{mode:>11}: {results[mode]}{detail}')
+  return results
+
+
+def main(args=sys.argv):
+  parser = argparse.ArgumentParser(description='Show or benchmark the per-thread CPU layout')
+  parser.add_argument('--layout-file', default=CPU_LAYOUT_FILE)
+  parser.add_argument('--bench', action='store_true', help='Capture-interval jitter, unpinned vs pinned')
+  parser.add_argument('--seconds', type=float, default=10.0)
+  parser.add_argument('--interval-ms', type=float, default=33.3, help='Frame interval of the simulated capture loop')
+  parser.add_argument('--load', type=int, default=3, help='CPU-bound loader processes')
+  parser.add_argument('--check-spawn', action='store_true', help="Check a spawned worker resolves 'vision' against the parent's cores")
+  parser.add_argument('--allowed-cpus', default=None, help='For --check-spawn, the parent\'s cores as on the Pi (default 0,1,2,3)')
+  opts = parser.parse_args(args[1:])
+
+  if opts.check_spawn:
+    # Default to the Pi's four cores, so the check means the same on a dev box with fewer
+    allowed_cpus = [int(c) for c in (opts.allowed_cpus or '0,1,2,3').split(',')]
+    return check_spawn(allowed_cpus)
+
+  layout = CpuLayout.load(opts.layout_file)
+  if opts.bench:
+    print(f'{len(layout.allowed_cpus)} allowed cpus {sorted(layout.allowed_cpus)}, {opts.load} loaders, {opts.interval_ms}ms frames for {opts.seconds}s each')
+    bench(opts.seconds, opts.interval_ms / 1000.0, opts.load, layout)
+    return 0
+
+  for role, settings in layout.layout.items():
+    print(f'{role:>9}: {settings} -> cpus {sorted(layout.cpus_for(role))}')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
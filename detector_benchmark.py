@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+# Headless benchmark of every rail_detector backend over the research-photos corpus.
+# Results are checked against research-photos/golden.json so a speedup cannot quietly
+# change what the table does; output is JSON so runs can be diffed/compared.
+#
+#   python detector_benchmark.py                       # all backends, all photos
+#   python detector_benchmark.py --backend numpy-lut --iterations 200 --output /tmp/bench.json
+#   python detector_benchmark.py --update-golden       # after an intended detector change
+#
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+
+import rail_detector
+
+import cv2
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS_GLOBS = [
+  os.path.join(REPO_DIR, 'research-photos', '*.png'),
+  os.path.join(REPO_DIR, 'research-photos', '*.jpg'),
+]
+DEFAULT_GOLDEN_FILE = os.path.join(REPO_DIR, 'research-photos', 'golden.json')
+
+
+def golden_entry(result):
+  return {
+    'rail_px_diff': result.rail_px_diff,
+    'table_rail_idxs': list(result.table_rail_idxs) if result.table_rail_idxs is not None else None,
+    'layout_rail_idxs': list(result.layout_rail_idxs) if result.layout_rail_idxs is not None else None,
+  }
+
+def percentile(sorted_values, q):
+  if len(sorted_values) < 1:
+    return None
+  i = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+  return sorted_values[i]
+
+def benchmark_backend(name, frames, iterations, warmup):
+  detector = rail_detector.get_detector(name)
+
+  for _ in range(0, warmup):
+    for _f_name, img in frames:
+      detector.detect(img)
+
+  latencies_s = []
+  start = time.perf_counter()
+  for _ in range(0, iterations):
+    for _f_name, img in frames:
+      t0 = time.perf_counter()
+      detector.detect(img)
+      latencies_s.append(time.perf_counter() - t0)
+  total_s = time.perf_counter() - start
+  latencies_s.sort()
+
+  # Separate pass, tracemalloc slows everything down; only sees python + numpy allocations, not cv2's.
+  tracemalloc.start()
+  outputs = {}
+  for f_name, img in frames:
+    outputs[f_name] = golden_entry(detector.detect(img))
+  _current, peak_bytes = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  return {
+    'frames': len(latencies_s),
+    'frames_per_s': len(latencies_s) / total_s if total_s > 0 else None,
+    'p50_ms': percentile(latencies_s, 0.50) * 1000.0,
+    'p99_ms': percentile(latencies_s, 0.99) * 1000.0,
+    'max_ms': latencies_s[-1] * 1000.0,
+    'peak_traced_bytes': peak_bytes,
+  }, outputs
+
+def compare_to_golden(outputs, golden):
+  mismatches = []
+  for f_name, entry in outputs.items():
+    if not f_name in golden:
+      mismatches.append({'file': f_name, 'error': 'missing from golden file'})
+    elif golden[f_name] != entry:
+      mismatches.append({'file': f_name, 'expected': golden[f_name], 'actual': entry})
+  return mismatches
+
+
+def main(args=sys.argv):
+  parser = argparse.ArgumentParser(description='Benchmark rail_detector backends over a photo corpus')
+  parser.add_argument('photos', nargs='*', help='Images to run; defaults to research-photos/*.png and *.jpg')
+  parser.add_argument('--backend', action='append', help=f'Backend(s) to run, default all of {list(rail_detector.DETECTOR_BACKENDS.keys())}')
+  parser.add_argument('--iterations', type=int, default=int(os.environ.get('ITERATIONS', '50')))
+  parser.add_argument('--warmup', type=int, default=3)
+  parser.add_argument('--golden', default=DEFAULT_GOLDEN_FILE)
+  parser.add_argument('--update-golden', action='store_true', help='Write the python reference backend output as the new golden file')
+  parser.add_argument('--output', default=None, help='Write JSON results here instead of stdout')
+  opts = parser.parse_args(args[1:])
+
+  photo_files = opts.photos
+  if len(photo_files) < 1:
+    for g in DEFAULT_CORPUS_GLOBS:
+      photo_files.extend(glob.glob(g))
+  photo_files = sorted(photo_files)
+
+  frames = []
+  for f in photo_files:
+    img = cv2.imread(f, cv2.IMREAD_COLOR)
+    if img is None:
+      print(f'Cannot read {f}, skipping', file=sys.stderr)
+      continue
+    frames.append((os.path.basename(f), img))
+  if len(frames) < 1:
+    print('No frames to benchmark!', file=sys.stderr)
+    return 1
+
+  if opts.update_golden:
+    reference = rail_detector.get_detector('python')
+    golden = {f_name: golden_entry(reference.detect(img)) for f_name, img in frames}
+    with open(opts.golden, 'w') as fd:
+      json.dump(golden, fd, indent=2, sort_keys=True)
+      fd.write('\n')
+    print(f'Wrote {len(golden)} golden results to {opts.golden}', file=sys.stderr)
+
+  golden = None
+  if os.path.exists(opts.golden):
+    with open(opts.golden, 'r') as fd:
+      golden = json.load(fd)
+
+  backend_names = opts.backend if opts.backend else list(rail_detector.DETECTOR_BACKENDS.keys())
+  report = {
+    'timestamp': time.time(),
+    'host': platform.node(),
+    'machine': platform.machine(),
+    'python': platform.python_version(),
+    'opencv': cv2.__version__,
+    'num_frames': len(frames),
+    'iterations': opts.iterations,
+    'backends': {},
+  }
+  all_ok = True
+  for name in backend_names:
+    stats, outputs = benchmark_backend(name, frames, opts.iterations, opts.warmup)
+    if golden is not None:
+      stats['golden_mismatches'] = compare_to_golden(outputs, golden)
+      all_ok = all_ok and len(stats['golden_mismatches']) < 1
+    report['backends'][name] = stats
+  report['golden_ok'] = all_ok if golden is not None else None
+
+  report_s = json.dumps(report, indent=2)
+  if opts.output:
+    with open(opts.output, 'w') as fd:
+      fd.write(report_s + '\n')
+  else:
+    print(report_s)
+
+  for name, stats in report['backends'].items():
+    print(f'{name:>12} {stats["frames_per_s"]:9.1f} frames/s  p50 {stats["p50_ms"]:.3f}ms  p99 {stats["p99_ms"]:.3f}ms  peak {stats["peak_traced_bytes"]/1024.0:.0f}KiB  golden mismatches {len(stats.get("golden_mismatches", []))}', file=sys.stderr)
+
+  return 0 if all_ok else 1
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+# Fixed-memory ring of the last N ROI crops and what webserver.py decided about each one,
+# so when automove misbehaves the evidence is still around.
+#
+# Every array is allocated once in __init__; record() only copies into existing slots.
+# Dump with SIGUSR2 or GET /admin/flight-recorder (both write a compressed .npz under /tmp),
+# then feed the dump back through the detector with
+#
+#   python flight_recorder.py /tmp/flight-recorder-<time>.npz [--backend python]
+#
+# rail_x1_diff / rail_px_diff are the detector's own result for the recorded crop, which is what a
+# replay can reproduce; acted_px_diff is what automove was given after template alignment and camera
+# fusion. Frames the static-scene gate skipped carry no detection and are not compared.
+#
+
+import os
+import sys
+import json
+import time
+import dataclasses
+
+import rail_detector
+import pipeline_metrics
+
+import numpy
+
+DEFAULT_CAPACITY = 150
+DUMP_DIR = '/tmp'
+
+# What do_automove_with_rail_px_diff decided for a frame
+AUTOMOVE_DECISIONS = (
+  'not-run',
+  'no-rail',
+  'limit',
+  'moving',
+  'settled',
+  'disabled',
+  'move-115',
+  'move-114',
+  'error',
+)
+AUTOMOVE_DECISION_CODES = {name: i for i, name in enumerate(AUTOMOVE_DECISIONS)}
+
+# Stored in integer columns when a value is None
+NONE_IDX = -1
+NONE_DIFF = numpy.iinfo(numpy.int32).min
+
+
+class FlightRecorder:
+  def __init__(self, geometry, capacity=DEFAULT_CAPACITY):
+    self.geometry = geometry
+    self.capacity = capacity
+    self.crops = numpy.zeros((capacity, geometry.crop_h, geometry.crop_w, 3), dtype=numpy.uint8)
+    self.frame_num = numpy.zeros((capacity, ), dtype=numpy.int64)
+    self.t = numpy.zeros((capacity, ), dtype=numpy.float64)
+    self.analysed = numpy.zeros((capacity, ), dtype=numpy.bool_)
+    self.alpha = numpy.zeros((capacity, ), dtype=numpy.float32)
+    self.beta = numpy.zeros((capacity, ), dtype=numpy.float32)
+    # table_x1, table_x2, layout_x1, layout_x2
+    self.rail_idxs = numpy.full((capacity, 4), NONE_IDX, dtype=numpy.int16)
+    self.rail_x1_diff = numpy.full((capacity, ), NONE_DIFF, dtype=numpy.int32)
+    self.rail_px_diff = numpy.full((capacity, ), NONE_DIFF, dtype=numpy.int32)
+    self.acted_px_diff = numpy.full((capacity, ), NONE_DIFF, dtype=numpy.int32)
+    self.automove = numpy.zeros((capacity, ), dtype=numpy.int8)
+    self.stage_s = numpy.zeros((capacity, len(pipeline_metrics.PIPELINE_STAGES)), dtype=numpy.float32)
+    self.num_recorded = 0
+
+  def record(self, frame_num, img, detection, analysed, acted_px_diff, stage_s):
+    # Returns the slot so the automove decision can be filled in once it is made.
+    # detection is this frame's RailDetection, None when the frame was not analysed.
+    i = self.num_recorded % self.capacity
+    g = self.geometry
+    numpy.copyto(self.crops[i], img[g.crop_y:g.crop_y+g.crop_h, g.crop_x:g.crop_x+g.crop_w])
+    self.frame_num[i] = frame_num
+    self.t[i] = time.time()
+    self.analysed[i] = analysed
+    self.automove[i] = 0
+    self.rail_idxs[i] = NONE_IDX
+    self.alpha[i] = 0.0
+    self.beta[i] = 0.0
+    self.rail_x1_diff[i] = NONE_DIFF
+    self.rail_px_diff[i] = NONE_DIFF
+    if detection is not None:
+      self.alpha[i] = detection.alpha
+      self.beta[i] = detection.beta
+      if detection.table_rail_idxs is not None:
+        self.rail_idxs[i, 0] = detection.table_rail_idxs[0]
+        self.rail_idxs[i, 1] = detection.table_rail_idxs[1]
+      if detection.layout_rail_idxs is not None:
+        self.rail_idxs[i, 2] = detection.layout_rail_idxs[0]
+        self.rail_idxs[i, 3] = detection.layout_rail_idxs[1]
+      if detection.rail_x1_diff is not None:
+        self.rail_x1_diff[i] = detection.rail_x1_diff
+      if detection.rail_px_diff is not None:
+        self.rail_px_diff[i] = detection.rail_px_diff
+    self.acted_px_diff[i] = NONE_DIFF if acted_px_diff is None else acted_px_diff
+    for j, stage in enumerate(pipeline_metrics.PIPELINE_STAGES):
+      self.stage_s[i, j] = stage_s.get(stage, 0.0)
+    self.num_recorded += 1
+    return i
+
+  def set_automove(self, slot, decision):
+    self.automove[slot] = AUTOMOVE_DECISION_CODES.get(decision, AUTOMOVE_DECISION_CODES['error'])
+
+  def snapshot(self):
+    # Oldest first. Fancy indexing copies, so the ring can keep recording while the copy is written out.
+    n = min(self.num_recorded, self.capacity)
+    order = numpy.arange(self.num_recorded - n, self.num_recorded) % self.capacity
+    return {
+      'crops': self.crops[order],
+      'frame_num': self.frame_num[order],
+      't': self.t[order],
+      'analysed': self.analysed[order],
+      'alpha': self.alpha[order],
+      'beta': self.beta[order],
+      'rail_idxs': self.rail_idxs[order],
+      'rail_x1_diff': self.rail_x1_diff[order],
+      'rail_px_diff': self.rail_px_diff[order],
+      'acted_px_diff': self.acted_px_diff[order],
+      'automove': self.automove[order],
+      'stage_s': self.stage_s[order],
+      'stages': numpy.array(pipeline_metrics.PIPELINE_STAGES),
+      'automove_decisions': numpy.array(AUTOMOVE_DECISIONS),
+      'geometry': numpy.array(json.dumps(dataclasses.asdict(self.geometry))),
+    }
+
+  def dump(self, path=None):
+    return write_snapshot(self.snapshot(), path)
+
+
+def default_dump_path():
+  return os.path.join(DUMP_DIR, f'flight-recorder-{time.strftime("%Y%m%d-%H%M%S")}.npz')
+
+def write_snapshot(snapshot, path=None):
+  # Compressing ~20MB of crops takes a while on a Pi, webserver.py runs this in an executor
+  if path is None:
+    path = default_dump_path()
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'wb') as fd:
+    numpy.savez_compressed(fd, **snapshot)
+  os.replace(tmp_path, path)
+  print(f'Flight recorder dumped {len(snapshot["frame_num"])} frames to {path}')
+  return path
+
+
+def replay(dump_path, backend_name=None):
+  # Runs every recorded crop through a detector and prints where it disagrees with what was recorded
+  with numpy.load(dump_path) as npz:
+    # Every NpzFile lookup decompresses the whole member again; load each one once, not per frame
+    dump = {k: npz[k] for k in npz.files}
+  geometry = rail_detector.RailGeometry(**json.loads(str(dump['geometry'])))
+  # Crops are already cropped; move the geometry to crop-space
+  crop_geometry = dataclasses.replace(geometry,
+    frame_w=geometry.crop_w,
+    frame_h=geometry.crop_h,
+    crop_x=0,
+    crop_y=0,
+    table_rail_y=geometry.crop_table_rail_y,
+    layout_rail_y=geometry.crop_layout_rail_y,
+  )
+  detector = rail_detector.get_detector(backend_name, geometry=crop_geometry)
+  decisions = [str(d) for d in dump['automove_decisions']]
+  num_frames = len(dump['frame_num'])
+  # Dumps from before acted_px_diff stored the acted-on value in rail_px_diff
+  acted_column = 'acted_px_diff' if 'acted_px_diff' in dump else 'rail_px_diff'
+  num_mismatches = 0
+  num_compared = 0
+  print(f'{"frame":>8} {"t":>10} {"analysed":>8} {"recorded":>9} {"replayed":>9} {"acted":>6} {"automove":>10}')
+  for i in range(0, num_frames):
+    analysed = bool(dump['analysed'][i])
+    acted = int(dump[acted_column][i])
+    acted = None if acted == NONE_DIFF else acted
+    recorded = None
+    replayed = None
+    marker = ''
+    if analysed:
+      result = detector.detect(dump['crops'][i])
+      recorded = int(dump['rail_px_diff'][i])
+      recorded = None if recorded == NONE_DIFF else recorded
+      replayed = result.rail_px_diff
+      num_compared += 1
+      if recorded != replayed:
+        num_mismatches += 1
+        marker = ' <-- differs'
+    print(f'{int(dump["frame_num"][i]):>8} {float(dump["t"][i]) % 100000.0:>10.2f} {analysed!s:>8} {recorded!s:>9} {replayed!s:>9} {acted!s:>6} {decisions[int(dump["automove"][i])]:>10}{marker}')
+  print(f'{num_mismatches} of {num_compared} analysed frames ({num_frames} recorded) replay differently with backend {detector.backend_name}')
+  return num_mismatches
+
+
+if __name__ == '__main__':
+  if len(sys.argv) < 2:
+    print(f'Usage: {sys.argv[0]} /tmp/flight-recorder-<time>.npz [--backend python|numpy|numpy-lut]')
+    sys.exit(1)
+  backend_name = None
+  if '--backend' in sys.argv:
+    backend_name = sys.argv[sys.argv.index('--backend') + 1]
+  replay(sys.argv[1], backend_name)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+# Builds the /video frame (camera image on top, rail debug panel under it) in one preallocated
+# canvas instead of allocating a resize, a vconcat and a copy per frame. The camera frame is
+# decoded straight into the top of the canvas and the debug panel is resized into the bottom.
+#
+# Run directly to check per-frame allocations of the whole capture -> detect -> compose -> encode
+# path with tracemalloc (exits 1 if memory keeps growing):
+#
+#   python frame_compositor.py --frames 500
+#
+
+import sys
+import time
+import argparse
+import tracemalloc
+
+import rail_detector
+import frame_sources
+
+import cv2
+import numpy
+
+# The debug panel is drawn 640x380 under a 640 wide frame, and scaled with the frame width
+DEBUG_PANEL_W = 640
+DEBUG_PANEL_H = 380
+MULTIPART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+MULTIPART_TRAILER = b'\r\n'
+
+
+def encode_multipart_jpeg(img):
+  # One immutable bytes per frame, shared by every /video client. It is not written into a reused
+  # buffer on purpose: a slow client's transport may still hold the previous frame.
+  # cv2.imencode has no output argument, so its buffer is the one allocation we cannot reuse.
+  ok, jpeg = cv2.imencode('.jpg', img)
+  if not ok:
+    return None
+  return b''.join((MULTIPART_HEADER, jpeg.data, MULTIPART_TRAILER))
+
+
+class FrameCompositor:
+  def __init__(self):
+    self.canvas = None
+    self.frame = None
+    self.debug = None
+    self.num_allocations = 0
+
+  def ensure_canvas(self, frame_w, frame_h):
+    if self.frame is not None and self.frame.shape[1] == frame_w and self.frame.shape[0] == frame_h:
+      return
+    debug_h = (frame_w * DEBUG_PANEL_H) // DEBUG_PANEL_W
+    self.canvas = numpy.zeros((frame_h + debug_h, frame_w, 3), dtype=numpy.uint8)
+    # Row slices of a C-contiguous array are contiguous, so OpenCV accepts them as dst=
+    self.frame = self.canvas[:frame_h]
+    self.debug = self.canvas[frame_h:]
+    self.num_allocations += 1
+    print(f'Allocated {frame_w}x{frame_h + debug_h} frame canvas')
+
+  def frame_view(self, frame_w, frame_h):
+    # Where the next camera frame should be decoded to, see FrameSource.retrieve(out=)
+    if frame_w < 1 or frame_h < 1:
+      return None
+    self.ensure_canvas(frame_w, frame_h)
+    return self.frame
+
+  def place_frame(self, img):
+    # Returns the canvas' view of img; only copies when the source could not decode in place
+    # (first frame, or the source changed size).
+    if self.frame is not None and img is self.frame:
+      return img
+    img_h, img_w = img.shape[:2]
+    self.ensure_canvas(img_w, img_h)
+    numpy.copyto(self.frame, img)
+    return self.frame
+
+  def place_debug(self, debug_img):
+    debug_h, debug_w = self.debug.shape[:2]
+    cv2.resize(debug_img, (debug_w, debug_h), dst=self.debug)
+
+  def draw_border(self, color):
+    canvas_h, canvas_w = self.canvas.shape[:2]
+    cv2.rectangle(self.canvas, (1, 1), (canvas_w-2, canvas_h-2), color=color, thickness=4)
+
+  def encode(self):
+    return encode_multipart_jpeg(self.canvas)
+
+
+def check_allocations(num_frames, warmup_frames, spec, backend_name=None):
+  # The same calls webserver.py's read_video_t makes per frame, minus the HTTP side
+  source = frame_sources.open_frame_source(spec)
+  geometry = rail_detector.RailGeometry().scaled_to(source.width, source.height)
+  detector = rail_detector.get_detector(backend_name, geometry=geometry)
+  gate = rail_detector.StaticSceneGate(geometry)
+  compositor = FrameCompositor()
+  debug_render = numpy.zeros((geometry.crop_h, geometry.crop_w, 3), dtype=numpy.uint8)
+  debug_cache = numpy.zeros_like(debug_render)
+
+  def one_frame(frame_num):
+    source.grab()
+    img = compositor.place_frame(source.retrieve(out=compositor.frame_view(source.width, source.height)))
+    cv2.putText(img, f'{frame_num % 1000}', (10, source.height-20), cv2.FONT_HERSHEY_SIMPLEX, 1, (240, 240, 240), 2, cv2.LINE_AA)
+    if gate.should_analyse(img, force=(frame_num % 2 == 0)):
+      result = detector.scan(detector.adjust(img))
+      detector.render_debug(result, out=debug_render)
+      numpy.copyto(debug_cache, debug_render)
+    else:
+      numpy.copyto(debug_render, debug_cache)
+    compositor.place_debug(debug_render)
+    compositor.draw_border((0, 255, 0))
+    return compositor.encode()
+
+  for i in range(0, warmup_frames):
+    one_frame(i)
+
+  tracemalloc.start()
+  start_bytes, _ = tracemalloc.get_traced_memory()
+  tracemalloc.reset_peak()
+  t0 = time.perf_counter()
+  encoded_frame_bytes = 0
+  for i in range(0, num_frames):
+    encoded_frame_bytes = len(one_frame(i))
+  elapsed_s = time.perf_counter() - t0
+  end_bytes, peak_bytes = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  source.release()
+  return {
+    'frames': num_frames,
+    'ms_per_frame': elapsed_s * 1000.0 / num_frames,
+    'growth_bytes': end_bytes - start_bytes,
+    'growth_bytes_per_frame': (end_bytes - start_bytes) / num_frames,
+    # Roughly one encoded frame in flight plus small per-frame temporaries
+    'peak_bytes_above_start': peak_bytes - start_bytes,
+    'encoded_frame_bytes': encoded_frame_bytes,
+    'canvas_allocations': compositor.num_allocations,
+  }
+
+
+def main(args=sys.argv):
+  parser = argparse.ArgumentParser(description='Check per-frame allocations of the capture/compose/encode path')
+  parser.add_argument('--frames', type=int, default=300)
+  parser.add_argument('--warmup', type=int, default=20)
+  parser.add_argument('--frame-source', default='synthetic:offset=8,noise=4,fps=0,seed=1')
+  parser.add_argument('--backend', default=None)
+  parser.add_argument('--max-growth-per-frame', type=float, default=64.0, help='Bytes; above this the check fails')
+  opts = parser.parse_args(args[1:])
+
+  stats = check_allocations(opts.frames, opts.warmup, opts.frame_source, opts.backend)
+  for k, v in stats.items():
+    print(f'{k:>24} {v:.3f}' if isinstance(v, float) else f'{k:>24} {v}')
+  if stats['growth_bytes_per_frame'] > opts.max_growth_per_frame or stats['canvas_allocations'] > 1:
+    print(f'FAIL: memory grows {stats["growth_bytes_per_frame"]:.1f} bytes/frame (limit {opts.max_growth_per_frame})')
+    return 1
+  print('OK')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,213 @@
+
+# Shared-memory ring of finished frames, written by the vision worker process and read by the
+# HTTP process when webserver.py runs with --vision-process (or VISION_PROCESS=1).
+#
+# Layout of the multiprocessing.shared_memory block:
+#   header     RING_HEADER, then padding to HEADER_BYTES
+#   slot 0..N  SLOT_HEADER (padded to SLOT_HEADER_BYTES), raw BGR frame (raw_capacity bytes),
+#              the JPEG as a complete multipart/x-mixed-replace part (part_capacity bytes)
+#
+# One writer, any number of readers, no locks. Each slot is a seqlock: the writer stores seq in
+# seq_begin, writes the payload, then stores seq in seq_end and finally bumps latest_seq.
+# A reader copies the payload out and only trusts it if both seq fields still equal the seq it
+# asked for. With several slots the writer is a few frames away from the slot being read anyway.
+
+import os
+import time
+import struct
+from multiprocessing import shared_memory
+
+import pipeline_metrics
+
+import numpy
+
+RING_MAGIC = b'TTFR'
+RING_VERSION = 1
+DEFAULT_NUM_SLOTS = 4
+# Slots are sized for the largest frame we expect; tmpfs only backs the pages that get written
+DEFAULT_RAW_CAPACITY = 1920 * 1080 * 3
+DEFAULT_PART_CAPACITY = 1024 * 1024
+
+# magic, version, num_slots, raw_capacity, part_capacity, latest_seq, template_capture_spool_num, writer_pid, writer_heartbeat_s, automove_count, move_expected_end_s
+RING_HEADER = struct.Struct('<4sIIIIQiIdId')
+HEADER_BYTES = 64
+# Each process only ever writes its own header fields, one at a time, never the whole header
+LATEST_SEQ_FIELD = (struct.Struct('<Q'), 20)       # written by the worker
+TEMPLATE_CAPTURE_FIELD = (struct.Struct('<i'), 28) # set by the HTTP process, cleared by the worker
+WRITER_PID_FIELD = (struct.Struct('<I'), 32)       # worker
+WRITER_HEARTBEAT_FIELD = (struct.Struct('<d'), 36) # worker
+AUTOMOVE_COUNT_FIELD = (struct.Struct('<I'), 44)   # worker, corrections sent so the HTTP process can log them
+MOVE_EXPECTED_END_FIELD = (struct.Struct('<d'), 48) # HTTP process, predicted end of a move it sent
+# seq_begin, seq_end, frame_num, t, rail_px_diff, flags, alpha, beta, 4 rail idxs, width, height, part_len, stage seconds
+SLOT_HEADER = struct.Struct('<QQqdiIff4hIII' + ('f' * len(pipeline_metrics.PIPELINE_STAGES)))
+SLOT_HEADER_BYTES = 128
+
+FLAG_ANALYSED = 1
+FLAG_HAS_RAIL_PX_DIFF = 2
+FLAG_PLACEHOLDER = 4
+NO_TEMPLATE_CAPTURE = -1
+NONE_IDX = -1
+
+assert RING_HEADER.size <= HEADER_BYTES and SLOT_HEADER.size <= SLOT_HEADER_BYTES
+
+
+class SharedFrameRing:
+  def __init__(self, shm, owner):
+    self.shm = shm
+    self.owner = owner
+    self.buf = shm.buf
+    magic, version, self.num_slots, self.raw_capacity, self.part_capacity, _, _, _, _, _, _ = RING_HEADER.unpack_from(self.buf, 0)
+    if magic != RING_MAGIC or version != RING_VERSION:
+      raise Exception(f'{shm.name} is not a version {RING_VERSION} frame ring')
+    self.slot_bytes = SLOT_HEADER_BYTES + self.raw_capacity + self.part_capacity
+    self.next_seq = self.latest_seq() + 1
+
+  @classmethod
+  def create(cls, name=None, num_slots=DEFAULT_NUM_SLOTS, raw_capacity=DEFAULT_RAW_CAPACITY, part_capacity=DEFAULT_PART_CAPACITY):
+    size = HEADER_BYTES + num_slots * (SLOT_HEADER_BYTES + raw_capacity + part_capacity)
+    shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    RING_HEADER.pack_into(shm.buf, 0, RING_MAGIC, RING_VERSION, num_slots, raw_capacity, part_capacity, 0, NO_TEMPLATE_CAPTURE, 0, 0.0, 0, 0.0)
+    return cls(shm, owner=True)
+
+  @classmethod
+  def attach(cls, name):
+    # track=False: the creating process owns the block, the resource tracker must not unlink it when we exit
+    try:
+      shm = shared_memory.SharedMemory(name=name, create=False, track=False)
+    except TypeError:
+      # python < 3.13 has no track argument
+      shm = shared_memory.SharedMemory(name=name, create=False)
+    return cls(shm, owner=False)
+
+  @property
+  def name(self):
+    return self.shm.name
+
+  def header(self):
+    return RING_HEADER.unpack_from(self.buf, 0)
+
+  def get_field(self, field):
+    s, offset = field
+    return s.unpack_from(self.buf, offset)[0]
+
+  def set_field(self, field, value):
+    s, offset = field
+    s.pack_into(self.buf, offset, value)
+
+  def latest_seq(self):
+    return self.get_field(LATEST_SEQ_FIELD)
+
+  def writer_pid(self):
+    return self.get_field(WRITER_PID_FIELD)
+
+  def writer_heartbeat_s(self):
+    return self.get_field(WRITER_HEARTBEAT_FIELD)
+
+  def automove_count(self):
+    return self.get_field(AUTOMOVE_COUNT_FIELD)
+
+  def slot_offset(self, seq):
+    return HEADER_BYTES + (seq % self.num_slots) * self.slot_bytes
+
+  # Written by the HTTP process, consumed by the worker
+
+  def request_template_capture(self, spool_num):
+    # spool_num names the key spool file (<spool_num>.txt) holding the '='; the worker resolves the slot
+    # from pmem once the controller has read it
+    self.set_field(TEMPLATE_CAPTURE_FIELD, spool_num)
+
+  def take_template_capture(self):
+    spool_num = self.get_field(TEMPLATE_CAPTURE_FIELD)
+    if spool_num == NO_TEMPLATE_CAPTURE:
+      return None
+    self.set_field(TEMPLATE_CAPTURE_FIELD, NO_TEMPLATE_CAPTURE)
+    return spool_num
+
+  def set_move_expected_end_s(self, end_s):
+    self.set_field(MOVE_EXPECTED_END_FIELD, end_s)
+
+  def move_expected_end_s(self):
+    return self.get_field(MOVE_EXPECTED_END_FIELD)
+
+  # Writer side
+
+  def publish(self, frame_num, img, part, detection=None, analysed=False, rail_px_diff=None, stage_s=None, placeholder=False):
+    img_h, img_w = img.shape[:2]
+    if img.nbytes > self.raw_capacity or len(part) > self.part_capacity:
+      print(f'Frame ({img.nbytes} bytes raw, {len(part)} bytes jpeg) does not fit in frame ring slots of {self.raw_capacity} + {self.part_capacity} bytes, dropped')
+      return None
+    seq = self.next_seq
+    self.next_seq += 1
+    offset = self.slot_offset(seq)
+    SLOT_HEADER.pack_into(self.buf, offset, seq, 0, 0, 0.0, 0, 0, 0.0, 0.0, NONE_IDX, NONE_IDX, NONE_IDX, NONE_IDX, 0, 0, 0, *([0.0] * len(pipeline_metrics.PIPELINE_STAGES)))
+
+    raw_offset = offset + SLOT_HEADER_BYTES
+    raw = numpy.ndarray(img.shape, dtype=numpy.uint8, buffer=self.buf, offset=raw_offset)
+    numpy.copyto(raw, img)
+    part_offset = raw_offset + self.raw_capacity
+    self.buf[part_offset:part_offset + len(part)] = part
+
+    flags = (FLAG_ANALYSED if analysed else 0) | (FLAG_HAS_RAIL_PX_DIFF if rail_px_diff is not None else 0) | (FLAG_PLACEHOLDER if placeholder else 0)
+    idxs = [NONE_IDX] * 4
+    alpha = beta = 0.0
+    if detection is not None:
+      alpha, beta = detection.alpha, detection.beta
+      if detection.table_rail_idxs is not None:
+        idxs[0:2] = detection.table_rail_idxs
+      if detection.layout_rail_idxs is not None:
+        idxs[2:4] = detection.layout_rail_idxs
+    stages = [float((stage_s or {}).get(stage, 0.0)) for stage in pipeline_metrics.PIPELINE_STAGES]
+    SLOT_HEADER.pack_into(self.buf, offset, seq, seq, frame_num, time.time(), rail_px_diff or 0, flags, alpha, beta, *idxs, img_w, img_h, len(part), *stages)
+    self.set_field(LATEST_SEQ_FIELD, seq)
+    return seq
+
+  def count_automove(self):
+    self.set_field(AUTOMOVE_COUNT_FIELD, (self.automove_count() + 1) & 0xffffffff)
+
+  def heartbeat(self):
+    self.set_field(WRITER_PID_FIELD, os.getpid())
+    self.set_field(WRITER_HEARTBEAT_FIELD, time.time())
+
+  # Reader side
+
+  def read(self, seq, with_raw=False):
+    # Returns a dict with copies of slot seq, or None if it was overwritten before/while we read it
+    if seq < 1:
+      return None
+    offset = self.slot_offset(seq)
+    fields = SLOT_HEADER.unpack_from(self.buf, offset)
+    if fields[0] != seq or fields[1] != seq:
+      return None
+    _, _, frame_num, t, rail_px_diff, flags, alpha, beta, tx1, tx2, lx1, lx2, width, height, part_len = fields[:15]
+    raw_offset = offset + SLOT_HEADER_BYTES
+    part_offset = raw_offset + self.raw_capacity
+    frame = {
+      'seq': seq,
+      'frame_num': frame_num,
+      't': t,
+      'analysed': bool(flags & FLAG_ANALYSED),
+      'placeholder': bool(flags & FLAG_PLACEHOLDER),
+      'rail_px_diff': rail_px_diff if flags & FLAG_HAS_RAIL_PX_DIFF else None,
+      'alpha': alpha,
+      'beta': beta,
+      'table_rail_idxs': (tx1, tx2) if tx1 != NONE_IDX else None,
+      'layout_rail_idxs': (lx1, lx2) if lx1 != NONE_IDX else None,
+      'stage_s': dict(zip(pipeline_metrics.PIPELINE_STAGES, fields[15:])),
+      'part': bytes(self.buf[part_offset:part_offset + part_len]),
+    }
+    if with_raw:
+      frame['raw'] = numpy.ndarray((height, width, 3), dtype=numpy.uint8, buffer=self.buf, offset=raw_offset).copy()
+    # Re-check: the writer may have lapped us while we copied
+    seq_begin, seq_end = struct.unpack_from('<QQ', self.buf, offset)
+    if seq_begin != seq or seq_end != seq:
+      return None
+    return frame
+
+  def close(self):
+    self.buf = None
+    self.shm.close()
+    if self.owner:
+      try:
+        self.shm.unlink()
+      except FileNotFoundError:
+        pass
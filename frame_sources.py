@@ -0,0 +1,497 @@
+
+# Where webserver.py gets frames from. Lets the whole server run, and be benchmarked,
+# on any Linux box without the table camera.
+#
+# Selected with FRAME_SOURCE=<spec> or webserver.py --frame-source=<spec>, where spec is
+#   camera                       last working device from CAMERA_CACHE_FILE, then probe /dev/video* (default)
+#   camera:/dev/video2           one specific device
+#   replay:research-photos       loop a directory of .jpg/.png, or a recorded video file
+#   replay:table.mkv,fps=0       fps=0 replays as fast as possible
+#   synthetic:offset=12,noise=6  generated rail image; offset_file=/tmp/int_a follows a griffin dial
+#
+
+import os
+import sys
+import glob
+import json
+import time
+import traceback
+
+import rail_detector
+
+import cv2
+import numpy
+
+DEFAULT_FRAME_SOURCE = 'camera'
+DEFAULT_REPLAY_FPS = 20.0
+# Last camera device + format that delivered a frame, tried first on the next start
+CAMERA_CACHE_FILE = os.environ.get('CAMERA_CACHE_FILE', '/mnt/usb1/webserver-camera.json')
+
+
+class FrameSource:
+  # Same grab()/retrieve() split as cv2.VideoCapture so capture wait and decode can be timed apart.
+  name = 'frame-source'
+
+  def __init__(self, fps=None):
+    # None or 0 means as fast as possible
+    self.fps = fps
+    self.next_frame_s = 0.0
+    self.width = 0
+    self.height = 0
+
+  def open(self):
+    return self
+
+  def wait_s(self):
+    # Seconds until the next frame is due, callers should sleep this long (asynchronously) before grab()
+    if not self.fps:
+      return 0.0
+    return max(0.0, self.next_frame_s - time.monotonic())
+
+  def frame_delivered(self):
+    if self.fps:
+      now = time.monotonic()
+      self.next_frame_s = max(self.next_frame_s + (1.0 / self.fps), now - (1.0 / self.fps))
+
+  def grab(self):
+    raise NotImplementedError()
+
+  def retrieve(self, out=None):
+    # out is an optional preallocated image to decode into; callers must use the returned image,
+    # which is only out when it had the right shape.
+    raise NotImplementedError()
+
+  def read(self):
+    if not self.grab():
+      return False, None
+    img = self.retrieve()
+    return img is not None, img
+
+  def release(self):
+    pass
+
+  def __str__(self):
+    return f'{self.name} {self.width}x{self.height}'
+
+
+class OpenCVCaptureSource(FrameSource):
+  name = 'camera'
+
+  def __init__(self, device=None, width=rail_detector.FRAME_W, height=rail_detector.FRAME_H):
+    super().__init__(fps=None)
+    self.device = device
+    self.requested_width = width
+    self.requested_height = height
+    self.camera = None
+    self.cached = None
+    self.format_saved = False
+
+  def candidate_devices(self):
+    if self.device:
+      return [self.device]
+    devices = []
+    if self.cached is not None and os.path.exists(self.cached.get('device', '')):
+      devices.append(self.cached['device'])
+    # Only nodes that exist; opening all of /dev/video0..98 used to take seconds
+    video_nodes = sorted(glob.glob('/dev/video[0-9]*'), key=lambda d: int(d[len('/dev/video'):]) if d[len('/dev/video'):].isdigit() else 999)
+    devices.extend(d for d in video_nodes if not d in devices)
+    return devices
+
+  def open(self):
+    self.cached = load_camera_cache()
+    for device in self.candidate_devices():
+      try:
+        camera = cv2.VideoCapture(device)
+        if camera.isOpened():
+          self.camera = camera
+          self.device = device
+          break
+        camera.release()
+      except:
+        traceback.print_exc()
+
+    if self.camera is None and not self.device:
+      try:
+        self.camera = cv2.VideoCapture(-1) # auto-select "best"
+      except:
+        traceback.print_exc()
+
+    if self.camera is None or not self.camera.isOpened():
+      raise RuntimeError('Cannot open camera')
+
+    # Re-request the pixel format this device negotiated last time, saves the driver trying others
+    if self.cached is not None and self.cached.get('device', None) == self.device and self.cached.get('fourcc', 0):
+      self.camera.set(cv2.CAP_PROP_FOURCC, self.cached['fourcc'])
+    # Ask for the size rail_detector was measured at; anything else is handled by scaling its geometry.
+    self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.requested_width)
+    self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.requested_height)
+    self.width = int(self.camera.get(cv2.CAP_PROP_FRAME_WIDTH))
+    self.height = int(self.camera.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    return self
+
+  def grab(self):
+    grabbed = self.camera.grab()
+    if grabbed and not self.format_saved:
+      # Only remember a device once it has actually delivered a frame
+      self.format_saved = True
+      current = {
+        'device': str(self.device),
+        'fourcc': int(self.camera.get(cv2.CAP_PROP_FOURCC)),
+        'width': self.width,
+        'height': self.height,
+      }
+      if current != self.cached:
+        save_camera_cache(current)
+    return grabbed
+
+  def retrieve(self, out=None):
+    _, img = self.camera.retrieve(out)
+    return img
+
+  def release(self):
+    if self.camera is not None:
+      self.camera.release()
+      self.camera = None
+
+  def __str__(self):
+    return f'{self.name} {self.device} {self.width}x{self.height}'
+
+
+class ReplaySource(FrameSource):
+  # Loops a directory of images (decoded once up front) or a video file (decoded as we go).
+  name = 'replay'
+
+  def __init__(self, path, fps=DEFAULT_REPLAY_FPS):
+    super().__init__(fps=fps)
+    self.path = path
+    self.images = None
+    self.image_i = 0
+    self.video = None
+    self.pending = None
+
+  def open(self):
+    if os.path.isdir(self.path):
+      files = []
+      for pattern in ('*.jpg', '*.jpeg', '*.png'):
+        files.extend(glob.glob(os.path.join(self.path, pattern)))
+      self.images = [img for img in (cv2.imread(f, cv2.IMREAD_COLOR) for f in sorted(files)) if img is not None]
+      if len(self.images) < 1:
+        raise RuntimeError(f'No images found in {self.path}')
+      self.height, self.width = self.images[0].shape[:2]
+    else:
+      self.video = cv2.VideoCapture(self.path)
+      if not self.video.isOpened():
+        raise RuntimeError(f'Cannot open {self.path}')
+      self.width = int(self.video.get(cv2.CAP_PROP_FRAME_WIDTH))
+      self.height = int(self.video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    return self
+
+  def grab(self):
+    if self.images is not None:
+      self.pending = self.images[self.image_i]
+      self.image_i = (self.image_i + 1) % len(self.images)
+    else:
+      if not self.video.grab():
+        # Loop back to the start of the recording
+        self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        if not self.video.grab():
+          return False
+      self.pending = None
+    self.frame_delivered()
+    return True
+
+  def retrieve(self, out=None):
+    if self.images is not None:
+      # Callers draw on frames, never hand out the cached original
+      return copy_into(out, self.pending)
+    _, img = self.video.retrieve(out)
+    return img
+
+  def release(self):
+    if self.video is not None:
+      self.video.release()
+      self.video = None
+
+  def __str__(self):
+    return f'{self.name} {self.path} {self.width}x{self.height} @ {self.fps or "max"}fps'
+
+
+class SyntheticRailSource(FrameSource):
+  # Draws the table rails offset px to the right of the layout rails, in the rows rail_detector scans,
+  # plus gaussian noise. A detector reading this frame should report rail_x1_diff == -offset.
+  name = 'synthetic'
+
+  def __init__(self, offset=0.0, noise=4.0, fps=DEFAULT_REPLAY_FPS, offset_file=None, seed=None,
+               width=rail_detector.FRAME_W, height=rail_detector.FRAME_H):
+    super().__init__(fps=fps)
+    self.offset = float(offset)
+    self.noise = float(noise)
+    self.offset_file = offset_file
+    self.rng = numpy.random.default_rng(seed)
+    self.width = int(width)
+    self.height = int(height)
+    self.geometry = rail_detector.RailGeometry().scaled_to(self.width, self.height)
+    self.base = None
+    self.noise_buf = None
+    self.frame = None
+
+  def open(self):
+    self.base = numpy.empty((self.height, self.width, 3), dtype=numpy.float32)
+    self.noise_buf = numpy.empty((self.height, self.width, 3), dtype=numpy.float32)
+    self.frame = numpy.empty((self.height, self.width, 3), dtype=numpy.uint8)
+    return self
+
+  def current_offset(self):
+    if self.offset_file and os.path.exists(self.offset_file):
+      try:
+        with open(self.offset_file, 'r') as fd:
+          return float(fd.read().strip())
+      except:
+        traceback.print_exc()
+    return self.offset
+
+  def draw_base(self, offset):
+    g = self.geometry
+    self.base[:] = (60.0, 55.0, 50.0)
+    # Table and layout meet halfway between the two scanned rows
+    boundary_y = (g.table_rail_y + g.layout_rail_y) // 2
+    # Wide enough that rails are >10% of the crop, so the auto contrast stretch keeps them bright
+    rail_w = max(2, int(round(16 * g.frame_w / rail_detector.FRAME_W)))
+    layout_x1 = g.crop_x + (g.crop_w // 3)
+    for rail_x in (layout_x1, layout_x1 + g.rail_pair_width_px):
+      self.base[boundary_y:, rail_x - rail_w//2:rail_x + rail_w - rail_w//2] = (190.0, 200.0, 205.0)
+      table_x = int(round(rail_x + offset))
+      self.base[:boundary_y, max(0, table_x - rail_w//2):max(0, table_x + rail_w - rail_w//2)] = (190.0, 200.0, 205.0)
+
+  def grab(self):
+    self.draw_base(self.current_offset())
+    if self.noise > 0.0:
+      self.rng.standard_normal(dtype=numpy.float32, out=self.noise_buf)
+      self.noise_buf *= self.noise
+      self.noise_buf += self.base
+      numpy.clip(self.noise_buf, 0.0, 255.0, out=self.noise_buf)
+      self.frame[:] = self.noise_buf
+    else:
+      self.frame[:] = self.base
+    self.frame_delivered()
+    return True
+
+  def retrieve(self, out=None):
+    return copy_into(out, self.frame)
+
+  def __str__(self):
+    return f'{self.name} offset={self.offset} noise={self.noise} {self.width}x{self.height} @ {self.fps or "max"}fps'
+
+
+class CaptureSupervisor:
+  # Owns the frame source for webserver.py's reader: reopens it in-process with exponential backoff
+  # when it stops delivering, and keeps the numbers on how often and for how long that happens.
+  # Nothing here sleeps; the caller awaits backoff_s() and runs try_open() off the event loop.
+  # A failed open and a source dropped for empty reads both count as failures; only a good frame
+  # resets the count, so a camera that opens but never delivers still backs off and stays in outage.
+
+  def __init__(self, spec=None, backoff_initial_s=0.5, backoff_max_s=30.0, none_reads_before_reopen=3):
+    self.spec = spec
+    self.backoff_initial_s = backoff_initial_s
+    self.backoff_max_s = backoff_max_s
+    self.none_reads_before_reopen = none_reads_before_reopen
+    self.source = None
+    self.none_reads = 0
+    self.frames_since_open = 0
+    self.consecutive_failures = 0
+    self.outage_started_s = None # monotonic, None while frames are flowing
+    self.last_error = None
+    self.last_width = rail_detector.FRAME_W
+    self.last_height = rail_detector.FRAME_H
+    self.placeholder = None
+    # Counters for /metrics and /status
+    self.open_failures_total = 0
+    self.outages_total = 0
+    self.recoveries_total = 0
+    self.last_recovery_s = None
+    self.max_recovery_s = 0.0
+
+  def try_open(self):
+    # Blocking (camera probing), returns True once self.source is usable
+    try:
+      self.source = open_frame_source(self.spec)
+      self.none_reads = 0
+      self.frames_since_open = 0
+      return True
+    except:
+      self.last_error = traceback.format_exc(limit=1).strip().splitlines()[-1]
+      self.open_failures_total += 1
+      self.consecutive_failures += 1
+      if self.outage_started_s is None:
+        self.outage_started_s = time.monotonic()
+        self.outages_total += 1
+      print(f'Cannot open frame source (failure {self.consecutive_failures}): {self.last_error}')
+      return False
+
+  def frame_failed(self):
+    # A grab/retrieve came back empty; returns True when the source was dropped and must be reopened
+    self.none_reads += 1
+    if self.none_reads <= self.none_reads_before_reopen:
+      return False
+    print(f'Read None from {self.source} {self.none_reads} times, reopening')
+    self.last_error = f'{self.none_reads} empty reads'
+    self.release()
+    self.consecutive_failures += 1
+    if self.outage_started_s is None:
+      self.outage_started_s = time.monotonic()
+      self.outages_total += 1
+    return True
+
+  def frame_ok(self, img):
+    self.none_reads = 0
+    self.consecutive_failures = 0
+    self.frames_since_open += 1
+    self.last_height, self.last_width = img.shape[:2]
+    if self.outage_started_s is not None:
+      self.last_recovery_s = time.monotonic() - self.outage_started_s
+      self.max_recovery_s = max(self.max_recovery_s, self.last_recovery_s)
+      self.recoveries_total += 1
+      self.outage_started_s = None
+      print(f'Frame source recovered after {self.last_recovery_s:.1f}s')
+
+  def outage_s(self):
+    if self.outage_started_s is None:
+      return 0.0
+    return time.monotonic() - self.outage_started_s
+
+  def backoff_s(self):
+    # How long to wait before the next try_open(); 0 until something has failed
+    if self.consecutive_failures < 1:
+      return 0.0
+    n = self.consecutive_failures - 1
+    return min(self.backoff_max_s, self.backoff_initial_s * (2 ** min(n, 16)))
+
+  def render_placeholder(self, retry_in_s=None):
+    # Shown to /video clients while there is no camera, so their streams stay open
+    if self.placeholder is None or self.placeholder.shape[:2] != (self.last_height, self.last_width):
+      self.placeholder = numpy.empty((self.last_height, self.last_width, 3), dtype=numpy.uint8)
+    self.placeholder[:] = (40, 40, 40)
+    lines = ['CAMERA RECONNECTING', f'down {self.outage_s():.0f}s, {self.consecutive_failures} failures']
+    if retry_in_s is not None:
+      lines.append(f'next try in {retry_in_s:.0f}s')
+    if self.last_error:
+      lines.append(self.last_error[:48])
+    for i, line in enumerate(lines):
+      y = 40 + (i * 30)
+      cv2.putText(self.placeholder, line, (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.7 if i > 0 else 1.0, (0, 200, 255), 2 if i < 1 else 1, cv2.LINE_AA)
+    return self.placeholder
+
+  def release(self):
+    if self.source is not None:
+      try:
+        self.source.release()
+      except:
+        traceback.print_exc()
+      self.source = None
+
+  def render_prometheus(self, prefix):
+    lines = [
+      f'# TYPE {prefix}_camera_open_failures_total counter',
+      f'{prefix}_camera_open_failures_total {self.open_failures_total}',
+      f'# TYPE {prefix}_camera_outages_total counter',
+      f'{prefix}_camera_outages_total {self.outages_total}',
+      f'# TYPE {prefix}_camera_recoveries_total counter',
+      f'{prefix}_camera_recoveries_total {self.recoveries_total}',
+      f'# TYPE {prefix}_camera_outage_seconds gauge',
+      f'{prefix}_camera_outage_seconds {self.outage_s():.3f}',
+      f'# TYPE {prefix}_camera_max_recovery_seconds gauge',
+      f'{prefix}_camera_max_recovery_seconds {self.max_recovery_s:.3f}',
+    ]
+    if self.last_recovery_s is not None:
+      lines.append(f'# TYPE {prefix}_camera_last_recovery_seconds gauge')
+      lines.append(f'{prefix}_camera_last_recovery_seconds {self.last_recovery_s:.3f}')
+    return '\n'.join(lines) + '\n'
+
+  def stats_s(self):
+    s = f'frames since open {self.frames_since_open}, outages {self.outages_total}, recoveries {self.recoveries_total}, open failures {self.open_failures_total}'
+    if self.last_recovery_s is not None:
+      s += f', last recovery {self.last_recovery_s:.1f}s (max {self.max_recovery_s:.1f}s)'
+    if self.outage_started_s is not None:
+      s += f', DOWN for {self.outage_s():.0f}s: {self.last_error}'
+    return s
+
+
+def copy_into(out, img):
+  if out is not None and out.shape == img.shape and out.dtype == img.dtype:
+    numpy.copyto(out, img)
+    return out
+  return img.copy()
+
+def load_camera_cache():
+  try:
+    if os.path.exists(CAMERA_CACHE_FILE):
+      with open(CAMERA_CACHE_FILE, 'r') as fd:
+        return json.load(fd)
+  except:
+    traceback.print_exc()
+  return None
+
+def save_camera_cache(cache):
+  try:
+    tmp_file = CAMERA_CACHE_FILE + '.tmp'
+    with open(tmp_file, 'w') as fd:
+      json.dump(cache, fd)
+    os.replace(tmp_file, CAMERA_CACHE_FILE)
+    print(f'Saved camera {cache} to {CAMERA_CACHE_FILE}')
+  except:
+    # /mnt/usb1 is not mounted on dev machines
+    traceback.print_exc()
+
+
+def parse_frame_source_spec(spec):
+  # 'kind:positional,key=value,...' -> (kind, positional or None, {key: value})
+  kind, _, rest = spec.partition(':')
+  positional = None
+  options = {}
+  for part in [p for p in rest.split(',') if len(p) > 0]:
+    if '=' in part:
+      k, v = part.split('=', 1)
+      options[k.strip()] = v.strip()
+    elif positional is None:
+      positional = part
+    else:
+      raise Exception(f'Unexpected "{part}" in frame source spec "{spec}"')
+  return kind.strip().lower(), positional, options
+
+def open_frame_source(spec=None):
+  if spec is None:
+    spec = os.environ.get('FRAME_SOURCE', DEFAULT_FRAME_SOURCE)
+  kind, positional, options = parse_frame_source_spec(spec)
+  fps = float(options['fps']) if 'fps' in options else DEFAULT_REPLAY_FPS
+
+  if kind == 'camera':
+    source = OpenCVCaptureSource(device=positional or options.get('device', None))
+  elif kind == 'replay':
+    path = positional or options.get('path', None)
+    if path is None:
+      raise Exception(f'Replay frame source needs a path, eg "replay:research-photos"')
+    source = ReplaySource(path, fps=fps)
+  elif kind == 'synthetic':
+    source = SyntheticRailSource(
+      offset=float(options.get('offset', positional or 0.0)),
+      noise=float(options.get('noise', 4.0)),
+      fps=fps,
+      offset_file=options.get('offset_file', None),
+      seed=int(options['seed']) if 'seed' in options else None,
+      width=int(options.get('width', rail_detector.FRAME_W)),
+      height=int(options.get('height', rail_detector.FRAME_H)),
+    )
+  else:
+    raise Exception(f'Unknown frame source "{kind}", expected camera, replay or synthetic')
+
+  return source.open()
+
+
+if __name__ == '__main__':
+  # Quick look at what a source produces: python frame_sources.py synthetic:offset=12 /tmp/frame.jpg
+  source = open_frame_source(sys.argv[1] if len(sys.argv) > 1 else None)
+  ok, img = source.read()
+  print(f'{source}: read ok = {ok}')
+  if ok and len(sys.argv) > 2:
+    cv2.imwrite(sys.argv[2], img)
+  source.release()
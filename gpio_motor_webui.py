@@ -8,10 +8,21 @@ import asyncio
 import dataclasses
 import typing
 import ctypes
+import json
+import zlib
+import time
 
 PMEM_FILE = "/mnt/usb1/pmem.bin"
 CMD_FILE = "/mnt/usb1/cmd.bin"
+CMD_FILE = os.environ.get('CMD_FILE', CMD_FILE)
 num_positions = 12
+# stat() is cheap, the file is only read when its mtime/size moved
+PMEM_POLL_S = 0.25
+# mtime granularity is a kernel tick; a second write inside one tick keeps the same mtime, so
+# the file is read again (and the crc compared) until its mtime is this old
+PMEM_MTIME_SETTLE_S = 1.0
+# Messages queued per websocket before a slow client is dropped back to a fresh snapshot
+WS_QUEUE_MAX = 8
 
 python_libs_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '.py-env'))
 os.makedirs(python_libs_dir, exist_ok=True)
@@ -27,6 +38,8 @@ except:
 
 import aiohttp.web
 
+import cmd_ring
+
 @dataclasses.dataclass
 class PosDat(ctypes.Structure):
   _fields_ = [
@@ -46,19 +59,153 @@ class PMem(ctypes.Structure):
     return PMem.from_buffer_copy(b)
 
 
-async def background_t():
-  while True:
-    await asyncio.sleep(1)
-    #print('In background_t!')
-    p = await read_pmem()
-    #print(f'p.logical_position = {p.logical_position}')
-    #print(f'p.step_position = {p.step_position}')
-    #print(f'p.positions[2].step_position = {p.positions[2].step_position}')
-
-
+def flatten_ctypes(obj, prefix=''):
+  # PMem -> {'logical_position': 3, 'positions.2.step_position': 81700, ...}
+  fields = {}
+  for name, _field_type in obj._fields_:
+    value = getattr(obj, name)
+    key = f'{prefix}{name}'
+    if isinstance(value, ctypes.Structure):
+      fields.update(flatten_ctypes(value, f'{key}.'))
+    elif isinstance(value, ctypes.Array):
+      for i, item in enumerate(value):
+        if isinstance(item, ctypes.Structure):
+          fields.update(flatten_ctypes(item, f'{key}.{i}.'))
+        else:
+          fields[f'{key}.{i}'] = item
+    else:
+      fields[key] = value
+  return fields
+
+
+class PMemBroadcastHub:
+  # Watches PMEM_FILE and pushes only the fields that changed to every connected websocket.
+  # Messages are JSON built once per change and shared by all clients:
+  #   {"type": "snapshot", "v": 7, "fields": {...every field...}}   on connect / after falling behind
+  #   {"type": "delta", "v": 8, "fields": {"step_position": 40650}}
+  # v increases by one per change, so a client can tell it missed a delta.
+
+  def __init__(self, pmem_file=PMEM_FILE, queue_max=WS_QUEUE_MAX):
+    self.pmem_file = pmem_file
+    self.queue_max = queue_max
+    self.last_stat = None # (mtime_ns, size)
+    self.last_crc = None
+    self.fields = {}
+    self.version = 0
+    self.clients = {} # ws -> asyncio.Queue
+    # Counters
+    self.num_stats = 0
+    self.num_reads = 0
+    self.num_unchanged_reads = 0
+    self.num_deltas = 0
+    self.num_resyncs = 0
+
+  def poll(self):
+    self.num_stats += 1
+    try:
+      st = os.stat(self.pmem_file)
+    except FileNotFoundError:
+      return
+    stat_key = (st.st_mtime_ns, st.st_size)
+    if stat_key == self.last_stat:
+      return
+    with open(self.pmem_file, 'rb') as fd:
+      pmem_bytes = fd.read()
+    self.num_reads += 1
+    if len(pmem_bytes) < ctypes.sizeof(PMem):
+      return # caught the controller mid-write, look again next poll
+    if time.time_ns() - st.st_mtime_ns > PMEM_MTIME_SETTLE_S * 1e9:
+      self.last_stat = stat_key
+    crc = zlib.crc32(pmem_bytes)
+    if crc == self.last_crc:
+      self.num_unchanged_reads += 1 # rewritten with the same contents
+      return
+    self.last_crc = crc
+
+    new_fields = flatten_ctypes(PMem.from_bytes(pmem_bytes))
+    delta = {k: v for k, v in new_fields.items() if self.fields.get(k, None) != v}
+    self.fields = new_fields
+    if len(delta) > 0:
+      self.version += 1
+      self.num_deltas += 1
+      self.broadcast(json.dumps({'type': 'delta', 'v': self.version, 'fields': delta}, separators=(',', ':')))
+
+  def snapshot_message(self):
+    return json.dumps({'type': 'snapshot', 'v': self.version, 'fields': self.fields}, separators=(',', ':'))
+
+  def broadcast(self, message):
+    for q in self.clients.values():
+      self.enqueue(q, message)
+
+  def enqueue(self, q, message):
+    if q.full():
+      # This client is behind; its pending deltas are worth less than one fresh snapshot
+      self.num_resyncs += 1
+      while not q.empty():
+        q.get_nowait()
+      message = self.snapshot_message()
+    q.put_nowait(message)
+
+  def add_client(self, ws):
+    q = asyncio.Queue(maxsize=self.queue_max)
+    self.clients[ws] = q
+    q.put_nowait(self.snapshot_message())
+    return q
+
+  def remove_client(self, ws):
+    self.clients.pop(ws, None)
+
+  async def poll_t(self):
+    while True:
+      try:
+        self.poll()
+      except:
+        traceback.print_exc()
+      await asyncio.sleep(PMEM_POLL_S)
+
+
+pmem_hub = PMemBroadcastHub()
+pmem_hub_task = None
+command_ring = None
 
 async def on_startup(app_ref):
-  bg_t_task = asyncio.create_task(background_t())
+  global pmem_hub_task, command_ring
+  pmem_hub.poll() # first snapshot is ready before the first client connects
+  pmem_hub_task = asyncio.create_task(pmem_hub.poll_t())
+  try:
+    command_ring = cmd_ring.CommandRing(CMD_FILE)
+  except:
+    traceback.print_exc()
+    print(f'Commands are disabled, cannot map {CMD_FILE}')
+
+async def on_cleanup(app_ref):
+  if command_ring is not None:
+    command_ring.close()
+
+
+def send_command(msg):
+  # msg is a websocket JSON message like {"cmd": "move", "arg": 3}; returns the reply message
+  op = cmd_ring.CMD_OPCODES.get(msg.get('cmd', None), cmd_ring.CMD_NOP)
+  try:
+    arg = int(msg.get('arg', 0))
+  except (TypeError, ValueError):
+    arg = None
+  if op == cmd_ring.CMD_NOP:
+    error = f'unknown command {msg.get("cmd", None)}'
+  elif arg is None:
+    error = 'arg must be an integer'
+  else:
+    error = cmd_ring.check_command(op, arg)
+  if error is None and command_ring is None:
+    error = f'{CMD_FILE} is not mapped'
+  seq = None
+  if error is None:
+    seq = command_ring.push(op, arg)
+    if seq is None:
+      error = f'controller is {command_ring.pending()} commands behind'
+  if error is not None:
+    return json.dumps({'type': 'cmd_error', 'cmd': msg.get('cmd', None), 'error': error}, separators=(',', ':'))
+  return json.dumps({'type': 'cmd_ack', 'cmd': msg.get('cmd', None), 'seq': seq}, separators=(',', ':'))
 
 
 async def read_pmem():
@@ -77,9 +224,23 @@ async def index_handle(request):
   </head>
   <body>
     <h2>McAteer Transfer Table</h2>
-    <p>todo</p>
+    <pre id="pmem">Connecting...</pre>
+    <div id="positions"></div>
+    <button onclick="send_cmd('jog', 400)">Jog -400</button>
+    <button onclick="send_cmd('jog', -400)">Jog +400</button>
+    <pre id="cmd_status"></pre>
     <script>
 window.ws = null;
+window.pmem = {};
+window.pmem_v = -1;
+
+function render_pmem() {
+  var lines = ['logical_position = '+window.pmem['logical_position'], 'step_position = '+window.pmem['step_position']];
+  for (var i = 0; i < 12; i += 1) {
+    lines.push('Position '+(i+1)+' step_position = '+window.pmem['positions.'+i+'.step_position']);
+  }
+  document.getElementById('pmem').textContent = lines.join('\n');
+}
 
 function connect_ws() {
   if (window.ws != null && window.ws.readyState !== WebSocket.CLOSED) {
@@ -88,14 +249,39 @@ function connect_ws() {
   window.ws_url = window.location.origin.replace('http', 'ws')+'/ws';
   console.log('Connecting to '+window.ws_url);
   window.ws = new WebSocket(window.ws_url);
-  window.ws.addEventListener("open", (event) => {
-    window.ws.send("Hello Server!");
-  });
   window.ws.addEventListener("message", (event) => {
-    console.log("Message from server ", event.data);
+    var msg = JSON.parse(event.data);
+    if (msg.type == 'cmd_ack' || msg.type == 'cmd_error') {
+      document.getElementById('cmd_status').textContent = msg.type == 'cmd_ack' ? (msg.cmd+' queued as #'+msg.seq) : (msg.cmd+': '+msg.error);
+      return;
+    }
+    if (msg.type == 'delta' && msg.v != window.pmem_v + 1) {
+      window.ws.send('snapshot'); // missed one, ask for everything
+    }
+    if (msg.type == 'snapshot') {
+      window.pmem = {};
+    }
+    Object.assign(window.pmem, msg.fields);
+    window.pmem_v = msg.v;
+    render_pmem();
   });
 }
 
+function send_cmd(cmd, arg) {
+  if (window.ws == null || window.ws.readyState !== WebSocket.OPEN) {
+    document.getElementById('cmd_status').textContent = 'Not connected';
+    return;
+  }
+  window.ws.send(JSON.stringify({'cmd': cmd, 'arg': arg}));
+}
+
+for (var i = 1; i <= 12; i += 1) {
+  var b = document.createElement('button');
+  b.textContent = ''+i;
+  b.onclick = send_cmd.bind(null, 'move', i);
+  document.getElementById('positions').appendChild(b);
+}
+
 setInterval(connect_ws, 2000); // every 2 seconds, re-connect to websocket if not already connected
 
     </script>
@@ -103,21 +289,37 @@ setInterval(connect_ws, 2000); // every 2 seconds, re-connect to websocket if no
 </html>
 '''.strip(), content_type='text/html')
 
+async def websocket_sender_t(ws, q):
+  # One per socket, so a slow client only ever delays itself
+  while not ws.closed:
+    message = await q.get()
+    await ws.send_str(message)
+
 async def websocket_handle(request):
   ws = aiohttp.web.WebSocketResponse()
 
   await ws.prepare(request)
 
-  async for msg in ws:
-      if msg.type == aiohttp.WSMsgType.TEXT:
-          print(f'msg.data = {msg.data}')
-          if msg.data == 'close':
-              await ws.close()
-          else:
-              await ws.send_str(msg.data + '/answer')
-
-      elif msg.type == aiohttp.WSMsgType.ERROR:
-          print(f'ws connection closed with exception {ws.exception()}')
+  q = pmem_hub.add_client(ws)
+  sender_task = asyncio.create_task(websocket_sender_t(ws, q))
+  try:
+    async for msg in ws:
+        if msg.type == aiohttp.WSMsgType.TEXT:
+            if msg.data == 'close':
+                await ws.close()
+            elif msg.data == 'snapshot':
+                pmem_hub.enqueue(q, pmem_hub.snapshot_message())
+            elif msg.data.startswith('{'):
+                try:
+                  pmem_hub.enqueue(q, send_command(json.loads(msg.data)))
+                except:
+                  traceback.print_exc()
+
+        elif msg.type == aiohttp.WSMsgType.ERROR:
+            print(f'ws connection closed with exception {ws.exception()}')
+  finally:
+    pmem_hub.remove_client(ws)
+    sender_task.cancel()
 
   print('websocket connection closed')
 
@@ -131,6 +333,7 @@ def main(args=sys.argv):
 
   app = aiohttp.web.Application()
   app.on_startup.append(on_startup)
+  app.on_cleanup.append(on_cleanup)
   app.add_routes([
     aiohttp.web.get('/',           index_handle),
     aiohttp.web.get('/index.html', index_handle),
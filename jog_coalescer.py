@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+# Merges rapid dial clicks ('r' / 'l' from the web UI, knob bursts from midi_bridge.py) into one
+# spool command, so ten quick clicks are one file and one controller scan instead of ten.
+#
+#  - Clicks in the same direction accumulate while they keep arriving within window_s of each
+#    other; the command is sent window_s after the last click, or max_wait_s after the first so
+#    a held-down stream of clicks still moves the table.
+#  - A click in the other direction sends what is pending first (never nets them out, the user
+#    saw the table go one way and then asked for the other).
+#  - discard() drops pending clicks for an emergency stop.
+#
+# Counters and a histogram of click-to-table-stopped time are on /metrics. Compare coalesced and
+# one-command-per-click against the controller's spool scan offline with
+#
+#   python jog_coalescer.py --clicks 10 --interval-ms 80
+#
+
+import sys
+import time
+import asyncio
+import argparse
+
+import pipeline_metrics
+import motion_profile
+
+JOG_COALESCE_S = 0.25
+JOG_COALESCE_MAX_S = 1.0
+MAX_JOG_CLICKS = 200
+# The controller scans the key spool twice a second
+SPOOL_SCAN_S = 0.5
+# First click to the predicted end of the command's motion
+BURST_BUCKETS_S = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0)
+
+
+class JogCoalescer:
+  # send_jog(clicks) writes one command, + is clockwise ('r', keycode 115); called on the event loop
+
+  def __init__(self, send_jog, window_s=JOG_COALESCE_S, max_wait_s=JOG_COALESCE_MAX_S, max_clicks=MAX_JOG_CLICKS):
+    self.send_jog = send_jog
+    self.window_s = window_s
+    self.max_wait_s = max_wait_s
+    self.max_clicks = max_clicks
+    self.pending_clicks = 0
+    self.first_click_s = 0.0
+    self.timer = None
+    # Counters
+    self.clicks_total = 0
+    self.commands_total = 0
+    self.discarded_clicks_total = 0
+    self.flushes_total = {'window': 0, 'max_wait': 0, 'max_clicks': 0, 'reversal': 0}
+    self.burst_s = pipeline_metrics.RollingHistogram(buckets=BURST_BUCKETS_S)
+
+  def add(self, clicks):
+    if clicks == 0:
+      return
+    self.clicks_total += abs(clicks)
+    if self.pending_clicks != 0 and (self.pending_clicks > 0) != (clicks > 0):
+      self.flush('reversal')
+    now = time.monotonic()
+    if self.pending_clicks == 0:
+      self.first_click_s = now
+    self.pending_clicks += clicks
+    if abs(self.pending_clicks) >= self.max_clicks:
+      self.flush('max_clicks')
+      return
+    if self.window_s <= 0.0:
+      self.flush('window')
+      return
+    # Restart the quiet-period timer, but never past max_wait_s from the first click
+    if self.timer is not None:
+      self.timer.cancel()
+    deadline_s = self.first_click_s + self.max_wait_s
+    delay_s = min(self.window_s, max(0.0, deadline_s - now))
+    self.timer = asyncio.get_running_loop().call_later(delay_s, self.flush, 'window' if delay_s >= self.window_s else 'max_wait')
+
+  def flush(self, reason='window'):
+    if self.timer is not None:
+      self.timer.cancel()
+      self.timer = None
+    clicks = self.pending_clicks
+    if clicks == 0:
+      return
+    self.pending_clicks = 0
+    self.flushes_total[reason] += 1
+    self.commands_total += 1
+    waited_s = time.monotonic() - self.first_click_s
+    self.burst_s.observe(waited_s + motion_profile.CONTROLLER_PICKUP_S + command_motion_s(clicks))
+    self.send_jog(clicks)
+
+  def discard(self):
+    if self.timer is not None:
+      self.timer.cancel()
+      self.timer = None
+    self.discarded_clicks_total += abs(self.pending_clicks)
+    self.pending_clicks = 0
+
+  def render_prometheus(self, prefix):
+    lines = [
+      f'# TYPE {prefix}_jog_clicks_total counter',
+      f'{prefix}_jog_clicks_total {self.clicks_total}',
+      f'# TYPE {prefix}_jog_commands_total counter',
+      f'{prefix}_jog_commands_total {self.commands_total}',
+      f'# TYPE {prefix}_jog_discarded_clicks_total counter',
+      f'{prefix}_jog_discarded_clicks_total {self.discarded_clicks_total}',
+      f'# TYPE {prefix}_jog_flushes_total counter',
+    ]
+    for reason, n in self.flushes_total.items():
+      lines.append(f'{prefix}_jog_flushes_total{{reason="{reason}"}} {n}')
+    h = self.burst_s
+    lines.append(f'# HELP {prefix}_jog_burst_seconds First click of a command to the predicted end of its motion.')
+    lines.append(f'# TYPE {prefix}_jog_burst_seconds histogram')
+    cumulative = 0
+    for bound, c in zip(h.buckets, h.counts):
+      cumulative += c
+      lines.append(f'{prefix}_jog_burst_seconds_bucket{{le="{bound}"}} {cumulative}')
+    lines.append(f'{prefix}_jog_burst_seconds_bucket{{le="+Inf"}} {h.count}')
+    lines.append(f'{prefix}_jog_burst_seconds_sum {h.sum:.6f}')
+    lines.append(f'{prefix}_jog_burst_seconds_count {h.count}')
+    return '\n'.join(lines) + '\n'
+
+  def stats_s(self):
+    per_command = self.clicks_total / self.commands_total if self.commands_total > 0 else 0.0
+    return f'{self.clicks_total} clicks -> {self.commands_total} commands ({per_command:.1f} clicks/command), {self.discarded_clicks_total} discarded by stop, flushes {self.flushes_total}, {abs(self.pending_clicks)} pending'
+
+
+def command_motion_s(clicks):
+  # A dial click is steps_per_click step_once() calls with no ramp
+  return abs(clicks) * motion_profile.dial_duration_s()
+
+
+def simulate_controller(commands):
+  # commands: [(written_s, clicks)]. Each file waits for the next spool scan, then runs after the
+  # one before it; returns when the last one finishes.
+  done_s = 0.0
+  for written_s, clicks in commands:
+    picked_up_s = (int(written_s / SPOOL_SCAN_S) + 1) * SPOOL_SCAN_S
+    done_s = max(done_s, picked_up_s) + command_motion_s(clicks)
+  return done_s
+
+
+def main(args=sys.argv):
+  parser = argparse.ArgumentParser(description='Compare coalesced and per-click jog commands for a burst of clicks')
+  parser.add_argument('--clicks', type=int, default=10)
+  parser.add_argument('--interval-ms', type=float, default=80.0, help='Between clicks')
+  parser.add_argument('--reverse-at', type=int, default=None, help='Click index where direction flips')
+  parser.add_argument('--window-ms', type=float, default=JOG_COALESCE_S * 1000.0)
+  opts = parser.parse_args(args[1:])
+
+  clicks = [(-1 if opts.reverse_at is not None and i >= opts.reverse_at else 1) for i in range(0, opts.clicks)]
+
+  async def run(window_s):
+    sent = []
+    t0 = time.monotonic()
+    coalescer = JogCoalescer(lambda n: sent.append((time.monotonic() - t0, n)), window_s=window_s)
+    for c in clicks:
+      coalescer.add(c)
+      await asyncio.sleep(opts.interval_ms / 1000.0)
+    await asyncio.sleep(JOG_COALESCE_MAX_S + 0.1)
+    return sent
+
+  for name, window_s in (('per click', 0.0), ('coalesced', opts.window_ms / 1000.0)):
+    sent = asyncio.run(run(window_s))
+    print(f'{name:>10}: {len(sent):>3} commands {[n for _, n in sent]}, table stops {simulate_controller(sent):.2f}s after the first click')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
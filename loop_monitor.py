@@ -0,0 +1,165 @@
+
+# Event loop lag monitor for webserver.py.
+#
+#  - A heartbeat task sleeps HEARTBEAT_INTERVAL_S at a time and records how late it wakes up;
+#    that is the scheduling lag every other coroutine (video streams, e-stop POSTs) sees.
+#  - Every loop callback is timed the same way asyncio debug mode does it (around Handle._run),
+#    without the rest of debug mode's overhead. Callbacks over SLOW_CALLBACK_S are tallied per
+#    coroutine/callback name.
+#  - A watchdog thread grabs the loop thread's stack when a single callback has run longer than
+#    STALL_STACK_S, so we see *where* it blocked, not just that it did.
+#
+# Served as JSON on /admin/loop and appended to /metrics.
+
+import sys
+import time
+import asyncio
+import threading
+import traceback
+
+import pipeline_metrics
+
+HEARTBEAT_INTERVAL_S = 0.05
+SLOW_CALLBACK_S = 0.010
+STALL_STACK_S = 0.1
+WATCHDOG_POLL_S = 0.02
+# Repeat the log line for the same offender at most this often
+SLOW_CALLBACK_LOG_EVERY_S = 60.0
+MAX_OFFENDERS = 200
+MAX_RECENT_STALLS = 20
+
+LOOP_LAG_BUCKETS_S = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+active_monitor = None
+original_handle_run = asyncio.events.Handle._run
+
+def timed_handle_run(handle):
+  monitor = active_monitor
+  if monitor is None or monitor.loop is not handle._loop:
+    return original_handle_run(handle)
+  t0 = time.perf_counter()
+  monitor.current_handle = handle
+  monitor.current_started_s = t0
+  try:
+    return original_handle_run(handle)
+  finally:
+    monitor.current_handle = None
+    dt = time.perf_counter() - t0
+    if dt >= monitor.slow_callback_s:
+      monitor.record_slow_callback(handle, dt)
+
+
+def handle_name(handle):
+  callback = getattr(handle, '_callback', None)
+  owner = getattr(callback, '__self__', None)
+  if isinstance(owner, asyncio.Task):
+    coro = owner.get_coro()
+    return getattr(coro, '__qualname__', repr(coro))
+  return getattr(callback, '__qualname__', repr(callback))
+
+
+class LoopMonitor:
+  def __init__(self, slow_callback_s=SLOW_CALLBACK_S, stall_stack_s=STALL_STACK_S):
+    self.slow_callback_s = slow_callback_s
+    self.stall_stack_s = stall_stack_s
+    self.lag = pipeline_metrics.RollingHistogram(buckets=LOOP_LAG_BUCKETS_S)
+    self.max_lag_s = 0.0
+    self.loop = None
+    self.loop_thread_id = None
+    self.current_handle = None
+    self.current_started_s = 0.0
+    self.stack_captured_for = None
+    self.captured_stack = None
+    # name -> {'count', 'total_s', 'max_s', 'stack', 'last_logged_s'}
+    self.offenders = {}
+    self.recent_stalls = []
+    self.heartbeat_task = None
+
+  def install(self, loop):
+    global active_monitor
+    self.loop = loop
+    self.loop_thread_id = threading.get_ident()
+    active_monitor = self
+    asyncio.events.Handle._run = timed_handle_run
+    self.heartbeat_task = loop.create_task(self.heartbeat())
+    threading.Thread(target=self.watchdog_t, name='loop-watchdog', daemon=True).start()
+    print(f'Loop monitor installed, logging callbacks slower than {self.slow_callback_s*1000.0:.0f}ms')
+    return self
+
+  async def heartbeat(self):
+    while True:
+      t0 = time.perf_counter()
+      await asyncio.sleep(HEARTBEAT_INTERVAL_S)
+      lag_s = max(0.0, time.perf_counter() - t0 - HEARTBEAT_INTERVAL_S)
+      self.lag.observe(lag_s)
+      self.max_lag_s = max(self.max_lag_s, lag_s)
+
+  def watchdog_t(self):
+    while active_monitor is self:
+      time.sleep(WATCHDOG_POLL_S)
+      handle = self.current_handle
+      if handle is None or handle is self.stack_captured_for:
+        continue
+      if time.perf_counter() - self.current_started_s < self.stall_stack_s:
+        continue
+      frame = sys._current_frames().get(self.loop_thread_id, None)
+      if frame is None:
+        continue
+      self.captured_stack = ''.join(traceback.format_stack(frame))
+      self.stack_captured_for = handle
+
+  def record_slow_callback(self, handle, seconds):
+    name = handle_name(handle)
+    o = self.offenders.get(name, None)
+    if o is None:
+      if len(self.offenders) >= MAX_OFFENDERS:
+        return
+      o = {'count': 0, 'total_s': 0.0, 'max_s': 0.0, 'stack': None, 'last_logged_s': 0.0}
+      self.offenders[name] = o
+    o['count'] += 1
+    o['total_s'] += seconds
+    o['max_s'] = max(o['max_s'], seconds)
+
+    stack = None
+    if self.stack_captured_for is handle:
+      stack = self.captured_stack
+      o['stack'] = stack
+      self.recent_stalls.append({'name': name, 'seconds': seconds, 'at': time.time(), 'stack': stack})
+      del self.recent_stalls[:-MAX_RECENT_STALLS]
+
+    now = time.monotonic()
+    if stack is not None or now - o['last_logged_s'] > SLOW_CALLBACK_LOG_EVERY_S:
+      o['last_logged_s'] = now
+      print(f'Slow loop callback {name} took {seconds*1000.0:.1f}ms ({o["count"]} times so far)')
+      if stack is not None:
+        print(stack)
+
+  def snapshot(self, top_n=10):
+    worst = sorted(self.offenders.items(), key=lambda kv: kv[1]['total_s'], reverse=True)[:top_n]
+    return {
+      'lag_p50_s': self.lag.rolling_quantile(0.5),
+      'lag_p99_s': self.lag.rolling_quantile(0.99),
+      'lag_max_s': self.max_lag_s,
+      'lag_count': self.lag.count,
+      'slow_callback_s': self.slow_callback_s,
+      'worst_offenders': [
+        {'name': name, 'count': o['count'], 'total_s': o['total_s'], 'max_s': o['max_s'], 'stack': o['stack']}
+        for name, o in worst
+      ],
+      'recent_stalls': self.recent_stalls,
+    }
+
+  def render_prometheus(self):
+    p = pipeline_metrics.METRIC_PREFIX
+    lines = [f'# TYPE {p}_loop_lag_seconds histogram']
+    cumulative = 0
+    for bound, c in zip(self.lag.buckets, self.lag.counts):
+      cumulative += c
+      lines.append(f'{p}_loop_lag_seconds_bucket{{le="{bound}"}} {cumulative}')
+    lines.append(f'{p}_loop_lag_seconds_bucket{{le="+Inf"}} {self.lag.count}')
+    lines.append(f'{p}_loop_lag_seconds_sum {self.lag.sum:.6f}')
+    lines.append(f'{p}_loop_lag_seconds_count {self.lag.count}')
+    lines.append(f'# TYPE {p}_loop_slow_callbacks_total counter')
+    lines.append(f'{p}_loop_slow_callbacks_total {sum(o["count"] for o in self.offenders.values())}')
+    return '\n'.join(lines) + '\n'
+
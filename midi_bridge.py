@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+
+# MIDI control surface (the WORLDE pad/knob controller from midi_experiment.py) for webserver.py.
+#
+#  - mido calls on_message() from its own input thread; messages are handed to the event loop
+#    with call_soon_threadsafe, nothing blocks the loop waiting on the device.
+#  - run() takes the first message of a burst and keeps collecting for COALESCE_S, then sends
+#    ONE command for the whole burst: a knob spun through 30 ticks becomes one net jog of N dial
+#    clicks (one spool file), not 30 files. Stop beats a position move beats a jog.
+#  - The STOP pad is the exception to waiting: it is sent the moment it arrives, and the rest of
+#    its burst is still collected and dropped so a pad hit alongside it cannot move the table.
+#  - feedback_t() lights the pad of the position the table is at, and MOVING_NOTE while it moves,
+#    from webserver.py's pmem + motion state; only changes are sent to the device.
+#
+# Find note and control numbers with `aseqdump -p 'WORLDE'` and adjust the tables below.
+#
+#   python midi_bridge.py                 # print the commands the attached controller would send
+#   python midi_bridge.py --self-test     # coalescing + feedback against a fake port, no device
+#
+
+import os
+import sys
+import time
+import types
+import asyncio
+import argparse
+import threading
+import subprocess
+import traceback
+
+# Substring of the mido port name, case-insensitive
+MIDI_PORT_MATCH = 'worlde'
+# Events closer together than this are one command
+COALESCE_S = 0.15
+FEEDBACK_S = 0.5
+REOPEN_S = 10.0
+# Pads: note -> position 1..12
+POSITION_NOTES = {36 + i: i + 1 for i in range(0, 12)}
+STOP_NOTE = 48
+MOVING_NOTE = 49
+# Knobs: control number -> dial clicks per knob tick. The WORLDE knobs send absolute 0..127,
+# so a tick is the change from the last value seen on that control.
+JOG_CONTROLS = {
+  14: 1,
+  15: 10,
+}
+# One burst never jogs further than this many clicks either way
+MAX_JOG_CLICKS = 100
+LED_VELOCITY = 100
+
+
+def import_mido():
+  # Same install-on-first-use as midi_experiment.py
+  py_env_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '.py-env'))
+  os.makedirs(py_env_dir, exist_ok=True)
+  if py_env_dir not in sys.path:
+    sys.path.append(py_env_dir)
+  try:
+    import mido
+  except:
+    subprocess.run([
+      sys.executable, '-m', 'pip', 'install', f'--target={py_env_dir}', 'mido[ports-rtmidi]'
+    ])
+    import mido
+  return mido
+
+
+def find_port_name(names, match=MIDI_PORT_MATCH):
+  for name in names:
+    if match.lower() in name.lower():
+      return name
+  return None
+
+
+def coalesce(msgs, knob_values):
+  # Reduces a burst of messages to one command: ('stop', None), ('move', position), ('jog', clicks) or None.
+  # knob_values (control -> last value) is updated in place so the next burst diffs from here.
+  stop = False
+  position = None
+  clicks = 0
+  for msg in msgs:
+    if msg.type == 'note_on' and msg.velocity > 0:
+      if msg.note == STOP_NOTE:
+        stop = True
+      elif msg.note in POSITION_NOTES:
+        position = POSITION_NOTES[msg.note] # the last pad pressed wins
+    elif msg.type == 'control_change' and msg.control in JOG_CONTROLS:
+      last_value = knob_values.get(msg.control, None)
+      knob_values[msg.control] = msg.value
+      if last_value is not None:
+        clicks += (msg.value - last_value) * JOG_CONTROLS[msg.control]
+  if stop:
+    return ('stop', None)
+  if position is not None:
+    return ('move', position)
+  clicks = max(-MAX_JOG_CLICKS, min(MAX_JOG_CLICKS, clicks))
+  if clicks != 0:
+    return ('jog', clicks)
+  return None
+
+
+class MidiBridge:
+  # on_command(kind, arg) is called on the event loop once per burst; read_state() returns
+  # (logical_position 0..11 or None, moving) for the pad LEDs.
+  # mido_api defaults to the real mido, --self-test passes a FakeMido.
+
+  def __init__(self, on_command, read_state=None, port_match=MIDI_PORT_MATCH, coalesce_s=COALESCE_S, mido_api=None):
+    self.on_command = on_command
+    self.read_state = read_state
+    self.port_match = port_match
+    self.coalesce_s = coalesce_s
+    self.mido = mido_api
+    self.loop = None
+    self.queue = None
+    self.inport = None
+    self.outport = None
+    self.port_name = None
+    self.knob_values = {}
+    self.lit_notes = set()
+    # Counters
+    self.num_messages = 0
+    self.num_bursts = 0
+    self.num_commands = 0
+    self.num_feedback_sends = 0
+
+  def open(self):
+    # Returns True once both ports are open; blocking, run in an executor
+    if self.mido is None:
+      self.mido = import_mido()
+    name = find_port_name(self.mido.get_input_names(), self.port_match)
+    if name is None:
+      return False
+    self.inport = self.mido.open_input(name, callback=self.on_message)
+    try:
+      self.outport = self.mido.open_output(find_port_name(self.mido.get_output_names(), self.port_match))
+    except:
+      traceback.print_exc()
+      self.outport = None # input only, no LEDs
+    self.port_name = name
+    self.lit_notes = set()
+    print(f'MIDI bridge opened {name}')
+    return True
+
+  def close(self):
+    for port in (self.inport, self.outport):
+      try:
+        if port is not None:
+          port.close()
+      except:
+        traceback.print_exc()
+    self.inport = None
+    self.outport = None
+
+  def on_message(self, msg):
+    # mido's input thread
+    if self.loop is not None:
+      self.loop.call_soon_threadsafe(self.queue.put_nowait, msg)
+
+  def send_command(self, kind, arg):
+    self.num_commands += 1
+    try:
+      self.on_command(kind, arg)
+    except:
+      traceback.print_exc()
+
+  def stop_now(self, msg):
+    # Sends an emergency stop without waiting out the burst; returns True if msg was one
+    if msg.type == 'note_on' and msg.velocity > 0 and msg.note == STOP_NOTE:
+      self.send_command('stop', None)
+      return True
+    return False
+
+  async def next_burst(self):
+    # Returns (msgs, stopped), stopped when a stop in the burst was already sent by stop_now()
+    msgs = [await self.queue.get()]
+    stopped = self.stop_now(msgs[0])
+    deadline = self.loop.time() + self.coalesce_s
+    while True:
+      timeout = deadline - self.loop.time()
+      if timeout <= 0:
+        break
+      try:
+        msgs.append(await asyncio.wait_for(self.queue.get(), timeout))
+      except asyncio.TimeoutError:
+        break
+      if not stopped:
+        stopped = self.stop_now(msgs[-1])
+    return msgs, stopped
+
+  async def run(self):
+    self.loop = asyncio.get_running_loop()
+    self.queue = asyncio.Queue()
+    while self.inport is None:
+      try:
+        if await self.loop.run_in_executor(None, self.open):
+          break
+      except:
+        traceback.print_exc()
+      await asyncio.sleep(REOPEN_S)
+    feedback_task = asyncio.create_task(self.feedback_t())
+    try:
+      while True:
+        msgs, stopped = await self.next_burst()
+        self.num_messages += len(msgs)
+        self.num_bursts += 1
+        command = coalesce(msgs, self.knob_values)
+        # A stopped burst coalesces to the stop that already went out; its pads and knobs are dropped
+        if command is None or stopped:
+          continue
+        self.send_command(*command)
+    finally:
+      feedback_task.cancel()
+      self.close()
+
+  def update_leds(self, logical_position, moving):
+    want = set()
+    if logical_position is not None and 0 <= logical_position < len(POSITION_NOTES):
+      want.add(sorted(POSITION_NOTES)[logical_position])
+    if moving:
+      want.add(MOVING_NOTE)
+    if self.outport is None or want == self.lit_notes:
+      return
+    for note in sorted(self.lit_notes - want):
+      self.outport.send(self.mido.Message('note_off', note=note))
+      self.num_feedback_sends += 1
+    for note in sorted(want - self.lit_notes):
+      self.outport.send(self.mido.Message('note_on', note=note, velocity=LED_VELOCITY))
+      self.num_feedback_sends += 1
+    self.lit_notes = want
+
+  async def feedback_t(self):
+    while self.read_state is not None:
+      try:
+        self.update_leds(*self.read_state())
+      except:
+        traceback.print_exc()
+      await asyncio.sleep(FEEDBACK_S)
+
+  def stats_s(self):
+    return f'{self.port_name or "no port"}: {self.num_messages} messages in {self.num_bursts} bursts -> {self.num_commands} commands, {self.num_feedback_sends} LED updates, lit {sorted(self.lit_notes)}'
+
+
+# Fake mido for --self-test
+
+class FakePort:
+  def __init__(self, callback=None):
+    self.callback = callback
+    self.sent = []
+
+  def feed(self, msgs, gap_s=0.0):
+    # Delivers from another thread, like rtmidi does
+    def deliver():
+      for msg in msgs:
+        self.callback(msg)
+        time.sleep(gap_s)
+    t = threading.Thread(target=deliver)
+    t.start()
+    return t
+
+  def send(self, msg):
+    self.sent.append((msg.type, msg.note))
+
+  def close(self):
+    pass
+
+class FakeMido:
+  def __init__(self):
+    self.inport = None
+    self.outport = FakePort()
+
+  def get_input_names(self):
+    return ['WORLDE easy CTRL:WORLDE easy CTRL MIDI 1 20:0']
+
+  def get_output_names(self):
+    return self.get_input_names()
+
+  def open_input(self, name, callback=None):
+    self.inport = FakePort(callback)
+    return self.inport
+
+  def open_output(self, name):
+    return self.outport
+
+  def Message(self, type, **kwargs):
+    return types.SimpleNamespace(type=type, **kwargs)
+
+
+def self_test():
+  fake = FakeMido()
+  commands = []
+  stop_sent_s = []
+  def on_command(kind, arg):
+    commands.append((kind, arg))
+    if kind == 'stop':
+      stop_sent_s.append(time.monotonic())
+  state = {'logical_position': 2, 'moving': False}
+  bridge = MidiBridge(on_command, lambda: (state['logical_position'], state['moving']), mido_api=fake)
+  stop_latency_s = []
+
+  def cc(control, value):
+    return fake.Message('control_change', control=control, value=value)
+  def note(n):
+    return fake.Message('note_on', note=n, velocity=90)
+
+  async def scenario():
+    task = asyncio.create_task(bridge.run())
+    while fake.inport is None:
+      await asyncio.sleep(0.01)
+    # 30 knob ticks in 60ms; the first only sets the baseline
+    fake.inport.feed([cc(14, 60 + i) for i in range(0, 31)], gap_s=0.002)
+    await asyncio.sleep(0.5)
+    # Coarse knob back 3 ticks, then a pad in the same burst: the pad wins
+    fake.inport.feed([cc(15, 10), cc(15, 7), note(40)])
+    await asyncio.sleep(0.5)
+    # Two separate bursts
+    fake.inport.feed([cc(15, 8)])
+    await asyncio.sleep(0.5)
+    # Stop goes out at once; the pad in the same burst is dropped
+    fed_s = time.monotonic()
+    fake.inport.feed([note(STOP_NOTE), note(36)])
+    await asyncio.sleep(0.3)
+    # Stop arriving mid-way through a knob burst
+    fake.inport.feed([cc(14, 95), cc(14, 96), cc(14, 97)], gap_s=0.02)
+    await asyncio.sleep(0.05)
+    mid_burst_s = time.monotonic()
+    fake.inport.feed([note(STOP_NOTE)])
+    await asyncio.sleep(0.3)
+    if len(stop_sent_s) == 2:
+      stop_latency_s.extend([stop_sent_s[0] - fed_s, stop_sent_s[1] - mid_burst_s])
+    state['logical_position'] = 4
+    state['moving'] = True
+    await asyncio.sleep(FEEDBACK_S + 0.2)
+    task.cancel()
+
+  asyncio.run(scenario())
+  expect_commands = [('jog', 30), ('move', 5), ('jog', 10), ('stop', None), ('stop', None)]
+  expect_leds = [('note_on', 38), ('note_off', 38), ('note_on', 40), ('note_on', MOVING_NOTE)]
+  # Well under the coalescing window the stop used to wait out
+  max_stop_latency_s = COALESCE_S / 3.0
+  print(f'commands = {commands}')
+  print(f'LED sends = {fake.outport.sent}')
+  print(f'stop latency = {[f"{x*1000:.1f}ms" for x in stop_latency_s]} (limit {max_stop_latency_s*1000:.0f}ms)')
+  print(bridge.stats_s())
+  ok = commands == expect_commands and fake.outport.sent == expect_leds
+  ok = ok and len(stop_latency_s) == 2 and max(stop_latency_s) < max_stop_latency_s
+  print('OK' if ok else f'FAILED, expected commands {expect_commands}, LED sends {expect_leds} and stops within {max_stop_latency_s*1000:.0f}ms')
+  return 0 if ok else 1
+
+
+def main(args=sys.argv):
+  parser = argparse.ArgumentParser(description='MIDI control surface bridge for the transfer table')
+  parser.add_argument('--port', default=MIDI_PORT_MATCH, help='Substring of the MIDI port name')
+  parser.add_argument('--self-test', action='store_true', help='Run against a fake port')
+  opts = parser.parse_args(args[1:])
+
+  if opts.self_test:
+    return self_test()
+
+  bridge = MidiBridge(lambda kind, arg: print(f'{time.strftime("%H:%M:%S")} {kind} {arg}'), port_match=opts.port)
+  try:
+    asyncio.run(bridge.run())
+  except KeyboardInterrupt:
+    pass
+  except:
+    traceback.print_exc()
+    return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+# Model of gpio-motor-control.zig's step_n()/step_once() timing, so webserver.py can predict when
+# a move ends instead of guessing from how long ago /tmp/gpio_motor_last_active_mtime was touched.
+#
+# step_n(n) ramps the step delay down on a half cosine over RAMP_UP_STEPS steps (fewer for short
+# moves), cruises at FASTEST_US (+7us when driving HIGH, to dodge a resonance), then ramps back up.
+# step_once(d) busy-waits d/2 twice, so every step costs 2*(int(d)/2)us plus STEP_OVERHEAD_US of
+# GPIO writes and gettimeofday() polling. The sums below follow the zig code step for step.
+#
+#   python motion_profile.py                      # durations between the 12 positions in pmem.bin
+#   python motion_profile.py --steps 40600         # one move
+#   python motion_profile.py --calibrate 40600 9.8 # fit STEP_OVERHEAD_US from a timed move
+#
+
+import sys
+import math
+import time
+import struct
+import argparse
+import functools
+
+# Keep in sync with gpio-motor-control.zig
+RAMP_UP_STEPS = 14200
+SLOWEST_US = 600
+FASTEST_US = 224
+HIGH_DIRECTION_OFFSET_US = 7
+DIAL_STEP_US = 180
+DEFAULT_DIAL_STEPS_PER_CLICK = 40
+LOW = 0
+HIGH = 1
+# Per step, on top of the busy-waits; fit with --calibrate
+STEP_OVERHEAD_US = 2.0
+# The controller reads the key spool twice a second, then runs keypresses on its next 12ms tick
+CONTROLLER_PICKUP_S = 0.6
+
+PMEM_FILE = '/mnt/usb1/pmem.bin'
+# logical_position, step_position, 12 * (step_position, pad, cm_position)
+PMEM_STEPS = struct.Struct('<Ii' + ('i4xd' * 12))
+
+
+def step_us(delay_us):
+  # What step_once(delay_us) busy-waits, integer division included
+  return 2 * (delay_us // 2)
+
+def ramp_delay_us(i, ramp_n, fastest_us):
+  # The zig code evaluates this in f32 and truncates; delay_us <= 0 becomes 1
+  dist = SLOWEST_US - fastest_us
+  d = fastest_us + dist * (math.sin((math.pi / ramp_n) * i + (math.pi / 2.0)) + 1.0)
+  return max(1, int(d))
+
+@functools.lru_cache(maxsize=64)
+def ramp_us(ramp_n, fastest_us):
+  # (ramp up, ramp down) busy-wait microseconds; ramp up runs i = 0..ramp_n-1, ramp down i = ramp_n..1
+  if ramp_n < 1:
+    return (0, 0)
+  up = sum(step_us(ramp_delay_us(i, ramp_n, fastest_us)) for i in range(0, ramp_n))
+  down = sum(step_us(ramp_delay_us(i, ramp_n, fastest_us)) for i in range(1, ramp_n + 1))
+  return (up, down)
+
+def step_n_plan(n, level):
+  # (ramp_n, fastest_us, cruise_steps) the way step_n() picks them
+  ramp_n = RAMP_UP_STEPS
+  fastest_us = FASTEST_US + (HIGH_DIRECTION_OFFSET_US if level == HIGH else 0)
+  if n < ramp_n:
+    ramp_n = max(0, (n // 2) - 1)
+    fastest_us = FASTEST_US
+  return ramp_n, fastest_us, max(0, n - 2 * ramp_n)
+
+def step_n_us(n, level, step_overhead_us=STEP_OVERHEAD_US):
+  # For RAMP_UP_STEPS <= n < 2*RAMP_UP_STEPS both full ramps still run, so step_n() drives 2*ramp_n steps, not n
+  ramp_n, fastest_us, cruise_steps = step_n_plan(n, level)
+  up_us, down_us = ramp_us(ramp_n, fastest_us)
+  # Cruise alternates fastest_us and fastest_us+1 by step index, starting at i = ramp_n
+  num_odd = (ramp_n + cruise_steps) // 2 - ramp_n // 2
+  num_even = cruise_steps - num_odd
+  cruise_us = num_even * step_us(fastest_us) + num_odd * step_us(fastest_us + 1)
+  return up_us + cruise_us + down_us + (2 * ramp_n + cruise_steps) * step_overhead_us
+
+def move_duration_s(num_steps, step_overhead_us=STEP_OVERHEAD_US):
+  # num_steps as move_to_position() computes it: pmem.step_position - target step_position
+  if num_steps == 0:
+    return 0.0
+  return step_n_us(abs(num_steps), HIGH if num_steps > 0 else LOW, step_overhead_us) / 1e6
+
+def dial_duration_s(steps_per_click=DEFAULT_DIAL_STEPS_PER_CLICK, step_overhead_us=STEP_OVERHEAD_US):
+  # A dial click (or automove correction) is steps_per_click step_once(180) calls, no ramp
+  return steps_per_click * (step_us(DIAL_STEP_US) + step_overhead_us) / 1e6
+
+def simulate_step_n_us(n, level, step_overhead_us=STEP_OVERHEAD_US):
+  # Literal transcription of step_n()'s three loops, for checking step_n_us()
+  ramp_n, fastest_us, _ = step_n_plan(n, level)
+  total = 0
+  num_steps = 0
+  for i in range(0, ramp_n):
+    total += step_us(ramp_delay_us(i, ramp_n, fastest_us))
+    num_steps += 1
+  for i in range(ramp_n, n - ramp_n):
+    total += step_us(fastest_us + (i % 2))
+    num_steps += 1
+  for j in range(n - ramp_n, n):
+    total += step_us(ramp_delay_us(n - j, ramp_n, fastest_us))
+    num_steps += 1
+  return total + num_steps * step_overhead_us
+
+
+def read_pmem_steps(pmem_file=PMEM_FILE):
+  # (step_position, [step_position of positions 1..12])
+  with open(pmem_file, 'rb') as fd:
+    fields = PMEM_STEPS.unpack(fd.read(PMEM_STEPS.size))
+  return fields[1], list(fields[2::2])
+
+
+class MotionTracker:
+  # Decides "is the table moving, and since when has it been still" from three sources:
+  #  - moves webserver.py asked for itself (expect_move), predicted with move_duration_s
+  #  - /tmp/gpio_motor_is_active, which the controller holds for the whole move
+  #  - /tmp/gpio_motor_last_active_mtime, touched at the start and the end of every move
+  # A predicted move covers the gap before the controller picks the command up, and the end of a
+  # move is the observed end when we saw it, else the predicted one.
+
+  def __init__(self):
+    self.expected_end_s = 0.0
+    self.expected_since_s = 0.0
+    self.expected_move_s = 0.0
+    self.last_move_end_s = 0.0
+    self.motor_active = False
+
+  def expect_move(self, num_steps, now=None):
+    now = time.time() if now is None else now
+    self.expected_move_s = move_duration_s(num_steps)
+    self.expect_until(now + CONTROLLER_PICKUP_S + self.expected_move_s, now)
+    return self.expected_end_s
+
+  def expect_until(self, end_s, now=None):
+    if end_s > self.expected_end_s:
+      self.expected_end_s = end_s
+      self.expected_since_s = time.time() if now is None else now
+
+  def cancel(self, now=None):
+    # Emergency stop: whatever we predicted is not going to happen
+    now = time.time() if now is None else now
+    self.expected_end_s = min(self.expected_end_s, now)
+
+  def observe(self, motor_active, last_active_mtime_s, now=None):
+    now = time.time() if now is None else now
+    if not motor_active and self.expected_end_s > now:
+      if self.motor_active or (last_active_mtime_s is not None and last_active_mtime_s > self.expected_since_s):
+        # The controller has moved since we asked and is idle again; believe it over the prediction
+        self.expected_end_s = now
+    if self.motor_active and not motor_active:
+      self.last_move_end_s = max(self.last_move_end_s, now)
+    self.motor_active = motor_active
+    if last_active_mtime_s is not None:
+      self.last_move_end_s = max(self.last_move_end_s, last_active_mtime_s)
+    if not motor_active and self.expected_end_s <= now:
+      self.last_move_end_s = max(self.last_move_end_s, self.expected_end_s)
+
+  def moving(self, now=None):
+    now = time.time() if now is None else now
+    return self.motor_active or self.expected_end_s > now
+
+  def seconds_since_move_end(self, now=None):
+    now = time.time() if now is None else now
+    if self.moving(now):
+      return 0.0
+    return now - self.last_move_end_s
+
+  def eta_s(self, now=None):
+    # Seconds until a move we asked for should be done, None when we have no prediction
+    now = time.time() if now is None else now
+    if self.expected_end_s > now:
+      return self.expected_end_s - now
+    return None
+
+  def snapshot(self, now=None):
+    now = time.time() if now is None else now
+    return {
+      'moving': self.moving(now),
+      'motor_active': self.motor_active,
+      'eta_s': self.eta_s(now),
+      'expected_move_s': self.expected_move_s,
+      'seconds_since_move_end': self.seconds_since_move_end(now),
+    }
+
+
+def main(args=sys.argv):
+  parser = argparse.ArgumentParser(description='Predict gpio-motor-control move durations')
+  parser.add_argument('--pmem', default=PMEM_FILE)
+  parser.add_argument('--steps', type=int, default=None, help='pmem.step_position - target; > 0 drives HIGH')
+  parser.add_argument('--calibrate', nargs=2, type=float, metavar=('STEPS', 'SECONDS'), help='A timed move, prints the STEP_OVERHEAD_US it implies')
+  parser.add_argument('--check', action='store_true', help='Compare the model against a step-by-step simulation')
+  opts = parser.parse_args(args[1:])
+
+  if opts.calibrate is not None:
+    num_steps, seconds = int(opts.calibrate[0]), opts.calibrate[1]
+    busy_us = step_n_us(abs(num_steps), HIGH if num_steps > 0 else LOW, step_overhead_us=0.0)
+    print(f'{abs(num_steps)} steps busy-wait {busy_us/1e6:.3f}s, measured {seconds:.3f}s: STEP_OVERHEAD_US = {(seconds*1e6 - busy_us) / abs(num_steps):.2f}')
+    return 0
+
+  if opts.check:
+    num_bad = 0
+    for n in (2, 3, 100, 999, 14199, 28399, 28400, 28401, 40600, 466000):
+      for level in (LOW, HIGH):
+        model, sim = step_n_us(n, level), simulate_step_n_us(n, level)
+        if abs(model - sim) > 1e-6:
+          num_bad += 1
+        print(f'{n:>7} steps {"HIGH" if level == HIGH else "LOW":>4}: model {model/1e6:8.3f}s simulated {sim/1e6:8.3f}s')
+    return 1 if num_bad > 0 else 0
+
+  if opts.steps is not None:
+    print(f'{opts.steps} steps: {move_duration_s(opts.steps):.2f}s')
+    return 0
+
+  step_position, positions = read_pmem_steps(opts.pmem)
+  print(f'From step_position {step_position}:')
+  for i, target in enumerate(positions):
+    print(f'  position {i+1:>2} ({target:>7}): {move_duration_s(step_position - target):6.2f}s')
+  print(f'Dial click ({DEFAULT_DIAL_STEPS_PER_CLICK} steps): {dial_duration_s()*1000.0:.1f}ms')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+
+# Extra cameras next to the main one read_video_t already runs (a second camera at the far end of
+# the table, close-ups per rail), each in its own thread with its own frame source, detector and
+# calibration, fused with the main camera into the one rail_px_diff automove acts on.
+#
+# Configured in CAMERAS_FILE (env CAMERAS_FILE), a JSON list; no file means only the main camera:
+#
+#   [
+#     {"name": "far", "source": "camera:/dev/video2", "scale": -1.0, "offset_px": 0.0, "weight": 1.0,
+#      "geometry": {"crop_x": 175, "crop_y": 200, "table_rail_y": 330, "layout_rail_y": 350}}
+#   ]
+#
+#  - geometry overrides rail_detector.RailGeometry fields for this camera's view.
+#  - scale converts this camera's rail_x1_diff into main camera pixels; negative for a camera that
+#    looks at the table from the other side. offset_px is added after scaling (mounting bias).
+#  - Cameras run at fps (default EXTRA_CAMERA_FPS) instead of the main camera's rate.
+#
+# Capture, detection and JPEG encoding all happen in cv2/numpy calls that release the GIL, so
+# the threads spread over the cores of cpu_layout.py's 'camera' role without another process.
+#
+#   python multi_camera.py cameras.json --seconds 10    # run the cameras, print estimates + fused
+#
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import traceback
+import dataclasses
+
+import rail_detector
+import frame_sources
+import frame_compositor
+
+import cv2
+import numpy
+
+CAMERAS_FILE = os.environ.get('CAMERAS_FILE', '/mnt/usb1/webserver-cameras.json')
+MAIN_CAMERA_NAME = 'main'
+EXTRA_CAMERA_FPS = 10.0
+# Estimates older than this are left out of the fused value
+ESTIMATE_STALE_S = 1.0
+# Estimates further than this (main camera px) from the median are treated as misdetections
+FUSE_MAX_SPREAD_PX = 6.0
+# /video/combined
+COMBINED_TILE_W = 320
+COMBINED_FPS = 5.0
+
+
+@dataclasses.dataclass
+class CameraConfig:
+  name: str
+  source: str
+  geometry: dict = dataclasses.field(default_factory=dict)
+  scale: float = 1.0
+  offset_px: float = 0.0
+  weight: float = 1.0
+  fps: float = EXTRA_CAMERA_FPS
+
+  def rail_geometry(self, frame_w, frame_h):
+    # Overrides are in the same 640x480 measurement space as RailGeometry's defaults
+    return dataclasses.replace(rail_detector.RailGeometry(), **self.geometry).scaled_to(frame_w, frame_h)
+
+
+@dataclasses.dataclass
+class CameraEstimate:
+  name: str
+  t: float # monotonic
+  frame_num: int
+  # This camera's layout_x1 - table_x1, None when it sees no rails
+  rail_x1_diff: object
+  # rail_x1_diff in main camera pixels
+  main_px: object
+  weight: float
+
+
+def load_camera_configs(path=CAMERAS_FILE):
+  if not os.path.exists(path):
+    return []
+  with open(path, 'r') as fd:
+    configs = [CameraConfig(**c) for c in json.load(fd)]
+  names = [c.name for c in configs]
+  if MAIN_CAMERA_NAME in names or len(set(names)) != len(names):
+    raise Exception(f'Camera names in {path} must be unique and not "{MAIN_CAMERA_NAME}": {names}')
+  return configs
+
+
+def fuse(estimates, max_allowed_rail_offset, now=None, stale_s=ESTIMATE_STALE_S, max_spread_px=FUSE_MAX_SPREAD_PX):
+  # Returns (rail_px_diff like RailDetection.rail_px_diff, fused main_px or None, names used, names rejected)
+  now = time.monotonic() if now is None else now
+  fresh = [e for e in estimates if e is not None and e.main_px is not None and now - e.t <= stale_s and e.weight > 0.0]
+  if len(fresh) < 1:
+    return None, None, [], []
+  median = float(numpy.median([e.main_px for e in fresh]))
+  used = [e for e in fresh if abs(e.main_px - median) <= max_spread_px]
+  rejected = [e.name for e in fresh if not e in used]
+  if len(used) < 1:
+    # No majority (eg two cameras that disagree): do not act on either
+    return None, None, [], rejected
+  fused = sum(e.main_px * e.weight for e in used) / sum(e.weight for e in used)
+  rail_px_diff = int(round(fused))
+  if abs(rail_px_diff) <= max_allowed_rail_offset:
+    rail_px_diff = None
+  return rail_px_diff, fused, [e.name for e in used], rejected
+
+
+def label(img, text):
+  cv2.putText(img, text, (6, 22), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (10, 10, 10), 3, cv2.LINE_AA)
+  cv2.putText(img, text, (6, 22), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (240, 240, 240), 1, cv2.LINE_AA)
+
+
+def thumbnail(img, out=None):
+  h, w = img.shape[:2]
+  tile_h = max(1, (h * COMBINED_TILE_W) // w)
+  if out is None or out.shape[:2] != (tile_h, COMBINED_TILE_W):
+    out = numpy.empty((tile_h, COMBINED_TILE_W, 3), dtype=numpy.uint8)
+  cv2.resize(img, (COMBINED_TILE_W, tile_h), dst=out, interpolation=cv2.INTER_AREA)
+  return out
+
+
+class CameraWorker(threading.Thread):
+  def __init__(self, config, cpu_layout=None):
+    super().__init__(name=f'camera-{config.name}', daemon=True)
+    self.config = config
+    self.cpu_layout = cpu_layout
+    self.supervisor = frame_sources.CaptureSupervisor(config.source)
+    self.compositor = frame_compositor.FrameCompositor()
+    self.detector = None
+    self.stop_event = threading.Event()
+    self.lock = threading.Lock()
+    # Published under lock
+    self.estimate = None
+    self.latest_part = None
+    self.latest_thumbnail = None
+    self.frame_num = 0
+    # Streams are only rendered and encoded while someone watches them, see MultiCamera.add_viewer()
+    self.viewers = 0
+    self.thumbnail_viewers = 0
+    # Counters
+    self.busy_s = 0.0
+    self.started_s = time.monotonic()
+
+  def detector_for(self, img):
+    h, w = img.shape[:2]
+    if self.detector is None or self.detector.geometry.frame_w != w or self.detector.geometry.frame_h != h:
+      self.detector = rail_detector.get_detector(geometry=self.config.rail_geometry(w, h))
+    return self.detector
+
+  def run(self):
+    # Blocking on purpose: this is the camera's own thread
+    if self.cpu_layout is not None:
+      self.cpu_layout.apply('camera')
+    period_s = 1.0 / self.config.fps if self.config.fps > 0 else 0.0
+    next_frame_s = time.monotonic()
+    while not self.stop_event.is_set():
+      try:
+        if self.supervisor.source is None:
+          # Also backs off after the source was dropped for empty reads, not only after failed opens
+          if self.stop_event.wait(self.supervisor.backoff_s()):
+            break
+          if not self.supervisor.try_open():
+            continue
+          print(f'Camera {self.config.name} reading frames from {self.supervisor.source}')
+        self.stop_event.wait(max(0.0, next_frame_s - time.monotonic(), self.supervisor.source.wait_s()))
+        next_frame_s = max(next_frame_s + period_s, time.monotonic())
+        self.read_one()
+      except:
+        traceback.print_exc()
+        self.stop_event.wait(1.0)
+    self.supervisor.release()
+
+  def read_one(self):
+    t0 = time.perf_counter()
+    source = self.supervisor.source
+    img = None
+    if source.grab():
+      img = source.retrieve(out=self.compositor.frame_view(source.width, source.height))
+    if img is None:
+      self.supervisor.frame_failed()
+      return
+    self.supervisor.frame_ok(img)
+    img = self.compositor.place_frame(img)
+    detector = self.detector_for(img)
+    result = detector.detect(img)
+    main_px = None
+    if result.rail_x1_diff is not None:
+      main_px = result.rail_x1_diff * self.config.scale + self.config.offset_px
+    estimate = CameraEstimate(self.config.name, time.monotonic(), self.frame_num, result.rail_x1_diff, main_px, self.config.weight)
+    part = None
+    tile = None
+    if self.viewers > 0 or self.thumbnail_viewers > 0:
+      label(img, f'{self.config.name} {self.frame_num % 1000} diff {result.rail_x1_diff}')
+    if self.viewers > 0:
+      self.compositor.place_debug(detector.render_debug(result))
+      part = self.compositor.encode()
+    if self.thumbnail_viewers > 0:
+      tile = thumbnail(img)
+    with self.lock:
+      self.estimate = estimate
+      self.latest_part = part
+      self.latest_thumbnail = tile
+      self.frame_num += 1
+    self.busy_s += time.perf_counter() - t0
+
+  def stop(self):
+    self.stop_event.set()
+
+  def fps(self):
+    elapsed_s = time.monotonic() - self.started_s
+    return self.frame_num / elapsed_s if elapsed_s > 0.0 else 0.0
+
+  def stats_s(self):
+    e = self.estimate
+    return f'{self.config.name} ({self.supervisor.source}): {self.fps():.1f}fps, {100.0 * self.busy_s / max(1e-6, time.monotonic() - self.started_s):.0f}% of a core, rail_x1_diff {e.rail_x1_diff if e else None} -> {e.main_px if e else None} main px; {self.supervisor.stats_s()}'
+
+
+class MultiCamera:
+  def __init__(self, configs, cpu_layout=None):
+    # cpu_layout: a cpu_layout.CpuLayout each camera thread applies its 'camera' role from
+    self.workers = {c.name: CameraWorker(c, cpu_layout) for c in configs}
+    self.main_estimate = None
+    self.main_thumbnail = None
+    self.last_fused = (None, None, [], [])
+    self.combined_part = None
+    self.combined_s = 0.0
+    self.combined_lock = threading.Lock()
+    self.combined_viewers = 0
+    # Counters
+    self.num_fused = 0
+    self.num_rejected = 0
+
+  def start(self):
+    for worker in self.workers.values():
+      worker.start()
+    return self
+
+  def stop(self):
+    for worker in self.workers.values():
+      worker.stop()
+
+  def add_viewer(self, name, n=1):
+    # n = +1 when a stream client connects, -1 when it leaves; name is a camera or 'combined'
+    if name == 'combined':
+      self.combined_viewers += n
+      for worker in self.workers.values():
+        worker.thumbnail_viewers += n
+    elif name in self.workers:
+      self.workers[name].viewers += n
+
+  def fuse_main(self, main_estimate, max_allowed_rail_offset, img=None):
+    # Called by read_video_t for every main camera frame; returns the fused rail_px_diff.
+    # main_estimate is (frame_num, rail_x1_diff, main_px, monotonic s the frame was analysed) or None.
+    self.main_estimate = None
+    if main_estimate is not None:
+      frame_num, rail_x1_diff, main_px, t = main_estimate
+      self.main_estimate = CameraEstimate(MAIN_CAMERA_NAME, t, frame_num, rail_x1_diff, main_px, 1.0)
+    if img is not None and self.combined_viewers > 0:
+      self.main_thumbnail = thumbnail(img, out=self.main_thumbnail)
+      label(self.main_thumbnail, MAIN_CAMERA_NAME)
+    estimates = [self.main_estimate] + [w.estimate for w in self.workers.values()]
+    self.last_fused = fuse(estimates, max_allowed_rail_offset)
+    self.num_fused += 1
+    self.num_rejected += len(self.last_fused[3])
+    return self.last_fused[0]
+
+  def latest_part(self, name):
+    worker = self.workers.get(name, None)
+    if worker is None:
+      return None
+    with worker.lock:
+      return worker.latest_part
+
+  def combined(self):
+    # Tiles of every camera side by side with the fused result under them, rebuilt at most COMBINED_FPS
+    with self.combined_lock:
+      if self.combined_part is not None and time.monotonic() - self.combined_s < 1.0 / COMBINED_FPS:
+        return self.combined_part
+      tiles = [self.main_thumbnail] if self.main_thumbnail is not None else []
+      for worker in self.workers.values():
+        with worker.lock:
+          if worker.latest_thumbnail is not None:
+            tiles.append(worker.latest_thumbnail)
+      if len(tiles) < 1:
+        return None
+      tile_h = max(t.shape[0] for t in tiles)
+      canvas = numpy.zeros((tile_h + 40, COMBINED_TILE_W * len(tiles), 3), dtype=numpy.uint8)
+      for i, tile in enumerate(tiles):
+        canvas[:tile.shape[0], i*COMBINED_TILE_W:(i+1)*COMBINED_TILE_W] = tile
+      rail_px_diff, fused, used, rejected = self.last_fused
+      text = f'fused {fused:.1f}px from {",".join(used)}' if fused is not None else 'no rails'
+      if len(rejected) > 0:
+        text += f', rejected {",".join(rejected)}'
+      cv2.putText(canvas, text, (6, tile_h + 28), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0) if rail_px_diff is None and fused is not None else (0, 200, 255), 1, cv2.LINE_AA)
+      self.combined_part = frame_compositor.encode_multipart_jpeg(canvas)
+      self.combined_s = time.monotonic()
+      return self.combined_part
+
+  def render_prometheus(self, prefix):
+    lines = [
+      f'# TYPE {prefix}_camera_fps gauge',
+    ]
+    for name, worker in self.workers.items():
+      lines.append(f'{prefix}_camera_fps{{camera="{name}"}} {worker.fps():.2f}')
+    lines.append(f'# TYPE {prefix}_camera_busy_seconds_total counter')
+    for name, worker in self.workers.items():
+      lines.append(f'{prefix}_camera_busy_seconds_total{{camera="{name}"}} {worker.busy_s:.3f}')
+    lines.append(f'# TYPE {prefix}_camera_fused_total counter')
+    lines.append(f'{prefix}_camera_fused_total {self.num_fused}')
+    lines.append(f'# TYPE {prefix}_camera_rejected_estimates_total counter')
+    lines.append(f'{prefix}_camera_rejected_estimates_total {self.num_rejected}')
+    return '\n'.join(lines) + '\n'
+
+  def stats_s(self):
+    rail_px_diff, fused, used, rejected = self.last_fused
+    lines = [f'fused rail_px_diff {rail_px_diff} ({fused if fused is None else round(fused, 2)} main px) from {used}, rejected {rejected}']
+    for worker in self.workers.values():
+      lines.append(worker.stats_s())
+    return os.linesep.join(lines)
+
+
+def main(args=sys.argv):
+  parser = argparse.ArgumentParser(description='Run the extra cameras from a cameras.json and print their fused estimate')
+  parser.add_argument('cameras_file', nargs='?', default=CAMERAS_FILE)
+  parser.add_argument('--main', default=None, help='Frame source spec to run as the main camera, eg synthetic:offset=8')
+  parser.add_argument('--seconds', type=float, default=10.0)
+  parser.add_argument('--combined', default=None, help='Write the last combined frame to this .jpg')
+  opts = parser.parse_args(args[1:])
+
+  configs = load_camera_configs(opts.cameras_file)
+  if len(configs) < 1:
+    print(f'No cameras configured in {opts.cameras_file}')
+    return 1
+  cameras = MultiCamera(configs).start()
+  if opts.combined:
+    cameras.add_viewer('combined')
+  main_source = frame_sources.open_frame_source(opts.main) if opts.main else None
+  main_detector = None
+  stop_at = time.monotonic() + opts.seconds
+  frame_num = 0
+  try:
+    while time.monotonic() < stop_at:
+      if main_source is not None:
+        ok, img = main_source.read()
+        if ok:
+          if main_detector is None:
+            main_detector = rail_detector.get_detector(geometry=rail_detector.RailGeometry().scaled_to(img.shape[1], img.shape[0]))
+          result = main_detector.detect(img)
+          cameras.fuse_main((frame_num, result.rail_x1_diff, result.rail_x1_diff, time.monotonic()), main_detector.geometry.max_allowed_rail_offset, img)
+          frame_num += 1
+      else:
+        cameras.last_fused = fuse([w.estimate for w in cameras.workers.values()], rail_detector.RailGeometry().max_allowed_rail_offset)
+      time.sleep(0.1)
+    print(cameras.stats_s())
+    if opts.combined:
+      part = cameras.combined()
+      if part is not None:
+        with open(opts.combined, 'wb') as fd:
+          fd.write(part[len(frame_compositor.MULTIPART_HEADER):-len(frame_compositor.MULTIPART_TRAILER)])
+  finally:
+    cameras.stop()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
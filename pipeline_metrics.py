@@ -0,0 +1,147 @@
+
+# Per-stage timing for webserver.py's frame pipeline, served on /metrics in Prometheus text format.
+# observe() is a bisect and a few integer adds, cheap enough to leave on in production.
+
+import time
+import bisect
+import collections
+
+# Upper bounds in seconds; a frame is budgeted roughly FRAME_HANDLE_DELAY_S (50ms)
+STAGE_BUCKETS_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Rolling quantiles cover the last ROLLING_WINDOW_S, kept as ROLLING_SLOTS rotating bucket arrays
+ROLLING_WINDOW_S = 60.0
+ROLLING_SLOTS = 6
+
+PIPELINE_STAGES = (
+  'capture_wait',
+  'decode',
+  'contrast',
+  'detection',
+  'debug_render',
+  'jpeg_encode',
+  'broadcast',
+)
+
+METRIC_PREFIX = 'transfer_table'
+
+
+class RollingHistogram:
+  def __init__(self, buckets=STAGE_BUCKETS_S, window_s=ROLLING_WINDOW_S, num_slots=ROLLING_SLOTS):
+    self.buckets = tuple(buckets)
+    # Cumulative since start, as Prometheus expects; the last entry is +Inf
+    self.counts = [0] * (len(self.buckets) + 1)
+    self.sum = 0.0
+    self.count = 0
+    self.slot_s = window_s / num_slots
+    self.slots = [[0] * (len(self.buckets) + 1) for _ in range(0, num_slots)]
+    self.slot_ids = [-1] * num_slots
+
+  def observe(self, value):
+    i = bisect.bisect_left(self.buckets, value)
+    self.counts[i] += 1
+    self.sum += value
+    self.count += 1
+
+    slot_id = int(time.monotonic() / self.slot_s)
+    k = slot_id % len(self.slots)
+    slot = self.slots[k]
+    if self.slot_ids[k] != slot_id:
+      for j in range(0, len(slot)):
+        slot[j] = 0
+      self.slot_ids[k] = slot_id
+    slot[i] += 1
+
+  def rolling_counts(self):
+    oldest_slot_id = int(time.monotonic() / self.slot_s) - len(self.slots) + 1
+    totals = [0] * (len(self.buckets) + 1)
+    for slot_id, slot in zip(self.slot_ids, self.slots):
+      if slot_id >= oldest_slot_id:
+        for j in range(0, len(slot)):
+          totals[j] += slot[j]
+    return totals
+
+  def rolling_quantile(self, q):
+    # Upper bound of the bucket holding the q-th observation, or None without data
+    totals = self.rolling_counts()
+    n = sum(totals)
+    if n < 1:
+      return None
+    seen = 0
+    for j, c in enumerate(totals):
+      seen += c
+      if seen >= q * n:
+        return self.buckets[j] if j < len(self.buckets) else float('inf')
+    return float('inf')
+
+
+class PipelineMetrics:
+  def __init__(self, stages=PIPELINE_STAGES):
+    self.stages = {name: RollingHistogram() for name in stages}
+    # Timings of the frame in progress, for the flight recorder; zeroed by frame_done()
+    self.last_stage_s = {name: 0.0 for name in stages}
+    self.frames_total = 0
+    self.bytes_sent_total = 0
+    self.spool_writes_total = 0
+    self.connected_clients = 0
+    self.frame_times = collections.deque(maxlen=64)
+    # phase -> seconds, eg listen / vision_import / camera_open / first_frame
+    self.startup_s = {}
+
+  def observe(self, stage, seconds):
+    self.stages[stage].observe(seconds)
+    self.last_stage_s[stage] = seconds
+
+  def frame_done(self):
+    self.frames_total += 1
+    self.frame_times.append(time.monotonic())
+    for stage in self.last_stage_s:
+      self.last_stage_s[stage] = 0.0
+
+  def fps(self):
+    if len(self.frame_times) < 2:
+      return 0.0
+    elapsed_s = self.frame_times[-1] - self.frame_times[0]
+    if elapsed_s <= 0.0:
+      return 0.0
+    return (len(self.frame_times) - 1) / elapsed_s
+
+  def render_prometheus(self):
+    p = METRIC_PREFIX
+    lines = []
+    lines.append(f'# HELP {p}_stage_seconds Time spent in each frame pipeline stage.')
+    lines.append(f'# TYPE {p}_stage_seconds histogram')
+    for name, h in self.stages.items():
+      cumulative = 0
+      for bound, c in zip(h.buckets, h.counts):
+        cumulative += c
+        lines.append(f'{p}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+      lines.append(f'{p}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {h.count}')
+      lines.append(f'{p}_stage_seconds_sum{{stage="{name}"}} {h.sum:.6f}')
+      lines.append(f'{p}_stage_seconds_count{{stage="{name}"}} {h.count}')
+
+    lines.append(f'# HELP {p}_stage_seconds_rolling Bucket upper bound holding the quantile over the last {int(ROLLING_WINDOW_S)}s.')
+    lines.append(f'# TYPE {p}_stage_seconds_rolling gauge')
+    for name, h in self.stages.items():
+      for q in (0.5, 0.99):
+        v = h.rolling_quantile(q)
+        if v is not None:
+          lines.append(f'{p}_stage_seconds_rolling{{stage="{name}",quantile="{q}"}} {v}')
+
+    lines.append(f'# TYPE {p}_frames_total counter')
+    lines.append(f'{p}_frames_total {self.frames_total}')
+    lines.append(f'# TYPE {p}_fps gauge')
+    lines.append(f'{p}_fps {self.fps():.2f}')
+    lines.append(f'# TYPE {p}_video_clients gauge')
+    lines.append(f'{p}_video_clients {self.connected_clients}')
+    lines.append(f'# TYPE {p}_video_bytes_sent_total counter')
+    lines.append(f'{p}_video_bytes_sent_total {self.bytes_sent_total}')
+    lines.append(f'# TYPE {p}_spool_writes_total counter')
+    lines.append(f'{p}_spool_writes_total {self.spool_writes_total}')
+    if len(self.startup_s) > 0:
+      lines.append(f'# HELP {p}_startup_seconds Time taken by each startup phase; listen and first_frame are since process start.')
+      lines.append(f'# TYPE {p}_startup_seconds gauge')
+      for phase, seconds in self.startup_s.items():
+        lines.append(f'{p}_startup_seconds{{phase="{phase}"}} {seconds:.3f}')
+    return '\n'.join(lines) + '\n'
+
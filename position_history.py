@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+# Constant-memory history of where the table is, so drift, move durations and how often
+# automove corrects can be looked at after the fact.
+#
+#  - webserver.py samples pmem and /tmp/gpio_motor_is_active every SAMPLE_S and records a sample
+#    when anything changed (or KEEPALIVE_S passed), into preallocated array.array columns.
+#  - Samples are also appended to HISTORY_DIR/position-history.bin as fixed RECORD structs.
+#    Writes are batched every LOG_FLUSH_S and the file rotates at LOG_MAX_BYTES, keeping
+#    LOG_KEEP old files, so the USB stick sees a small write once a minute and bounded space.
+#  - GET /history?from=&to=&points= returns min/max per bucket, computed with numpy over the
+#    columns in place; a week of samples costs the same to serve as ten minutes.
+#
+# Read a log offline (e.g. copied off the stick) with
+#
+#   python position_history.py /mnt/usb1/position-history --points 40
+#
+
+import os
+import sys
+import time
+import array
+import struct
+import argparse
+import traceback
+
+HISTORY_DIR = '/mnt/usb1/position-history'
+LOG_NAME = 'position-history.bin'
+MOTOR_ACTIVE_FILE = '/tmp/gpio_motor_is_active'
+SAMPLE_S = 0.5
+# Record unchanged state at least this often, so any range has points in it
+KEEPALIVE_S = 30.0
+# 20 bytes/sample in memory; 100k samples is ~2MB and days of mostly idle table
+DEFAULT_CAPACITY = 100000
+LOG_FLUSH_S = 60.0
+LOG_MAX_BYTES = 1024 * 1024
+LOG_KEEP = 4
+DEFAULT_POINTS = 500
+MAX_POINTS = 5000
+
+# t, logical_position, step_position, flags
+RECORD = struct.Struct('<dIiI')
+FLAG_MOTOR_ACTIVE = 1
+FLAG_AUTOMOVE = 2 # automove sent a correction since the previous sample
+
+
+class PositionHistory:
+  def __init__(self, capacity=DEFAULT_CAPACITY, log_dir=HISTORY_DIR):
+    self.capacity = capacity
+    self.log_dir = log_dir
+    # Allocated once; append() only overwrites
+    self.t = array.array('d', [0.0]) * capacity
+    self.logical_position = array.array('I', [0]) * capacity
+    self.step_position = array.array('i', [0]) * capacity
+    self.flags = array.array('I', [0]) * capacity
+    self.num_recorded = 0
+    self.last_t = 0.0
+    self.last_state = None # (logical_position, step_position, flags) of the newest sample
+    self.pending_automoves = 0
+    self.pmem_cache = (None, None) # ((mtime_ns, size), (logical_position, step_position))
+    self.log_buf = bytearray()
+    self.last_flush_s = time.monotonic()
+    # Counters
+    self.num_samples_taken = 0
+    self.num_automoves = 0
+    self.num_log_bytes = 0
+    self.num_rotations = 0
+
+  def __len__(self):
+    return min(self.num_recorded, self.capacity)
+
+  def append(self, t, logical_position, step_position, flags, log=True):
+    # Wall clock can step backwards (NTP); keep t sorted so ranges can be binary-searched
+    t = max(t, self.last_t)
+    i = self.num_recorded % self.capacity
+    self.t[i] = t
+    self.logical_position[i] = logical_position
+    self.step_position[i] = step_position
+    self.flags[i] = flags
+    self.num_recorded += 1
+    self.last_t = t
+    self.last_state = (logical_position, step_position, flags)
+    if log and self.log_dir is not None:
+      self.log_buf += RECORD.pack(t, logical_position, step_position, flags)
+
+  def note_automove(self, n=1):
+    self.pending_automoves += n
+    self.num_automoves += n
+
+  def read_pmem(self, pmem_file):
+    # (logical_position, step_position), re-read only when the controller rewrote the file
+    st = os.stat(pmem_file)
+    stat_key = (st.st_mtime_ns, st.st_size)
+    if stat_key != self.pmem_cache[0]:
+      with open(pmem_file, 'rb') as fd:
+        self.pmem_cache = (stat_key, struct.unpack('Ii', fd.read(8)))
+    return self.pmem_cache[1]
+
+  def sample(self, pmem_file, motor_active_file=MOTOR_ACTIVE_FILE, now=None):
+    # Returns True if a sample was recorded
+    now = time.time() if now is None else now
+    try:
+      logical_position, step_position = self.read_pmem(pmem_file)
+    except (FileNotFoundError, struct.error):
+      return False
+    self.num_samples_taken += 1
+    flags = FLAG_MOTOR_ACTIVE if os.path.exists(motor_active_file) else 0
+    if self.pending_automoves > 0:
+      flags |= FLAG_AUTOMOVE
+      self.pending_automoves = 0
+    if (logical_position, step_position, flags) == self.last_state and now - self.last_t < KEEPALIVE_S:
+      return False
+    self.append(now, logical_position, step_position, flags)
+    return True
+
+  # Binary log
+
+  def log_path(self, n=0):
+    return os.path.join(self.log_dir, LOG_NAME if n == 0 else f'{LOG_NAME}.{n}')
+
+  def flush_log(self):
+    # Blocking file IO, webserver.py runs this in an executor
+    if self.log_dir is None or len(self.log_buf) < 1:
+      return 0
+    data = bytes(self.log_buf)
+    self.log_buf.clear()
+    self.last_flush_s = time.monotonic()
+    os.makedirs(self.log_dir, exist_ok=True)
+    with open(self.log_path(), 'ab') as fd:
+      fd.write(data)
+      size = fd.tell()
+    self.num_log_bytes += len(data)
+    if size >= LOG_MAX_BYTES:
+      self.rotate_log()
+    return len(data)
+
+  def flush_due(self):
+    return len(self.log_buf) > 0 and time.monotonic() - self.last_flush_s >= LOG_FLUSH_S
+
+  def rotate_log(self):
+    for n in range(LOG_KEEP, 0, -1):
+      if os.path.exists(self.log_path(n-1)):
+        os.replace(self.log_path(n-1), self.log_path(n))
+    self.num_rotations += 1
+
+  def load_log(self):
+    # Oldest rotated file first, so the ring ends up holding the newest `capacity` samples
+    if self.log_dir is None:
+      return 0
+    num_loaded = 0
+    for n in range(LOG_KEEP, -1, -1):
+      try:
+        with open(self.log_path(n), 'rb') as fd:
+          data = fd.read()
+      except FileNotFoundError:
+        continue
+      # A torn last record (power cut mid-write) is ignored
+      for t, logical_position, step_position, flags in RECORD.iter_unpack(data[:len(data) - (len(data) % RECORD.size)]):
+        self.append(t, logical_position, step_position, flags, log=False)
+        num_loaded += 1
+    # Anything loaded is history, the next sample is recorded even if unchanged
+    self.last_state = None
+    return num_loaded
+
+  # Queries
+
+  def span(self):
+    # (oldest t, newest t) held in memory
+    if len(self) < 1:
+      return (0.0, 0.0)
+    return (self.t[self.num_recorded % self.capacity if self.num_recorded > self.capacity else 0], self.last_t)
+
+  def columns(self, from_t, to_t):
+    # numpy arrays of the samples with from_t <= t <= to_t, oldest first.
+    # The ring holds at most two sorted runs; each is searched in place and only the slice is copied.
+    import numpy # only needed once someone asks for /history, the webserver listens before numpy loads
+    n = len(self)
+    start = self.num_recorded % self.capacity if self.num_recorded > self.capacity else 0
+    runs = [(start, n)] if start == 0 else [(start, self.capacity), (0, start)]
+    views = [
+      numpy.frombuffer(self.t, dtype=numpy.float64),
+      numpy.frombuffer(self.logical_position, dtype=numpy.uint32),
+      numpy.frombuffer(self.step_position, dtype=numpy.int32),
+      numpy.frombuffer(self.flags, dtype=numpy.uint32),
+    ]
+    parts = [[], [], [], []]
+    for a, b in runs:
+      lo = a + int(numpy.searchsorted(views[0][a:b], from_t, side='left'))
+      hi = a + int(numpy.searchsorted(views[0][a:b], to_t, side='right'))
+      for part, view in zip(parts, views):
+        part.append(view[lo:hi])
+    return tuple(numpy.concatenate(part) for part in parts)
+
+  def downsample(self, from_t, to_t, points=DEFAULT_POINTS):
+    import numpy
+    points = max(1, min(MAX_POINTS, int(points)))
+    t, logical_position, step_position, flags = self.columns(from_t, to_t)
+    result = {
+      'from': from_t,
+      'to': to_t,
+      'samples': len(t),
+    }
+    if len(t) <= points:
+      # Few enough to send as-is; min == max
+      starts = numpy.arange(len(t))
+    else:
+      edges = numpy.linspace(from_t, to_t, points + 1)
+      starts = numpy.searchsorted(t, edges[:-1], side='left')
+      ends = numpy.searchsorted(t, edges[1:], side='left')
+      ends[-1] = len(t)
+      # t is sorted, so each non-empty bucket is one contiguous run starting where the next one ends
+      starts = starts[starts < ends]
+    if len(starts) < 1:
+      for k in ('t', 'step_position_min', 'step_position_max', 'logical_position_min', 'logical_position_max', 'motor_active', 'automoves'):
+        result[k] = []
+      return result
+    result['t'] = t[starts].tolist()
+    result['step_position_min'] = numpy.minimum.reduceat(step_position, starts).tolist()
+    result['step_position_max'] = numpy.maximum.reduceat(step_position, starts).tolist()
+    result['logical_position_min'] = numpy.minimum.reduceat(logical_position, starts).tolist()
+    result['logical_position_max'] = numpy.maximum.reduceat(logical_position, starts).tolist()
+    result['motor_active'] = (numpy.bitwise_or.reduceat(flags, starts) & FLAG_MOTOR_ACTIVE > 0).tolist()
+    result['automoves'] = numpy.add.reduceat((flags & FLAG_AUTOMOVE > 0).astype(numpy.int32), starts).tolist()
+    return result
+
+  def stats_s(self):
+    return f'{len(self)} of {self.capacity} samples ({self.num_recorded} recorded, {self.num_automoves} automoves), {self.num_log_bytes} bytes logged to {self.log_dir}, {self.num_rotations} rotations'
+
+
+def main(args=sys.argv):
+  parser = argparse.ArgumentParser(description='Print a downsampled position history log')
+  parser.add_argument('log_dir', nargs='?', default=HISTORY_DIR)
+  parser.add_argument('--from', dest='from_t', type=float, default=None, help='Unix seconds, default the oldest sample')
+  parser.add_argument('--to', dest='to_t', type=float, default=None, help='Unix seconds, default the newest sample')
+  parser.add_argument('--points', type=int, default=40)
+  opts = parser.parse_args(args[1:])
+
+  history = PositionHistory(log_dir=opts.log_dir)
+  try:
+    num_loaded = history.load_log()
+  except:
+    traceback.print_exc()
+    return 1
+  oldest_t, newest_t = history.span()
+  from_t = oldest_t if opts.from_t is None else opts.from_t
+  to_t = newest_t if opts.to_t is None else opts.to_t
+  result = history.downsample(from_t, to_t, opts.points)
+  print(f'{num_loaded} samples loaded, {result["samples"]} in range')
+  print(f'{"time":>19} {"step min":>9} {"step max":>9} {"pos":>5} {"moving":>6} {"automoves":>9}')
+  for i in range(0, len(result['t'])):
+    pos = f'{result["logical_position_min"][i]+1}' if result['logical_position_min'][i] == result['logical_position_max'][i] else f'{result["logical_position_min"][i]+1}-{result["logical_position_max"][i]+1}'
+    print(f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(result["t"][i]))} {result["step_position_min"][i]:>9} {result["step_position_max"][i]:>9} {pos:>5} {result["motor_active"][i]!s:>6} {result["automoves"][i]:>9}')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,98 @@
+
+# Per-position reference images of the table rail, captured when a position is saved with '='.
+# After a move, cv2.phaseCorrelate against the saved slot gives a sub-pixel table offset
+# in one FFT, which webserver.py prefers over rail_detector's threshold scan when confident.
+
+# Keep next to pmem.bin; one compressed .npz holds all num_positions slots
+TEMPLATES_FILE = '/mnt/usb1/position-templates.npz'
+num_positions = 12
+
+# Rows (crop-space at 640x480, relative to table_rail_y) we correlate. Only the table side of the image is
+# used because the layout rail never moves in frame and would pull the estimate towards 0.
+TEMPLATE_BAND_ABOVE_PX = 48
+TEMPLATE_BAND_BELOW_PX = 8
+
+# phaseCorrelate response below this means the template no longer matches the scene
+PHASE_CORRELATE_MIN_RESPONSE = 0.15
+
+import os
+import traceback
+
+import rail_detector
+
+import cv2
+import numpy
+
+
+class PositionTemplates:
+
+  def __init__(self, geometry=None, templates_file=TEMPLATES_FILE):
+    self.geometry = geometry if geometry is not None else rail_detector.RailGeometry()
+    self.templates_file = templates_file
+    g = self.geometry
+    sy = float(g.frame_h) / float(rail_detector.FRAME_H)
+    self.band_y0 = max(0, g.crop_table_rail_y - int(round(TEMPLATE_BAND_ABOVE_PX * sy)))
+    self.band_y1 = min(g.crop_h, g.crop_table_rail_y + int(round(TEMPLATE_BAND_BELOW_PX * sy)))
+    band_shape = (self.band_y1 - self.band_y0, g.crop_w)
+
+    self.templates = numpy.zeros((num_positions, ) + band_shape, dtype=numpy.uint8)
+    self.valid = numpy.zeros((num_positions, ), dtype=numpy.bool_)
+    # float32 copies phaseCorrelate consumes, computed once per slot instead of once per frame
+    self.templates_f32 = [None] * num_positions
+    self.window = cv2.createHanningWindow((band_shape[1], band_shape[0]), cv2.CV_32F)
+
+  def band(self, img):
+    # img is a full frame; returns the grayscale band we correlate against
+    g = self.geometry
+    cropped = img[g.crop_y+self.band_y0:g.crop_y+self.band_y1, g.crop_x:g.crop_x+g.crop_w]
+    return cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY)
+
+  def has(self, slot):
+    return slot is not None and 0 <= slot < num_positions and bool(self.valid[slot])
+
+  def load(self):
+    if not os.path.exists(self.templates_file):
+      return self
+    try:
+      with numpy.load(self.templates_file) as data:
+        if data['templates'].shape != self.templates.shape:
+          print(f'WARNING: {self.templates_file} has shape {data["templates"].shape}, expected {self.templates.shape}; ignoring saved templates')
+          return self
+        self.templates[:] = data['templates']
+        self.valid[:] = data['valid']
+      for slot in range(0, num_positions):
+        if self.valid[slot]:
+          self.templates_f32[slot] = self.templates[slot].astype(numpy.float32)
+      print(f'Loaded {int(self.valid.sum())} position templates from {self.templates_file}')
+    except:
+      traceback.print_exc()
+    return self
+
+  def save(self):
+    tmp_file = self.templates_file + '.tmp'
+    with open(tmp_file, 'wb') as fd:
+      numpy.savez_compressed(fd, templates=self.templates, valid=self.valid)
+    os.replace(tmp_file, self.templates_file)
+
+  def capture(self, slot, img):
+    if slot is None or slot < 0 or slot >= num_positions:
+      print(f'Refusing to capture template for invalid slot {slot}')
+      return
+    self.templates[slot] = self.band(img)
+    self.valid[slot] = True
+    self.templates_f32[slot] = self.templates[slot].astype(numpy.float32)
+    self.save()
+    print(f'Captured position template for slot {slot} to {self.templates_file}')
+
+  def align(self, slot, img):
+    # Returns (rail_px_diff, response) using the same sign convention as RailDetection.rail_x1_diff,
+    # or None if there is no template or it does not match well enough.
+    if not self.has(slot):
+      return None
+    current_f32 = self.band(img).astype(numpy.float32)
+    (dx, _dy), response = cv2.phaseCorrelate(self.templates_f32[slot], current_f32, self.window)
+    if response < PHASE_CORRELATE_MIN_RESPONSE:
+      return None
+    # Template was captured with the table aligned, so the table has moved dx px right of where it should be.
+    return -dx, response
+
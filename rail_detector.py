@@ -0,0 +1,576 @@
+#!/usr/bin/env python
+
+# Shared rail detector used by webserver.py and the research tools under old_code/.
+# camera-display/src/main.rs is a Rust port of the same algorithm; keep constants in sync.
+#
+# Every backend implements
+#   detect(img) -> RailDetection
+#   render_debug(result) -> BGR debug image (optional, only needed when someone looks at it)
+# and registers itself in DETECTOR_BACKENDS. The reference backend is the original
+# per-pixel python loop; faster backends MUST produce identical RailDetection.key() values,
+# which is checked by running this file directly:
+#
+#   python rail_detector.py research-photos/*.png
+#
+
+import os
+import sys
+import subprocess
+import traceback
+import time
+import dataclasses
+import typing
+import functools
+
+py_env_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.py-env')
+os.makedirs(py_env_dir, exist_ok=True)
+if not py_env_dir in sys.path:
+  sys.path.insert(0, py_env_dir)
+
+try:
+  import cv2
+except:
+  subprocess.run([
+    sys.executable, '-m', 'pip', 'install', f'--target={py_env_dir}', 'opencv-python'
+  ])
+  import cv2
+
+try:
+  import numpy
+except:
+  subprocess.run([
+    sys.executable, '-m', 'pip', 'install', f'--target={py_env_dir}', 'numpy'
+  ])
+  import numpy
+
+
+# Manually measured against 640x480 frames from the table camera.
+# Cameras delivering another size get a RailGeometry.scaled_to() copy instead of resized frames.
+FRAME_W = 640
+FRAME_H = 480
+
+@dataclasses.dataclass
+class RailGeometry:
+  # Frame size every pixel constant below was measured at
+  frame_w: int = FRAME_W
+  frame_h: int = FRAME_H
+  # Section of the frame we measure
+  crop_x: int = 175
+  crop_y: int = 200
+  crop_w: int = 425 - 175
+  crop_h: int = 400 - 200
+  # Absolute Y coordinates of the table rail and layout-side rail, converted at-time-of-use
+  table_rail_y: int = 330
+  layout_rail_y: int = 350
+  rail_pair_width_px: int = 96 # measured center-to-center
+  # The true average segmentation includes too much non-rail material -
+  # therefore we increase the "average" brightness up by this factor to capture
+  # somethig closer to the top 25% brightness values
+  brightness_threshold_mult: float = 1.35
+  clip_hist_percent: float = 20
+  # When True rail indexes point at the center of the bright run, else the left edge
+  center_rails: bool = True
+  max_allowed_rail_offset: int = 1
+
+  def scaled_to(self, frame_w, frame_h):
+    # Scale every pixel constant once, so frames of any size can be cropped directly.
+    if frame_w == self.frame_w and frame_h == self.frame_h:
+      return self
+    sx = float(frame_w) / float(self.frame_w)
+    sy = float(frame_h) / float(self.frame_h)
+    return dataclasses.replace(self,
+      frame_w=frame_w,
+      frame_h=frame_h,
+      crop_x=int(round(self.crop_x * sx)),
+      crop_y=int(round(self.crop_y * sy)),
+      crop_w=int(round(self.crop_w * sx)),
+      crop_h=int(round(self.crop_h * sy)),
+      table_rail_y=int(round(self.table_rail_y * sy)),
+      layout_rail_y=int(round(self.layout_rail_y * sy)),
+      rail_pair_width_px=max(1, int(round(self.rail_pair_width_px * sx))),
+      max_allowed_rail_offset=max(1, int(round(self.max_allowed_rail_offset * sx))),
+    )
+
+  @property
+  def crop_table_rail_y(self):
+    return self.table_rail_y - self.crop_y
+
+  @property
+  def crop_layout_rail_y(self):
+    return self.layout_rail_y - self.crop_y
+
+
+@dataclasses.dataclass
+class RailDetection:
+  geometry: RailGeometry
+  alpha: float
+  beta: float
+  # None until render_debug() for backends that only contrast-adjust the scanned rows
+  auto_adj_img: typing.Any
+  # Un-adjusted crop and the contrast table, kept so auto_adj_img can be built lazily
+  cropped: typing.Any = None
+  contrast_lut: typing.Any = None
+  # Contrast-adjusted (table, layout) rows for backends that skip auto_adj_img
+  adjusted_rows: typing.Any = None
+  # Filled in by scan()
+  table_rail_signal: typing.Any = None
+  layout_rail_signal: typing.Any = None
+  # (x1, x2) in crop-space or None
+  table_rail_idxs: typing.Optional[typing.Tuple[int, int]] = None
+  layout_rail_idxs: typing.Optional[typing.Tuple[int, int]] = None
+  # layout_x1 - table_x1, or None when no rails are visible.
+  rail_x1_diff: typing.Optional[int] = None
+
+  @property
+  def rail_px_diff(self):
+    # What the automove logic acts on; None when rails are missing OR already aligned.
+    if self.rail_x1_diff is None or abs(self.rail_x1_diff) <= self.geometry.max_allowed_rail_offset:
+      return None
+    return self.rail_x1_diff
+
+  def key(self):
+    # Everything a backend must agree on
+    return (
+      self.alpha, self.beta,
+      self.table_rail_idxs, self.layout_rail_idxs, self.rail_px_diff,
+      tuple(bool(x) for x in self.table_rail_signal),
+      tuple(bool(x) for x in self.layout_rail_signal),
+    )
+
+
+DETECTOR_BACKENDS = {}
+
+def register_backend(name):
+  def register(cls):
+    cls.backend_name = name
+    DETECTOR_BACKENDS[name] = cls
+    return cls
+  return register
+
+def get_detector(name=None, geometry=None):
+  if name is None:
+    name = os.environ.get('RAIL_DETECTOR', 'numpy-lut')
+  if not name in DETECTOR_BACKENDS:
+    raise Exception(f'Unknown rail detector backend {name}, known backends are {list(DETECTOR_BACKENDS.keys())}')
+  return DETECTOR_BACKENDS[name](geometry)
+
+
+def brightness_from_px(pixel):
+  if len(pixel) == 3:
+    # Assume BGR
+    B = int(pixel[0])
+    G = int(pixel[1])
+    R = int(pixel[2])
+    return int( float(R+R+R+B+G+G+G+G)/6.0 ) # Fast approx from https://stackoverflow.com/a/596241
+
+  elif len(pixel) == 1:
+    # Assume gray
+    return pixel[0]
+
+  else:
+    raise Exception(f'Error, bad pixel value! pixel = {pixel}')
+
+def count_num_true_ahead(signal, begin_i):
+  num_true_ahead = 0
+  for i in range(begin_i, len(signal)):
+    if not signal[i]:
+      break
+    num_true_ahead += 1
+  return num_true_ahead
+
+
+@register_backend('python')
+class PythonRailDetector:
+  # Reference implementation, a straight port of the original per-pixel loops.
+
+  def __init__(self, geometry=None):
+    self.geometry = geometry if geometry is not None else RailGeometry()
+
+  def crop(self, img):
+    g = self.geometry
+    return img[g.crop_y:g.crop_y+g.crop_h, g.crop_x:g.crop_x+g.crop_w]
+
+  def calc_alpha_beta_auto_brightness_adj(self, gray_img):
+    # See https://stackoverflow.com/questions/56905592/automatic-contrast-and-brightness-adjustment-of-a-color-photo-of-a-sheet-of-pape
+    clip_hist_percent = self.geometry.clip_hist_percent
+
+    # Calculate grayscale histogram
+    hist = cv2.calcHist([gray_img],[0],None,[256],[0,256]).ravel()
+    hist_size = len(hist)
+
+    # Calculate cumulative distribution from the histogram
+    accumulator = []
+    accumulator.append(float(hist[0]))
+    for index in range(1, hist_size):
+        accumulator.append(accumulator[index -1] + float(hist[index]))
+
+    # Locate points to clip
+    maximum = accumulator[-1]
+    clip_hist_percent *= (maximum/100.0)
+    clip_hist_percent /= 2.0
+
+    # Locate left cut
+    minimum_gray = 0
+    while accumulator[minimum_gray] < clip_hist_percent:
+        minimum_gray += 1
+
+    # Locate right cut
+    maximum_gray = hist_size -1
+    while accumulator[maximum_gray] >= (maximum - clip_hist_percent):
+        maximum_gray -= 1
+
+    # Calculate alpha and beta values
+    alpha = 255 / (maximum_gray - minimum_gray)
+    beta = -minimum_gray * alpha
+
+    return alpha, beta
+
+  def auto_adjust(self, cropped):
+    # Normalize contrast and brightness so changes in room lighting do not break the scan below.
+    gray = cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY)
+    alpha, beta = self.calc_alpha_beta_auto_brightness_adj(gray)
+    auto_adj_img = cv2.convertScaleAbs(cropped, alpha=alpha, beta=beta)
+    return alpha, beta, auto_adj_img
+
+  def rail_signals(self, auto_adj_img):
+    g = self.geometry
+    # Scan along table_rail_y to find two high signals approx rail_pair_width_px apart,
+    # and record X coords of both.
+    table_rail_brightnesses = []
+    layout_rail_brightnesses = []
+    for x in range(0, g.crop_w):
+      table_rail_brightnesses.append(
+        brightness_from_px(auto_adj_img[g.crop_table_rail_y,x])
+      )
+      layout_rail_brightnesses.append(
+        brightness_from_px(auto_adj_img[g.crop_layout_rail_y,x])
+      )
+
+    avg_table_rail_brightnesses = sum(table_rail_brightnesses) / len(table_rail_brightnesses)
+    avg_layout_rail_brightnesses = sum(layout_rail_brightnesses) / len(layout_rail_brightnesses)
+
+    avg_table_rail_brightnesses *= g.brightness_threshold_mult
+    avg_layout_rail_brightnesses *= g.brightness_threshold_mult
+
+    table_rail_signal = [x > avg_table_rail_brightnesses for x in table_rail_brightnesses]
+    layout_rail_signal = [x > avg_layout_rail_brightnesses for x in layout_rail_brightnesses]
+    return table_rail_signal, layout_rail_signal
+
+  def find_rail_pair(self, signal):
+    # Scan for the FIRST rail from the left ->
+    # by checking the signal True values AND reading the same TRUE value
+    # rail_pair_width_px items later
+    g = self.geometry
+    for x in range(0, len(signal)-g.rail_pair_width_px):
+      if signal[x] and signal[x+g.rail_pair_width_px]:
+        center_offset = 0
+        if g.center_rails:
+          center_offset = int(count_num_true_ahead(signal, x) // 2)
+        return (x + center_offset, x + g.rail_pair_width_px + center_offset)
+    return None
+
+  # detect() is split in two so callers can time the contrast and scan stages separately
+  def detect(self, img):
+    return self.scan(self.adjust(img))
+
+  def adjust(self, img):
+    cropped = self.crop(img)
+    alpha, beta, auto_adj_img = self.auto_adjust(cropped)
+    return RailDetection(
+      geometry=self.geometry,
+      alpha=alpha,
+      beta=beta,
+      auto_adj_img=auto_adj_img,
+      cropped=cropped,
+    )
+
+  def rail_signals_for(self, result):
+    return self.rail_signals(result.auto_adj_img)
+
+  def scan(self, result):
+    result.table_rail_signal, result.layout_rail_signal = self.rail_signals_for(result)
+    result.table_rail_idxs = self.find_rail_pair(result.table_rail_signal)
+    result.layout_rail_idxs = self.find_rail_pair(result.layout_rail_signal)
+
+    result.rail_x1_diff = None
+    if result.table_rail_idxs is not None and result.layout_rail_idxs is not None:
+      result.rail_x1_diff = result.layout_rail_idxs[0] - result.table_rail_idxs[0]
+
+    return result
+
+  def render_debug(self, result, out=None):
+    # For diagnostics, we write to a copy so our output doesn't change the image being processed.
+    # out is an optional preallocated crop_h x crop_w x 3 uint8 image to draw into instead of a new copy.
+    g = result.geometry
+    crop_w, crop_h = g.crop_w, g.crop_h
+    crop_table_rail_y = g.crop_table_rail_y
+    crop_layout_rail_y = g.crop_layout_rail_y
+    if out is None:
+      debug_adj_img = result.auto_adj_img.copy()
+    else:
+      debug_adj_img = out
+      if result.auto_adj_img is not out:
+        numpy.copyto(debug_adj_img, result.auto_adj_img)
+
+    # Log debug assumptions
+    cv2.line(debug_adj_img, (0, crop_table_rail_y), (crop_w, crop_table_rail_y), (255, 0, 0), thickness=1)
+    cv2.line(debug_adj_img, (0, crop_layout_rail_y), (crop_w, crop_layout_rail_y), (0, 255, 0), thickness=1)
+
+    # Signals as white/black bars under each rail line
+    white = numpy.array([255,255,255], dtype=numpy.uint8)
+    for rail_y, signal in ((crop_table_rail_y, result.table_rail_signal), (crop_layout_rail_y, result.layout_rail_signal)):
+      bar = white * numpy.asarray(signal, dtype=numpy.uint8)[:, None]
+      debug_adj_img[min(crop_h-1, rail_y+1), :len(signal)] = bar
+      debug_adj_img[min(crop_h-1, rail_y+2), :len(signal)] = bar
+
+    for rail_y, idxs in ((crop_table_rail_y, result.table_rail_idxs), (crop_layout_rail_y, result.layout_rail_idxs)):
+      if idxs is None:
+        continue
+      # Log the rail!
+      x1, x2 = idxs
+      debug_adj_img[min(crop_h-1, rail_y+3), x1] = [0,0,255]
+      debug_adj_img[min(crop_h-1, rail_y+4), x1] = [0,0,255]
+
+      debug_adj_img[min(crop_h-1, rail_y+3), min(crop_w-1, x2)] = [0,0,255]
+      debug_adj_img[min(crop_h-1, rail_y+4), min(crop_w-1, x2)] = [0,0,255]
+
+    if result.rail_x1_diff is not None:
+      table_x1 = result.table_rail_idxs[0]
+      layout_x1 = result.layout_rail_idxs[0]
+      if result.rail_px_diff is not None:
+        cv2.arrowedLine(debug_adj_img, (table_x1, crop_table_rail_y-10), (layout_x1, crop_table_rail_y-10), (0,0,0), 2)
+        cv2.arrowedLine(debug_adj_img, (table_x1, crop_table_rail_y-10), (layout_x1, crop_table_rail_y-10), (0,0,255), 1)
+      else:
+        # Rail position good!
+        cv2.arrowedLine(debug_adj_img, (table_x1, max(0, crop_table_rail_y-60) ), (layout_x1, crop_table_rail_y), (0,0,0), 2)
+        cv2.arrowedLine(debug_adj_img, (table_x1, max(0, crop_table_rail_y-60) ), (layout_x1, crop_table_rail_y), (0,255,0), 1)
+
+    else:
+      # No rails found!
+      cv2.putText(debug_adj_img,'[NO RAIL]',
+        (int(crop_w/6), max(0, crop_table_rail_y-40)),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        1, (0,0,0), 2, 2
+      )
+      cv2.putText(debug_adj_img,'[NO RAIL]',
+        (int(crop_w/6), max(0, crop_table_rail_y-40)),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        1, (0,0,255), 1, 2
+      )
+
+    return debug_adj_img
+
+
+@register_backend('numpy')
+class NumpyRailDetector(PythonRailDetector):
+  # Same math as the reference backend, with the per-pixel loops replaced by array operations.
+
+  def calc_alpha_beta_auto_brightness_adj(self, gray_img):
+    return alpha_beta_from_cut_points(*self.calc_gray_cut_points(gray_img))
+
+  def calc_gray_cut_points(self, gray_img):
+    hist = cv2.calcHist([gray_img],[0],None,[256],[0,256]).ravel()
+    accumulator = numpy.cumsum(hist, dtype=numpy.float64)
+
+    maximum = float(accumulator[-1])
+    clip_hist_percent = self.geometry.clip_hist_percent * (maximum/100.0)
+    clip_hist_percent /= 2.0
+
+    # First index >= the left cut, last index < the right cut
+    minimum_gray = int(numpy.searchsorted(accumulator, clip_hist_percent, side='left'))
+    maximum_gray = int(numpy.searchsorted(accumulator, maximum - clip_hist_percent, side='left')) - 1
+
+    return minimum_gray, maximum_gray
+
+  def rail_signals(self, auto_adj_img):
+    g = self.geometry
+    return self.rail_signals_from_rows(auto_adj_img[[g.crop_table_rail_y, g.crop_layout_rail_y], :g.crop_w])
+
+  def rail_signals_from_rows(self, rows):
+    # rows is the contrast-adjusted (2, crop_w, 3) table rail and layout rail rows
+    g = self.geometry
+    rows = rows.astype(numpy.int32)
+    # Same integer approximation as brightness_from_px, (R+R+R+B+G+G+G+G)/6
+    brightnesses = (rows[:, :, 0] + 4 * rows[:, :, 1] + 3 * rows[:, :, 2]) // 6
+    thresholds = (brightnesses.sum(axis=1) / brightnesses.shape[1]) * g.brightness_threshold_mult
+    signals = brightnesses > thresholds[:, None]
+    return signals[0], signals[1]
+
+  def find_rail_pair(self, signal):
+    g = self.geometry
+    pw = g.rail_pair_width_px
+    if len(signal) <= pw:
+      return None
+    candidates = numpy.flatnonzero(signal[:-pw] & signal[pw:])
+    if len(candidates) < 1:
+      return None
+    x = int(candidates[0])
+    center_offset = 0
+    if g.center_rails:
+      run_ends = numpy.flatnonzero(~signal[x:])
+      run_len = int(run_ends[0]) if len(run_ends) > 0 else len(signal) - x
+      center_offset = run_len // 2
+    return (x + center_offset, x + pw + center_offset)
+
+
+def alpha_beta_from_cut_points(minimum_gray, maximum_gray):
+  alpha = 255 / (maximum_gray - minimum_gray)
+  beta = -minimum_gray * alpha
+  return alpha, beta
+
+# alpha/beta only ever come from the two integer histogram cut points, so keying on those
+# is an exact quantization; a stable scene reuses one or two tables.
+CONTRAST_LUT_CACHE_SIZE = 32
+
+@functools.lru_cache(maxsize=CONTRAST_LUT_CACHE_SIZE)
+def contrast_lut(minimum_gray, maximum_gray):
+  # Running every possible pixel value through convertScaleAbs gives a table cv2.LUT applies
+  # bit-identically to convertScaleAbs, without the per-pixel float multiply-add.
+  alpha, beta = alpha_beta_from_cut_points(minimum_gray, maximum_gray)
+  lut = cv2.convertScaleAbs(numpy.arange(0, 256, dtype=numpy.uint8), alpha=alpha, beta=beta)
+  lut.flags.writeable = False
+  return lut
+
+
+@register_backend('numpy-lut')
+class LutRailDetector(NumpyRailDetector):
+  # Applies the contrast stretch through a cached 256-entry cv2.LUT table, and only to the two rows
+  # the scan reads. The full adjusted crop is built by render_debug, only when someone looks at it.
+
+  def adjust(self, img):
+    g = self.geometry
+    cropped = self.crop(img)
+    gray = cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY)
+    minimum_gray, maximum_gray = self.calc_gray_cut_points(gray)
+    alpha, beta = alpha_beta_from_cut_points(minimum_gray, maximum_gray)
+    lut = contrast_lut(minimum_gray, maximum_gray)
+    return RailDetection(
+      geometry=g,
+      alpha=alpha,
+      beta=beta,
+      auto_adj_img=None,
+      cropped=cropped,
+      contrast_lut=lut,
+      adjusted_rows=cv2.LUT(cropped[[g.crop_table_rail_y, g.crop_layout_rail_y], :g.crop_w], lut),
+    )
+
+  def rail_signals_for(self, result):
+    return self.rail_signals_from_rows(result.adjusted_rows)
+
+  def render_debug(self, result, out=None):
+    if result.auto_adj_img is None:
+      if out is not None:
+        # Apply the LUT straight into the caller's buffer, the lines drawn next go on top of it
+        cv2.LUT(result.cropped, result.contrast_lut, dst=out)
+        return super().render_debug(dataclasses.replace(result, auto_adj_img=out), out=out)
+      result.auto_adj_img = cv2.LUT(result.cropped, result.contrast_lut)
+    return super().render_debug(result, out=out)
+
+
+class StaticSceneGate:
+  # Cheap check run before detect(): while a downsampled copy of the ROI matches the last
+  # frame we fully analysed, callers may reuse that frame's results.
+  # The comparison is against the last *analysed* frame, not the previous frame, so slow
+  # drift still trips the gate once it adds up.
+
+  def __init__(self, geometry=None, downsample=8, max_mean_abs_diff=2.0, force_every_s=5.0):
+    self.geometry = geometry if geometry is not None else RailGeometry()
+    self.thumb_size = (max(1, self.geometry.crop_w // downsample), max(1, self.geometry.crop_h // downsample))
+    self.max_mean_abs_diff = max_mean_abs_diff
+    self.force_every_s = force_every_s
+    self.reference = None
+    self.last_analysed_s = 0.0
+    self.last_reason = None
+    # Counters, read by webserver.py for /status
+    self.num_analysed = 0
+    self.num_skipped = 0
+    self.num_forced = 0
+    # Largest mean diff we decided was "unchanged"; how close we came to a missed change
+    self.max_skipped_diff = 0.0
+    # Forced refreshes whose result differed from what we had been reusing
+    self.num_stale_on_refresh = 0
+
+  def thumbnail(self, img):
+    g = self.geometry
+    cropped = img[g.crop_y:g.crop_y+g.crop_h, g.crop_x:g.crop_x+g.crop_w]
+    return cv2.cvtColor(cv2.resize(cropped, self.thumb_size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+
+  def should_analyse(self, img, force=False):
+    thumb = self.thumbnail(img)
+    now = time.monotonic()
+    mean_diff = None
+    if self.reference is not None:
+      mean_diff = cv2.norm(thumb, self.reference, cv2.NORM_L1) / thumb.size
+
+    if force:
+      self.last_reason = 'active'
+    elif mean_diff is None or mean_diff > self.max_mean_abs_diff:
+      self.last_reason = 'changed'
+    elif now - self.last_analysed_s > self.force_every_s:
+      self.last_reason = 'forced'
+      self.num_forced += 1
+    else:
+      self.last_reason = 'skipped'
+      self.num_skipped += 1
+      self.max_skipped_diff = max(self.max_skipped_diff, mean_diff)
+      return False
+
+    self.reference = thumb
+    self.last_analysed_s = now
+    self.num_analysed += 1
+    return True
+
+  def stats_s(self):
+    return f'analysed = {self.num_analysed}, skipped = {self.num_skipped}, forced = {self.num_forced}, stale_on_refresh = {self.num_stale_on_refresh}, max_skipped_diff = {self.max_skipped_diff:.2f}'
+
+
+def cross_check(frames, backend_names=None, geometry=None, iterations=1):
+  # Runs every backend over every frame, raising if any backend disagrees with the first one.
+  # Returns {backend_name: seconds_per_frame}
+  if backend_names is None:
+    backend_names = list(DETECTOR_BACKENDS.keys())
+  detectors = [get_detector(name, geometry) for name in backend_names]
+  timings = {name: 0.0 for name in backend_names}
+  for frame_i, frame in enumerate(frames):
+    reference_key = None
+    for name, detector in zip(backend_names, detectors):
+      start = time.perf_counter()
+      for _ in range(0, iterations):
+        result = detector.detect(frame)
+      timings[name] += (time.perf_counter() - start) / iterations
+      key = result.key()
+      if reference_key is None:
+        reference_key = key
+      elif key != reference_key:
+        raise AssertionError(f'Backend {name} disagrees with {backend_names[0]} on frame {frame_i}: {key[:5]} != {reference_key[:5]}')
+  return {name: s / max(1, len(frames)) for name, s in timings.items()}
+
+
+def main(args=sys.argv):
+  frames = []
+  for img_f in args[1:]:
+    img = cv2.imread(img_f, cv2.IMREAD_COLOR)
+    if img is None:
+      print(f'Cannot read {img_f}, skipping')
+      continue
+    frames.append(img)
+
+  if len(frames) < 1:
+    print(f'Usage: {args[0]} research-photos/*.png')
+    return 1
+
+  iterations = int(os.environ.get('ITERATIONS', '3'))
+  try:
+    timings = cross_check(frames, iterations=iterations)
+  except AssertionError:
+    traceback.print_exc()
+    return 1
+
+  print(f'All {len(DETECTOR_BACKENDS)} backends agree on {len(frames)} frames')
+  for name, s in timings.items():
+    print(f'{name:>12} {s*1000.0:8.3f}ms/frame')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# The web UI's HTML/CSS/JS (webui/) built once at startup instead of formatted per request.
+#
+#  - Every asset is kept as identity, gzip and (when the brotli module is installed) brotli bytes;
+#    the response picks one from Accept-Encoding, so nothing is compressed per request.
+#  - Each variant has a strong ETag from its content hash; If-None-Match answers 304.
+#  - CSS/JS are served under content-hashed names (/static/app.<hash>.js) with a year-long immutable
+#    Cache-Control, and the HTML pages that reference them are no-cache. A revisit is one 304 for
+#    the page; the dynamic parts come from /status.json and /motion.
+#
+# {{app.js}} in an HTML asset becomes the hashed URL of app.js; other {{NAME}} come from build(substitutions=).
+#
+#   python static_assets.py       # print sizes and URLs of what webserver.py would serve
+#
+
+import os
+import sys
+import gzip
+import hashlib
+import argparse
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+import aiohttp.web
+
+WEBUI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'webui')
+STATIC_PREFIX = '/static/'
+CONTENT_TYPES = {
+  '.html': 'text/html; charset=utf-8',
+  '.css': 'text/css; charset=utf-8',
+  '.js': 'text/javascript; charset=utf-8',
+}
+HTML_CACHE_CONTROL = 'no-cache'
+HASHED_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Preference order when the client accepts several
+ENCODINGS = ('br', 'gzip')
+
+
+class StaticAsset:
+  def __init__(self, name, body, content_type, cache_control):
+    self.name = name
+    self.content_type = content_type
+    self.cache_control = cache_control
+    digest = hashlib.sha256(body).hexdigest()[:20]
+    self.hash = digest[:10]
+    # encoding -> (bytes, etag); '' is identity
+    self.variants = {'': (body, f'"{digest}"')}
+    compressed = gzip.compress(body, compresslevel=9, mtime=0)
+    if len(compressed) < len(body):
+      self.variants['gzip'] = (compressed, f'"{digest}-gz"')
+    if brotli is not None:
+      compressed = brotli.compress(body, quality=11)
+      if len(compressed) < len(body):
+        self.variants['br'] = (compressed, f'"{digest}-br"')
+
+  def pick(self, accept_encoding):
+    accepted = [e.split(';', 1)[0].strip().lower() for e in accept_encoding.split(',')]
+    for encoding in ENCODINGS:
+      if encoding in accepted and encoding in self.variants:
+        return encoding
+    return ''
+
+  def response(self, request):
+    encoding = self.pick(request.headers.get('Accept-Encoding', ''))
+    body, etag = self.variants[encoding]
+    headers = {
+      'ETag': etag,
+      'Cache-Control': self.cache_control,
+      'Vary': 'Accept-Encoding',
+    }
+    if_none_match = request.headers.get('If-None-Match', '')
+    if if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')]:
+      return aiohttp.web.Response(status=304, headers=headers)
+    if len(encoding) > 0:
+      headers['Content-Encoding'] = encoding
+    headers['Content-Type'] = self.content_type
+    return aiohttp.web.Response(body=body, headers=headers)
+
+
+class StaticAssets:
+  def __init__(self):
+    self.by_path = {}
+
+  def build(self, webui_dir=WEBUI_DIR, pages=None, substitutions=None):
+    # pages: {url path: html file name}; every non-HTML file in webui_dir is served hashed under STATIC_PREFIX
+    substitutions = dict(substitutions or {})
+    names = sorted(os.listdir(webui_dir))
+    for name in names:
+      ext = os.path.splitext(name)[1]
+      if ext == '.html' or ext not in CONTENT_TYPES:
+        continue
+      with open(os.path.join(webui_dir, name), 'rb') as fd:
+        asset = StaticAsset(name, fd.read(), CONTENT_TYPES[ext], HASHED_CACHE_CONTROL)
+      root, ext = os.path.splitext(name)
+      url = f'{STATIC_PREFIX}{root}.{asset.hash}{ext}'
+      self.by_path[url] = asset
+      substitutions[name] = url
+    for path, name in (pages or {}).items():
+      with open(os.path.join(webui_dir, name), 'r') as fd:
+        html = fd.read()
+      for key, value in substitutions.items():
+        html = html.replace('{{'+key+'}}', str(value))
+      self.by_path[path] = StaticAsset(name, html.encode('utf-8'), CONTENT_TYPES['.html'], HTML_CACHE_CONTROL)
+    return self
+
+  async def handle(self, request):
+    asset = self.by_path.get(request.path, None)
+    if asset is None:
+      raise aiohttp.web.HTTPNotFound()
+    return asset.response(request)
+
+  def routes(self):
+    return [aiohttp.web.get(path, self.handle) for path in self.by_path]
+
+  def stats_s(self):
+    parts = []
+    for path, asset in self.by_path.items():
+      sizes = '/'.join(f'{e or "identity"} {len(b)}' for e, (b, _) in asset.variants.items())
+      parts.append(f'{path} ({sizes})')
+    return ', '.join(parts)
+
+
+def main(args=sys.argv):
+  parser = argparse.ArgumentParser(description='Build the web UI assets and print what would be served')
+  parser.add_argument('--webui-dir', default=WEBUI_DIR)
+  opts = parser.parse_args(args[1:])
+
+  pages = {'/': 'index.html', '/status': 'status.html'}
+  assets = StaticAssets().build(opts.webui_dir, pages)
+  if brotli is None:
+    print('brotli is not installed, serving gzip only')
+  for path, asset in assets.by_path.items():
+    sizes = ' '.join(f'{e or "identity"}={len(b)}' for e, (b, _) in asset.variants.items())
+    print(f'{path:<28} {asset.cache_control:<36} {sizes}')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
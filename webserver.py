@@ -6,6 +6,30 @@ GPIO_MOTOR_KEYS_IN_DIR = "/tmp/gpio_motor_keys_in"
 PASSWORD_FILE = '/mnt/usb1/webserver-password.txt'
 #FRAME_HANDLE_DELAY_S = 0.08
 FRAME_HANDLE_DELAY_S = 0.05
+# While the table is parked and the camera ROI is unchanged, reuse the last analysis, but
+# always re-run it at least this often.
+ANALYSIS_FORCE_EVERY_S = 5.0
+# The camera is reopened in-process with backoff; only an outage this long restarts webserver.service
+CAMERA_OUTAGE_RESTART_S = 600.0
+# With --vision-process, how often the HTTP process looks for a new frame from the worker,
+# and how long the worker may go without a heartbeat before it is killed and restarted
+VISION_PROCESS_POLL_S = 0.02
+VISION_PROCESS_HUNG_S = 90.0
+# The controller holds MOTOR_ACTIVE_FILE for a whole move and touches MOTOR_LAST_ACTIVE_MTIME_FILE at its start and end
+MOTOR_ACTIVE_FILE = '/tmp/gpio_motor_is_active'
+MOTOR_LAST_ACTIVE_MTIME_FILE = '/tmp/gpio_motor_last_active_mtime'
+# Measured from when the table stopped (observed, or predicted by motion_profile.py):
+# within MOVE_RECENT_S the new position ought to be saved, automove corrects for AUTOMOVE_WINDOW_S,
+# after that the table is SAFE TO MOVE and the save is sent once between AUTO_SAVE_AFTER_S.
+MOVE_RECENT_S = 5.0
+AUTOMOVE_WINDOW_S = 9.0
+AUTO_SAVE_AFTER_S = (6.0, 20.0)
+# Samples of pmem + motor-active for /history, see position_history.py
+POSITION_HISTORY_DIR = '/mnt/usb1/position-history'
+# --midi[=<port name substring>] takes jogs and position moves from a MIDI pad/knob controller, see midi_bridge.py
+MIDI_PORT_MATCH = 'worlde'
+# Dial clicks ('r'/'l' and MIDI knobs) arriving within this long of each other go to the controller as one command
+JOG_COALESCE_S = 0.25
 
 import os
 import sys
@@ -21,6 +45,19 @@ import random
 import base64
 import threading
 import signal
+import json
+import importlib
+import multiprocessing
+import concurrent.futures
+
+# Startup metrics are measured from here
+webserver_started_s = time.monotonic()
+
+# Load tests point the spool somewhere harmless, see webserver_loadtest.py
+GPIO_MOTOR_KEYS_IN_DIR = os.environ.get('GPIO_MOTOR_KEYS_IN_DIR', GPIO_MOTOR_KEYS_IN_DIR)
+POSITION_HISTORY_DIR = os.environ.get('POSITION_HISTORY_DIR', POSITION_HISTORY_DIR)
+MIDI_PORT_MATCH = os.environ.get('MIDI_PORT_MATCH', MIDI_PORT_MATCH)
+JOG_COALESCE_S = float(os.environ.get('JOG_COALESCE_S', JOG_COALESCE_S))
 
 py_env_dir = os.path.join(os.path.dirname(__file__), '.py-env')
 os.makedirs(py_env_dir, exist_ok=True)
@@ -36,22 +73,43 @@ except:
 
 import aiohttp.web
 
-try:
-  import cv2
-except:
-  subprocess.run([
-    sys.executable, '-m', 'pip', 'install', f'--target={py_env_dir}', 'opencv-python'
-  ])
-  import cv2
+import pipeline_metrics
+import loop_monitor
+import position_history
+import motion_profile
+import midi_bridge
+import jog_coalescer
+import static_assets
+import cpu_layout
 
+def import_or_install(module_name, pip_name=None):
+  try:
+    return importlib.import_module(module_name)
+  except ImportError:
+    subprocess.run([
+      sys.executable, '-m', 'pip', 'install', f'--target={py_env_dir}', pip_name or module_name
+    ])
+    importlib.invalidate_caches()
+    return importlib.import_module(module_name)
 
-try:
-  import psutil
-except:
-  subprocess.run([
-    sys.executable, '-m', 'pip', 'install', f'--target={py_env_dir}', 'psutil'
-  ])
-  import psutil
+# cv2 + numpy take seconds to import on the Pi. They, and every module that needs them, are imported by
+# import_vision_modules() on a worker thread after the server is already listening; see load_vision_modules().
+cv2 = None
+numpy = None
+rail_detector = None
+position_templates = None
+frame_sources = None
+flight_recorder = None
+frame_compositor = None
+frame_ring = None
+multi_camera = None
+psutil = None
+
+# Shared by read_video_t, video_handle and the spool writers; served on /metrics
+metrics = pipeline_metrics.PipelineMetrics()
+
+# Cores and priorities per thread role, read from cpu_layout.CPU_LAYOUT_FILE; see apply_cpu_layout()
+cpu_layout_manager = cpu_layout.CpuLayout.load()
 
 
 def get_loc_ip():
@@ -82,7 +140,10 @@ async def set_current_password(password):
     traceback.print_exc()
 
 def send_sigusr1_to_gpio_proc():
+  global psutil
   try:
+    if psutil is None:
+      psutil = import_or_install('psutil')
     for proc in psutil.process_iter():
       if 'gpio-motor-control' in proc.name().lower():
         # Send signal
@@ -93,6 +154,19 @@ def send_sigusr1_to_gpio_proc():
     traceback.print_exc()
 
 
+# Writes keycode_s to the first non-existent file under GPIO_MOTOR_KEYS_IN_DIR, returns the file name or None
+def write_to_gpio_motor_keys_in(keycode_s, attempts=100):
+  for _ in range(0, attempts):
+    input_num = random.randrange(1000, 9000)
+    input_f_name = os.path.join(GPIO_MOTOR_KEYS_IN_DIR, f'{input_num}.txt')
+    if os.path.exists(input_f_name):
+      continue
+    with open(input_f_name, 'w') as fd:
+      fd.write(keycode_s)
+    metrics.spool_writes_total += 1
+    return input_f_name
+  return None
+
 # Returns None if auth is good, else a aiohttp.web.Response object to be sent back by caller.
 async def maybe_redirect_for_auth(request):
   supplied_auth = request.headers.getone('Authorization', 'Basic ==')
@@ -124,183 +198,114 @@ async def maybe_redirect_for_auth(request):
       )
   return None
 
-async def index_handle(request):
-  index_html = ('''
-<!doctype html>
-<html lang="en">
-<head>
-  <meta charset="utf-8">
-  <meta name="viewport" content="width=device-width, initial-scale=1">
-  <title>Transfer Table Control</title>
-  <style>
-html, body {
-  margin: 0;
-  padding: 0;
-}
-#camera_stream {
-  width: 100vw;
-  max-width: 600pt;
-  display: block;
-}
-#status_iframe {
-  width: 90vw;
-  max-width: 592pt;
-  min-height: 400pt;
-  display: block;
-  padding: 2pt;
-}
-#inputForm, #setPasswordForm {
-  max-width: 592pt;
-  padding: 2pt;
-}
-h2, #status_iframe, #inputForm, #setPasswordForm {
-  margin: 2pt;
-}
-input, label {
-  font-size: 16pt;
-}
-  </style>
-</head>
-<body>
-  <script>
-    function submitInputForm() {
-       console.log('submitInputForm');
-       var frm = document.getElementById('inputForm');
-       frm.submit();
-       setTimeout(function() { frm.reset(); }, 4600);
-       return false;
-    }
-    function submitStop() {
-       console.log('submitStop');
-       document.getElementById('number').value = '!!!';
-       var frm = document.getElementById('inputForm');
-       frm.submit();
-       setTimeout(function() { frm.reset(); }, 4600);
-       return false;
-    }
-    function submitSetPasswordForm() {
-       var frm = document.getElementById('setPasswordForm');
-       frm.submit();
-       frm.reset();
-       return false;
-    }
-  </script>
-  <img src="/video" id="camera_stream" />
-  <h2>Table Input</h2>
-  <form id="inputForm" action="/input" method="POST" target="dummyFormFrame">
-    <label for="number">Number</label>
-    <input name="number" id="number" value="" type="text" />
-    <br/><br/>
-    <input type="submit" value="Enter" onclick="submitInputForm()" style="margin-left:180pt;display:inline-block;" />
-    <br/><br/>
-  </form>
-
-  <input type="button" value="STOP" onclick="submitStop()" style="margin-left:6pt;background-color:red;color:white;font-weight:bold;display:inline-block;position:relative;top:-44pt;" />
-  <br/>
-
-  <i>
-    Numbers turn into key presses, 'r' becomes a clockwise dial rotation, 'l' becomes a counter-clockwise dial rotation.
-    '=' performs the same as '=' on keyboard or numpad.
-  </i>
-
-  <iframe name="dummyFormFrame" id="dummyFormFrame" style="display: none;"></iframe>
-  <br/>
-  <br/>
-  <br/>
-  <details>
-    <summary>Table Status</summary>
-    <iframe src="/status" id="status_iframe" style="border:1px solid black;border-radius:3pt;"></iframe>
-  </details>
-  <br/>
-  <br/>
-  <br/>
-  <form id="setPasswordForm" action="/set-control-password" method="POST" target="dummyFormFrame">
-    <label for="pw">Set Control Password</label>
-    <input name="pw" id="pw" value="" type="password" />
-    <br/><br/>
-    <input type="button" value="Enter" onclick="submitSetPasswordForm()" style="margin-left:172pt;"/>
-    <br/>
-    <i>
-      If set, the current password is stored at '''+PASSWORD_FILE+''' on the control server. Remove this file to "reset" the password if forgotten. /mnt/usb1 is the USB drive.
-    </i>
-  </form>
-  <br/>
-  <br/>
-  <br/>
-
-</body>
-</html>
-''').strip()
-  return aiohttp.web.Response(text=index_html, content_type='text/html')
-
-
-async def status_handle(request):
-  track_data = 'ERROR FETCHING TABLE POSITIONS'
+pmem_logical_position_cache = (0, None) # (mtime, logical_position)
+def read_pmem_logical_position():
+  global pmem_logical_position_cache
+  try:
+    pmem_mtime = os.path.getmtime(PMEM_FILE)
+    if pmem_mtime != pmem_logical_position_cache[0]:
+      with open(PMEM_FILE, 'rb') as fd:
+        logical_position, _step_position = struct.unpack('Ii', fd.read(8))
+      pmem_logical_position_cache = (pmem_mtime, logical_position)
+  except:
+    return None
+  return pmem_logical_position_cache[1]
+
+motion_tracker = motion_profile.MotionTracker()
+def observe_motion():
+  # Returns seconds since the table stopped; 0 while it moves or while a move we sent is still due
+  try:
+    last_active_mtime_s = os.path.getmtime(MOTOR_LAST_ACTIVE_MTIME_FILE)
+  except OSError:
+    last_active_mtime_s = None
+  if shared_frame_ring is not None:
+    # In the vision worker, moves sent by the HTTP process arrive through the ring header
+    motion_tracker.expect_until(shared_frame_ring.move_expected_end_s())
+  motion_tracker.observe(os.path.exists(MOTOR_ACTIVE_FILE), last_active_mtime_s)
+  return motion_tracker.seconds_since_move_end()
+
+def expect_move_to_position(position_num):
+  # Called when we send "N<enter>"; returns the predicted seconds until the table stops, or None
+  try:
+    step_position, positions = motion_profile.read_pmem_steps(PMEM_FILE)
+    end_s = motion_tracker.expect_move(step_position - positions[position_num-1])
+    if shared_frame_ring is not None:
+      shared_frame_ring.set_move_expected_end_s(end_s)
+    return end_s - time.time()
+  except:
+    traceback.print_exc()
+  return None
+
+def status_dict():
+  # Everything the status page shows, rendered into text by webui/status.js
+  status = {'time': str(datetime.datetime.now()), 'pmem': None, 'sections': [], 'error': None}
   try:
-    pmem_bytes = b''
     with open(PMEM_FILE, 'rb') as fd:
       pmem_bytes = fd.read()
 
     # pmem_bytes has structure
     #   logical_position: u32,
     #   step_position: i32,
-    #   positions: [12]pos_dat align(1),
+    #   positions: [12]pos_dat (step_position: i32, cm_position: f64)
+    if len(pmem_bytes) == motion_profile.PMEM_STEPS.size:
+      pmem_data = motion_profile.PMEM_STEPS.unpack(pmem_bytes)
+    else:
+      # Older controllers stored an f32 cm_position
+      num_numbers = int((len(pmem_bytes) - 8) / 8.0)
+      pmem_data = struct.unpack('Ii'+('if'*num_numbers), pmem_bytes)
+    status['pmem'] = {
+      'logical_position': pmem_data[0],
+      'step_position': pmem_data[1],
+      'positions': list(pmem_data[2::2]),
+    }
+  except:
+    traceback.print_exc()
+    status['error'] = traceback.format_exc()
 
-    #if len(pmem_bytes) > 104:
-    #  print(f'len(pmem_bytes) = {len(pmem_bytes)}')
-    #  pmem_bytes = pmem_bytes[:104] # todo better
+  sections = status['sections']
+  try:
+    if analysis_gate is not None:
+      sections.append(('Image analysis', analysis_gate.stats_s()))
+    if camera_supervisor is not None:
+      sections.append(('Camera', camera_supervisor.stats_s()))
+    if vision_process_enabled:
+      sections.append(('Vision process', vision_process_stats_s()))
+    observe_motion()
+    sections.append(('Motion', json.dumps(motion_tracker.snapshot())))
+    if position_log is not None:
+      sections.append(('Position history', position_log.stats_s()))
+    sections.append(('Dial jogs', dial_jogs.stats_s()))
+    if midi_control is not None:
+      sections.append(('MIDI', midi_control.stats_s()))
+    if extra_cameras is not None:
+      sections.append(('Cameras', extra_cameras.stats_s()))
+    sections.append(('CPU layout', cpu_layout_manager.stats_s()))
+  except:
+    traceback.print_exc()
+    status['error'] = traceback.format_exc()
+  return status
 
-    # num_numbers = 12
-    num_numbers = int((len(pmem_bytes) - 8) / 8.0)
+async def status_json_handle(request):
+  return aiohttp.web.Response(text=json.dumps(status_dict()), content_type='application/json')
 
-    pmem_data = struct.unpack(
-      'Ii'+('if'*num_numbers),
-      pmem_bytes
-    )
-    logical_position = pmem_data[0]
-    track_data = '================================='+os.linesep
-    track_data += f'logical_position = {logical_position}'+os.linesep
-    step_position = pmem_data[1]
-    track_data += f'step_position = {step_position}'+os.linesep
-    track_data += '================================='+os.linesep
-
-    for pos_num in range(0, num_numbers):
-      step_position = pmem_data[2+(pos_num*2)]
-      track_data += f'Position {pos_num+1} step_position = {step_position}'+os.linesep
-    track_data += '================================='+os.linesep
-
-    track_data += '==== Zero position init code ===='+os.linesep
-    for pos_num in range(0, num_numbers):
-      step_position = pmem_data[2+(pos_num*2)]
-      track_data += f'pmem.positions[{pos_num}].step_position = {step_position};'+os.linesep
-    track_data += os.linesep
 
+def emergency_stop():
+  input_file_keycode_s = '1,15,51,83'
+  dial_jogs.discard()
+  try:
+    send_sigusr1_to_gpio_proc()
+    write_to_gpio_motor_keys_in(input_file_keycode_s, attempts=10000)
+    send_sigusr1_to_gpio_proc()
+    motion_tracker.cancel()
+    if shared_frame_ring is not None:
+      shared_frame_ring.set_move_expected_end_s(time.time())
   except:
+    send_sigusr1_to_gpio_proc()
     traceback.print_exc()
-    track_data += '\n'+traceback.format_exc()
-
-  index_html = f'''
-<!doctype html>
-<html lang="en">
-<head>
-  <meta charset="utf-8">
-  <meta name="viewport" content="width=device-width, initial-scale=1">
-  <meta http-equiv="refresh" content="6" />
-  <style>
-html, body {{
-  margin: 0;
-  padding: 0;
-}}
-  </style>
-</head>
-<body>
-  <p><i>Status at {datetime.datetime.now()}</i></p>
-  <pre>{track_data}</pre>
-</body>
-</html>
-'''.strip()
-  return aiohttp.web.Response(text=index_html, content_type='text/html')
 
+  # ^^ The above will not be read until AFTER the move is complete!
+  # TODO send a SIGUSER1 or similar & handle in zig?
+  return input_file_keycode_s
 
 async def input_handle(request):
   data = await request.post()
@@ -311,32 +316,19 @@ async def input_handle(request):
 
   # Special-case emergency stop DO NOT DO AUTH
   if '!' in number_val:
-    input_file_keycode_s += '1,15,51,83'
-    # Find first non-existent file under GPIO_MOTOR_KEYS_IN_DIR
-    try:
-      send_sigusr1_to_gpio_proc()
-      for _ in range(0, 10000):
-        input_num = random.randrange(1000, 9000)
-        input_f_name = os.path.join(GPIO_MOTOR_KEYS_IN_DIR, f'{input_num}.txt')
-        if os.path.exists(input_f_name):
-          continue
-        with open(input_f_name, 'w') as fd:
-          fd.write(input_file_keycode_s)
-        break
-      send_sigusr1_to_gpio_proc()
-    except:
-      send_sigusr1_to_gpio_proc()
-      traceback.print_exc()
-
-    # ^^ The above will not be read until AFTER the move is complete!
-    # TODO send a SIGUSER1 or similar & handle in zig?
-
+    input_file_keycode_s = emergency_stop()
     return aiohttp.web.Response(text=f'EMERGENCY STOP, input_file_keycode_s={input_file_keycode_s}', content_type='text/plain')
 
   auth_resp = await maybe_redirect_for_auth(request)
   if auth_resp is not None:
     return auth_resp
 
+  # Dial clicks are merged with the ones around them, see jog_coalescer.py
+  if len(number_val.strip()) > 0 and all(c in 'rl' for c in number_val.strip()):
+    for c in number_val.strip():
+      dial_jogs.add(1 if c == 'r' else -1)
+    return aiohttp.web.Response(text=f'Done, {abs(dial_jogs.pending_clicks)} dial clicks pending', content_type='text/plain')
+
   for number in number_val:
     # convert int format to linux keycode number
     try:
@@ -373,20 +365,61 @@ async def input_handle(request):
   # and add an <enter> keycode
   input_file_keycode_s += '96'
 
-  # Find first non-existent file under GPIO_MOTOR_KEYS_IN_DIR
+  input_f_name = None
   try:
-    for _ in range(0, 100):
-      input_num = random.randrange(1000, 9000)
-      input_f_name = os.path.join(GPIO_MOTOR_KEYS_IN_DIR, f'{input_num}.txt')
-      if os.path.exists(input_f_name):
-        continue
-      with open(input_f_name, 'w') as fd:
-        fd.write(input_file_keycode_s)
-      break
+    input_f_name = write_to_gpio_motor_keys_in(input_file_keycode_s)
   except:
     traceback.print_exc()
 
-  return aiohttp.web.Response(text=f'Done, input_file_keycode_s={input_file_keycode_s}', content_type='text/plain')
+  if '=' in number_val and input_f_name is not None:
+    if any(c.isdigit() for c in number_val):
+      # The controller saves under whatever position it is at when it reads '=', then the digits + enter
+      # move the table away; there is no still scene of a known slot to keep
+      print(f'Not capturing a position template for "{number_val}", only a lone "=" does')
+    else:
+      request_template_capture(input_f_name)
+
+  eta_s = None
+  if number_val.strip().isdigit() and 1 <= int(number_val.strip()) <= 12:
+    eta_s = expect_move_to_position(int(number_val.strip()))
+
+  return aiohttp.web.Response(text=f'Done, input_file_keycode_s={input_file_keycode_s}'+(f', move done in {eta_s:.1f}s' if eta_s is not None else ''), content_type='text/plain')
+
+# Keypad digits exactly as input_handle sends them
+KEYPAD_KEYCODES = {'0': 82, '1': 79, '2': 80, '3': 83, '4': 75, '5': 76, '6': 77, '7': 71, '8': 72, '9': 73}
+
+def write_jog_to_gpio_motor_keys_in(clicks):
+  # One spool file for a whole coalesced jog; 115 is the clockwise ('r') dial key, 114 counter-clockwise
+  input_file_keycode_s = ','.join(['115' if clicks > 0 else '114'] * abs(clicks))
+  input_f_name = write_to_gpio_motor_keys_in(input_file_keycode_s)
+  end_s = time.time() + motion_profile.CONTROLLER_PICKUP_S + jog_coalescer.command_motion_s(clicks)
+  motion_tracker.expect_until(end_s)
+  if shared_frame_ring is not None:
+    shared_frame_ring.set_move_expected_end_s(end_s)
+  print(f'Jog {clicks} clicks: wrote to {input_f_name}')
+
+dial_jogs = jog_coalescer.JogCoalescer(write_jog_to_gpio_motor_keys_in, window_s=JOG_COALESCE_S)
+
+midi_control = None
+def on_midi_command(kind, arg):
+  # Called by midi_bridge once per coalesced burst of pad/knob events
+  if kind == 'stop':
+    print(f'MIDI emergency stop: {emergency_stop()}')
+  elif kind == 'move':
+    input_file_keycode_s = ''.join(f'{KEYPAD_KEYCODES[c]},' for c in str(arg)) + '96'
+    input_f_name = write_to_gpio_motor_keys_in(input_file_keycode_s)
+    eta_s = expect_move_to_position(arg)
+    print(f'MIDI move to {arg}: wrote "{input_file_keycode_s}" to {input_f_name}'+(f', done in {eta_s:.1f}s' if eta_s is not None else ''))
+  elif kind == 'jog':
+    dial_jogs.add(arg)
+
+def midi_table_state():
+  observe_motion()
+  return (read_pmem_logical_position(), motion_tracker.moving())
+
+async def motion_handle(request):
+  observe_motion()
+  return aiohttp.web.Response(text=json.dumps(motion_tracker.snapshot()), content_type='application/json')
 
 async def set_control_password_handle(request):
   auth_resp = await maybe_redirect_for_auth(request)
@@ -403,227 +436,141 @@ async def set_control_password_handle(request):
 
 
 
-def calc_alpha_beta_auto_brightness_adj(gray_img):
-  clip_hist_percent = 20
-
-  # Calculate grayscale histogram
-  hist = cv2.calcHist([gray_img],[0],None,[256],[0,256])
-  hist_size = len(hist)
-
-  # Calculate cumulative distribution from the histogram
-  accumulator = []
-  accumulator.append(float(hist[0]))
-  for index in range(1, hist_size):
-      accumulator.append(accumulator[index -1] + float(hist[index]))
-
-  # Locate points to clip
-  maximum = accumulator[-1]
-  clip_hist_percent *= (maximum/100.0)
-  clip_hist_percent /= 2.0
-
-  # Locate left cut
-  minimum_gray = 0
-  while accumulator[minimum_gray] < clip_hist_percent:
-      minimum_gray += 1
-
-  # Locate right cut
-  maximum_gray = hist_size -1
-  while accumulator[maximum_gray] >= (maximum - clip_hist_percent):
-      maximum_gray -= 1
-
-  # Calculate alpha and beta values
-  alpha = 255 / (maximum_gray - minimum_gray)
-  beta = -minimum_gray * alpha
-
-  return alpha, beta
-
-def brightness_from_px(pixel):
-  if len(pixel) == 3:
-    # Assume BGR
-    B = int(pixel[0])
-    G = int(pixel[1])
-    R = int(pixel[2])
-    return int( float(R+R+R+B+G+G+G+G)/6.0 ) # Fast approx from https://stackoverflow.com/a/596241
-
-  elif len(pixel) == 1:
-    # Assume gray
-    return pixel[0]
-
+rail_detector_backend = None
+position_templates_store = None
+# (spool file holding the '=', monotonic s requested): the next analysed frame after the controller has
+# read that file becomes the reference image of the position pmem then says the table is at
+pending_template_capture = None
+TEMPLATE_CAPTURE_TIMEOUT_S = 10.0
+frame_recorder = None
+# Crop sized, allocated with the geometry: the debug render of the current frame, and the last analysed one
+debug_render_img = None
+debug_cache_img = None
+def set_analysis_frame_size(frame_w, frame_h):
+  global rail_detector_backend, position_templates_store, analysis_gate, last_analysis, last_detection, frame_recorder
+  global debug_render_img, debug_cache_img, last_main_estimate
+  geometry = rail_detector.RailGeometry().scaled_to(frame_w, frame_h)
+  if frame_w != rail_detector.FRAME_W or frame_h != rail_detector.FRAME_H:
+    print(f'WARNING: input image is {frame_w}x{frame_h} pixels, scaled rail geometry from {rail_detector.FRAME_W}x{rail_detector.FRAME_H}: {geometry}')
+  rail_detector_backend = rail_detector.get_detector(geometry=geometry)
+  print(f'Using rail detector backend {rail_detector_backend.backend_name}')
+  if position_templates_store is None or position_templates_store.geometry != geometry:
+    position_templates_store = position_templates.PositionTemplates(geometry).load()
+  analysis_gate = rail_detector.StaticSceneGate(geometry, force_every_s=ANALYSIS_FORCE_EVERY_S)
+  last_analysis = None
+  last_detection = None
+  last_main_estimate = None
+  debug_render_img = numpy.zeros((geometry.crop_h, geometry.crop_w, 3), dtype=numpy.uint8)
+  debug_cache_img = numpy.zeros_like(debug_render_img)
+  flight_recorder_frames = int(os.environ.get('FLIGHT_RECORDER_FRAMES', flight_recorder.DEFAULT_CAPACITY))
+  if flight_recorder_frames > 0 and (frame_recorder is None or frame_recorder.geometry != geometry):
+    frame_recorder = flight_recorder.FlightRecorder(geometry, capacity=flight_recorder_frames)
+
+last_detection = None # RailDetection of the last fully analysed frame, for the flight recorder
+# (frame_num, detector rail_x1_diff, px estimate after template alignment, monotonic s) of the last
+# fully analysed frame, what the main camera contributes to multi_camera.fuse()
+last_main_estimate = None
+def request_template_capture(input_f_name):
+  global pending_template_capture
+  if shared_frame_ring is not None:
+    # Frames are analysed by the vision process, which picks this up from the ring header
+    shared_frame_ring.request_template_capture(int(os.path.basename(input_f_name).split('.', 1)[0]))
   else:
-    raise Exception(f'Error, bad pixel value! pixel = {pixel}')
+    pending_template_capture = (input_f_name, time.monotonic())
+
+def take_due_template_capture_slot():
+  # The slot to capture into once the controller has read the '=' (and saved pmem), else None
+  global pending_template_capture
+  input_f_name, requested_s = pending_template_capture
+  if os.path.exists(input_f_name):
+    if time.monotonic() - requested_s > TEMPLATE_CAPTURE_TIMEOUT_S:
+      print(f'Controller did not read {input_f_name} within {TEMPLATE_CAPTURE_TIMEOUT_S:.0f}s, no position template captured')
+      pending_template_capture = None
+    return None
+  pending_template_capture = None
+  return read_pmem_logical_position()
+
+def analyse_rails(img):
+  global last_detection, last_main_estimate
+  # rail_px_diff is returned alongside the debug frame.
+  # When None indicates no rails detected, or rails are already aligned!
+  t0 = time.perf_counter()
+  result = rail_detector_backend.adjust(img)
+  t1 = time.perf_counter()
+  metrics.observe('contrast', t1 - t0)
+  rail_detector_backend.scan(result)
+  last_detection = result
+  rail_px_diff = result.rail_px_diff
+  main_px = result.rail_x1_diff
+  t2 = time.perf_counter()
+  debug_adj_img = rail_detector_backend.render_debug(result, out=debug_render_img)
+  t3 = time.perf_counter()
+  metrics.observe('debug_render', t3 - t2)
+
+  if position_templates_store is not None:
+    if pending_template_capture is not None:
+      try:
+        capture_slot = take_due_template_capture_slot()
+        if capture_slot is not None:
+          position_templates_store.capture(capture_slot, img)
+      except:
+        traceback.print_exc()
 
-def count_num_true_ahead(signal, begin_i):
-  num_true_ahead = 0
-  for i in range(begin_i, len(signal)):
-    if not signal[i]:
-      break
-    num_true_ahead += 1
-  return num_true_ahead
+    # A saved reference for this slot beats the threshold heuristics when it still matches the scene
+    template_alignment = position_templates_store.align(read_pmem_logical_position(), img)
+    if template_alignment is not None:
+      template_px_diff, response = template_alignment
+      main_px = template_px_diff
+      rail_px_diff = int(round(template_px_diff))
+      if abs(rail_px_diff) <= result.geometry.max_allowed_rail_offset:
+        rail_px_diff = None
+      cv2.putText(debug_adj_img, f'TEMPLATE {template_px_diff:+.1f}px',
+        (4, result.geometry.crop_h - 8),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        0.5, (255,255,0), 1, 2
+      )
+
+  last_main_estimate = (last_video_frame_num, result.rail_x1_diff, main_px, time.monotonic())
+  metrics.observe('detection', (t2 - t1) + (time.perf_counter() - t3))
+  return rail_px_diff, debug_adj_img
 
 ought_to_save_automove_pos_begin_s = 0
+analysis_gate = None
+last_analysis = None # (rail_px_diff, debug_cache_img) from the last fully analysed frame
+last_frame_was_analysed = False
 async def do_image_analysis_processing(img):
-  global last_s_when_gpio_motor_is_active, ought_to_save_automove_pos_begin_s
-  # if the image is not the same size as our research texts, fix it!
+  global ought_to_save_automove_pos_begin_s, last_analysis, last_frame_was_analysed
+  # Geometry is measured at 640x480; other frame sizes scale the constants once instead of resizing every frame.
   img_h, img_w, img_channels = img.shape
-  if img_w != 640 or img_h != 480:
-    print(f'WARNING: input image was {img_w}x{img_h} pixels, we resized to 640x480')
-    img = cv2.resize(img, (640, 480))
-
-  # This variable is returned alongside the debug frame.
-  # When None indicates no rails detected!
-  rail_px_diff = None
-
-  # First let's crop to a manually-measured section we want to measure.
-  crop_x = 175
-  crop_y = 200
-  crop_w = 425 - crop_x
-  crop_h = 400 - crop_y
-
-  cropped = img[crop_y:crop_y+crop_h, crop_x:crop_x+crop_w]
-
-  # Next, let's normalize the input images using a common technique
-  # to normalize the contrast and brightness incoming images.
-  # If the brightness of the room/track changes this will prevent the algorithms
-  # below from failing.
-  # See https://stackoverflow.com/questions/56905592/automatic-contrast-and-brightness-adjustment-of-a-color-photo-of-a-sheet-of-pape
-
-  gray = cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY)
-  alpha, beta = calc_alpha_beta_auto_brightness_adj(gray)
-  auto_adj_img = cv2.convertScaleAbs(cropped, alpha=alpha, beta=beta)
-  # For diagnostics, we write to this so our output doesn't change the input (auto_adj_img) being processed
-  debug_adj_img = auto_adj_img.copy()
-
-  # We also use these manually measured offsets to insersect the
-  # table rail and layout-side rail.
-  # Coordinates are measured in absolute units and converted at-time-of-use
-  table_rail_y = 330
-  layout_rail_y = 350
-  rail_pair_width_px = 96 # measured center-to-center
-
-  # Calc crop-space rail_y values
-  crop_table_rail_y = table_rail_y-crop_y
-  crop_layout_rail_y = layout_rail_y-crop_y
-
-  # Log debug assumptions
-  cv2.line(debug_adj_img, (0, table_rail_y-crop_y), (crop_w, crop_table_rail_y), (255, 0, 0), thickness=1)
-  cv2.line(debug_adj_img, (0, layout_rail_y-crop_y), (crop_w, crop_layout_rail_y), (0, 255, 0), thickness=1)
-
-  # Scan along table_rail_y to find two high signals approx rail_pair_width_px apart,
-  # and record X coords of both.
-  table_rail_brightnesses = []
-  layout_rail_brightnesses = []
-  for x in range(0, crop_w):
-    table_px = auto_adj_img[crop_table_rail_y,x]
-    layout_px = auto_adj_img[crop_layout_rail_y,x]
-    table_rail_brightnesses.append(
-      brightness_from_px(table_px)
-    )
-    layout_rail_brightnesses.append(
-      brightness_from_px(layout_px)
-    )
-
-  avg_table_rail_brightnesses = sum(table_rail_brightnesses) / len(table_rail_brightnesses)
-  avg_layout_rail_brightnesses = sum(layout_rail_brightnesses) / len(layout_rail_brightnesses)
-
-  # The true average segmentation includes too much non-rail material -
-  # therefore we increase the "average" brightness up by 50% to capture
-  # somethig closer to the top 25% brightness values
-  avg_table_rail_brightnesses *= 1.35
-  avg_layout_rail_brightnesses *= 1.35
-
-  table_rail_signal = [x > avg_table_rail_brightnesses for x in table_rail_brightnesses]
-  layout_rail_signal = [x > avg_layout_rail_brightnesses for x in layout_rail_brightnesses]
-
-  # Log more
-  for x in range(0, crop_w):
-    debug_adj_img[min(crop_h-1, crop_table_rail_y+1),x] = [255,255,255] if table_rail_signal[x] else [0,0,0]
-    debug_adj_img[min(crop_h-1, crop_table_rail_y+2),x] = [255,255,255] if table_rail_signal[x] else [0,0,0]
-
-    debug_adj_img[min(crop_h-1, crop_layout_rail_y+1),x] = [255,255,255] if layout_rail_signal[x] else [0,0,0]
-    debug_adj_img[min(crop_h-1, crop_layout_rail_y+2),x] = [255,255,255] if layout_rail_signal[x] else [0,0,0]
-
-  # Now we scan for the FIRST rail from the left ->
-  # by checking the signal True values AND reading the same TRUE value
-  # rail_pair_width_px items later
-  table_rail_left_idxs = None
-  layout_rail_left_idxs = None
-  for x in range(0, crop_w-rail_pair_width_px):
-    if table_rail_left_idxs is None and table_rail_signal[x] and table_rail_signal[x+rail_pair_width_px]:
-      # Found it!
-      #table_rail_left_idxs = (x, x+rail_pair_width_px)
-      center_offset = int(count_num_true_ahead(table_rail_signal, x) // 2)
-      table_rail_left_idxs = (x + center_offset, x + rail_pair_width_px + center_offset)
-
-    if layout_rail_left_idxs is None and layout_rail_signal[x] and layout_rail_signal[x+rail_pair_width_px]:
-      # Found it!
-      #layout_rail_left_idxs = (x, x+rail_pair_width_px)
-      center_offset = int(count_num_true_ahead(layout_rail_signal, x) // 2)
-      layout_rail_left_idxs = (x + center_offset, x + rail_pair_width_px + center_offset)
-
-
-  if not (table_rail_left_idxs is None):
-    # Log the rail!
-    x1, x2 = table_rail_left_idxs
-    debug_adj_img[min(crop_h-1, crop_table_rail_y+3), x1] = [0,0,255]
-    debug_adj_img[min(crop_h-1, crop_table_rail_y+4), x1] = [0,0,255]
-
-    debug_adj_img[min(crop_h-1, crop_table_rail_y+3), min(crop_w-1, x2)] = [0,0,255]
-    debug_adj_img[min(crop_h-1, crop_table_rail_y+4), min(crop_w-1, x2)] = [0,0,255]
-
-  if not (layout_rail_left_idxs is None):
-    # Log the rail!
-    x1, x2 = layout_rail_left_idxs
-    debug_adj_img[min(crop_h-1, crop_layout_rail_y+3), x1] = [0,0,255]
-    debug_adj_img[min(crop_h-1, crop_layout_rail_y+4), x1] = [0,0,255]
-
-    debug_adj_img[min(crop_h-1, crop_layout_rail_y+3), min(crop_w-1, x2)] = [0,0,255]
-    debug_adj_img[min(crop_h-1, crop_layout_rail_y+4), min(crop_w-1, x2)] = [0,0,255]
-
-  if table_rail_left_idxs is not None and layout_rail_left_idxs is not None:
-    # Now we can see how much to move the table by!
-    table_x1, table_x2 = table_rail_left_idxs
-    layout_x1, layout_x2 = layout_rail_left_idxs
-
-    x1_diff = layout_x1 - table_x1
-    x2_diff = layout_x2 - table_x2 # this will be identical b/c detection uses rail_pair_width_px
-
-    MAX_ALLOWED_RAIL_OFFSET = 1
-    if abs(x1_diff) > MAX_ALLOWED_RAIL_OFFSET:
-      cv2.arrowedLine(debug_adj_img, (table_x1, crop_table_rail_y-10), (layout_x1, crop_table_rail_y-10), (0,0,0), 2)
-      cv2.arrowedLine(debug_adj_img, (table_x1, crop_table_rail_y-10), (layout_x1, crop_table_rail_y-10), (0,0,255), 1)
-
-      # print(f'x1_diff = {x1_diff}')
-      rail_px_diff = x1_diff # Write to our returned variable so processing logic can move table!
-
-    else:
-      # Rail position good!
-      cv2.arrowedLine(debug_adj_img, (table_x1, max(0, crop_table_rail_y-60) ), (layout_x1, crop_table_rail_y), (0,0,0), 2)
-      cv2.arrowedLine(debug_adj_img, (table_x1, max(0, crop_table_rail_y-60) ), (layout_x1, crop_table_rail_y), (0,255,0), 1)
+  if rail_detector_backend is None or rail_detector_backend.geometry.frame_w != img_w or rail_detector_backend.geometry.frame_h != img_h:
+    set_analysis_frame_size(img_w, img_h)
+
+  seconds_since_last_table_move = observe_motion()
+
+  # Never reuse results while the controller is driving the motor, while automove may still act on
+  # them after a move, or when a template capture is due.
+  must_analyse = last_analysis is None or os.path.exists(MOTOR_ACTIVE_FILE) or pending_template_capture is not None
+  must_analyse = must_analyse or seconds_since_last_table_move < AUTOMOVE_WINDOW_S
+  last_frame_was_analysed = analysis_gate.should_analyse(img, force=must_analyse)
+  if not last_frame_was_analysed:
+    rail_px_diff, cached_debug_img = last_analysis
+    # overlays below must not accumulate on the cached render
+    numpy.copyto(debug_render_img, cached_debug_img)
+    debug_adj_img = debug_render_img
 
   else:
-    # No rails found!
-    cv2.putText(debug_adj_img,'[NO RAIL]',
-      (int(crop_w/6), max(0, crop_table_rail_y-40)),
-      cv2.FONT_HERSHEY_SIMPLEX,
-      1, (0,0,0), 2, 2
-    )
-    cv2.putText(debug_adj_img,'[NO RAIL]',
-      (int(crop_w/6), max(0, crop_table_rail_y-40)),
-      cv2.FONT_HERSHEY_SIMPLEX,
-      1, (0,0,255), 1, 2
-    )
-
-  # Do the faster decay checl using the mtime on /tmp/gpio_motor_last_active_mtime
-  if os.path.exists('/tmp/gpio_motor_last_active_mtime'):
-    last_s_when_gpio_motor_is_active = max(last_s_when_gpio_motor_is_active, os.path.getmtime('/tmp/gpio_motor_last_active_mtime'))
-
-  seconds_since_last_table_move = time.time() - last_s_when_gpio_motor_is_active
+    rail_px_diff, debug_adj_img = analyse_rails(img)
+    if last_analysis is not None and analysis_gate.last_reason == 'forced' and last_analysis[0] != rail_px_diff:
+      analysis_gate.num_stale_on_refresh += 1
+      print(f'Forced analysis refresh changed rail_px_diff {last_analysis[0]} -> {rail_px_diff}, {analysis_gate.stats_s()}')
+    numpy.copyto(debug_cache_img, debug_adj_img)
+    last_analysis = (rail_px_diff, debug_cache_img)
 
   # Table moved recently, record we OUGHT to save soon (done w/ 15 second window)
-  if seconds_since_last_table_move < 5.0:
+  if seconds_since_last_table_move < MOVE_RECENT_S:
     ought_to_save_automove_pos_begin_s = time.time()
 
-  if seconds_since_last_table_move > 9.0:
+  if seconds_since_last_table_move > AUTOMOVE_WINDOW_S:
     # Notify user we will not be moving!
     cv2.putText(debug_adj_img,'SAFE TO MOVE',
       (4, 30),
@@ -638,20 +585,12 @@ async def do_image_analysis_processing(img):
 
     # Also; when we know it's safe to move, send a '=' to the controller at least once.
     ought_to_save_age_s = time.time() - ought_to_save_automove_pos_begin_s
-    if ought_to_save_age_s > 6.0 and ought_to_save_age_s < 20.0:
+    if ought_to_save_age_s > AUTO_SAVE_AFTER_S[0] and ought_to_save_age_s < AUTO_SAVE_AFTER_S[1]:
       ought_to_save_automove_pos_begin_s = 0.0 # go back in time to prevent doing this a second time!
       try:
         input_file_keycode_s = '113,14'
-        # Find first non-existent file under GPIO_MOTOR_KEYS_IN_DIR
-        for _ in range(0, 100):
-          input_num = random.randrange(1000, 9000)
-          input_f_name = os.path.join(GPIO_MOTOR_KEYS_IN_DIR, f'{input_num}.txt')
-          if os.path.exists(input_f_name):
-            continue
-          with open(input_f_name, 'w') as fd:
-            fd.write(input_file_keycode_s)
-          break
-          print(f'AutoMove Wrote "{input_file_keycode_s}" to {input_f_name} to save new position!')
+        input_f_name = write_to_gpio_motor_keys_in(input_file_keycode_s)
+        print(f'AutoMove Wrote "{input_file_keycode_s}" to {input_f_name} to save new position!')
 
       except:
         traceback.print_exc()
@@ -665,53 +604,130 @@ async def do_image_analysis_processing(img):
 
 
 
+def import_vision_modules():
+  global cv2, numpy, rail_detector, position_templates, frame_sources, flight_recorder, frame_compositor, multi_camera
+  t0 = time.monotonic()
+  cv2 = import_or_install('cv2', 'opencv-python')
+  numpy = import_or_install('numpy')
+  rail_detector = importlib.import_module('rail_detector')
+  position_templates = importlib.import_module('position_templates')
+  frame_sources = importlib.import_module('frame_sources')
+  flight_recorder = importlib.import_module('flight_recorder')
+  frame_compositor = importlib.import_module('frame_compositor')
+  multi_camera = importlib.import_module('multi_camera')
+  metrics.startup_s['vision_import'] = time.monotonic() - t0
+  print(f'Imported vision modules in {metrics.startup_s["vision_import"]:.2f}s')
+
+vision_modules_future = None
+async def load_vision_modules():
+  # Runs import_vision_modules() once, everyone who needs cv2 awaits the same future
+  global vision_modules_future
+  if vision_modules_future is None:
+    vision_modules_future = asyncio.get_running_loop().run_in_executor(None, import_vision_modules)
+  await vision_modules_future
+
+async def publish_camera_placeholder(supervisor, retry_in_s):
+  # Keeps /video clients connected (and ensure_video_is_being_read quiet) while the camera is away
+  global last_video_frame_s, last_video_part
+  placeholder = supervisor.render_placeholder(retry_in_s)
+  last_video_part = frame_compositor.encode_multipart_jpeg(placeholder)
+  last_video_frame_s = time.time()
+  if shared_frame_ring is not None:
+    shared_frame_ring.heartbeat()
+    shared_frame_ring.publish(last_video_frame_num, placeholder, last_video_part, placeholder=True)
+
+async def reopen_frame_source(supervisor):
+  # Returns once supervisor.source is open; only restarts the whole service after a long outage.
+  # Backoff and the outage check apply to every reopen, also of a camera that opens fine but then
+  # only returns empty reads (supervisor.frame_failed() counts those as failures).
+  while True:
+    if supervisor.outage_s() > CAMERA_OUTAGE_RESTART_S:
+      print(f'Frame source down for {supervisor.outage_s():.0f}s, restarting webserver.service')
+      subprocess.run([
+        'sudo', 'systemctl', 'restart', 'webserver.service'
+      ], check=False)
+      raise Exception(f'Frame source down for {supervisor.outage_s():.0f}s: {supervisor.last_error}')
+
+    retry_at_s = time.monotonic() + supervisor.backoff_s()
+    while time.monotonic() < retry_at_s:
+      await publish_camera_placeholder(supervisor, retry_at_s - time.monotonic())
+      await asyncio.sleep(min(1.0, max(0.0, retry_at_s - time.monotonic())))
+
+    t0 = time.monotonic()
+    # Probing /dev/video* blocks for a while, keep serving HTTP meanwhile
+    if await asyncio.get_running_loop().run_in_executor(None, supervisor.try_open):
+      if not 'camera_open' in metrics.startup_s:
+        metrics.startup_s['camera_open'] = time.monotonic() - t0
+      print(f'Reading frames from {supervisor.source}, opened in {time.monotonic() - t0:.2f}s')
+      return
+
+# None uses FRAME_SOURCE from the environment, see frame_sources.py
+frame_source_spec = None
+camera_supervisor = None
+extra_cameras = None # multi_camera.MultiCamera when CAMERAS_FILE lists cameras besides the main one
 last_video_frame_num = 0
 last_video_frame_s = 0
-last_video_frame = None
+last_video_part = None # the latest frame as a complete multipart/x-mixed-replace part, shared by all /video clients
 async def read_video_t():
-  global last_video_frame_num, last_video_frame_s, last_video_frame, last_s_when_gpio_motor_is_active
-  cam_num = 0
-  camera = None
+  global last_video_frame_num, last_video_frame_s, last_video_part, camera_supervisor
+  global pending_template_capture, extra_cameras
+  supervisor = None
   try:
     frame_delay_s = FRAME_HANDLE_DELAY_S
-    for cam_num in range(0, 99):
+    await load_vision_modules()
+    if rail_detector_backend is None:
+      # Load saved templates before the first frame arrives
+      set_analysis_frame_size(rail_detector.FRAME_W, rail_detector.FRAME_H)
+    if extra_cameras is None:
       try:
-        camera = cv2.VideoCapture(f'/dev/video{cam_num}')
-        if not camera.isOpened():
-          raise RuntimeError('Cannot open camera')
+        camera_configs = multi_camera.load_camera_configs()
+        if len(camera_configs) > 0:
+          extra_cameras = multi_camera.MultiCamera(camera_configs, cpu_layout=cpu_layout_manager).start()
+          print(f'Started extra cameras {list(extra_cameras.workers)}')
       except:
         traceback.print_exc()
-      if camera is not None:
-        break
 
-    if camera is None:
+    compositor = frame_compositor.FrameCompositor()
+    supervisor = frame_sources.CaptureSupervisor(frame_source_spec)
+    camera_supervisor = supervisor
+    while True:
+      if supervisor.source is None:
+        await reopen_frame_source(supervisor)
+      camera = supervisor.source
+
+      if shared_frame_ring is not None:
+        # Running as the --vision-process worker
+        shared_frame_ring.heartbeat()
+        requested_capture_spool_num = shared_frame_ring.take_template_capture()
+        if requested_capture_spool_num is not None:
+          pending_template_capture = (os.path.join(GPIO_MOTOR_KEYS_IN_DIR, f'{requested_capture_spool_num}.txt'), time.monotonic())
+
+      # read() split in two so waiting on the camera and decoding are timed separately
+      t0 = time.perf_counter()
+      source_wait_s = camera.wait_s()
+      if source_wait_s > 0.0:
+        await asyncio.sleep(source_wait_s) # replay/synthetic sources pace themselves without blocking the loop
+      img = None
+      t1 = t0
       try:
-        camera = cv2.VideoCapture(-1) # auto-select "best"
+        grabbed = camera.grab()
+        t1 = time.perf_counter()
+        if grabbed:
+          # Decoded straight into the top of the output canvas when the size matches
+          img = camera.retrieve(out=compositor.frame_view(camera.width, camera.height))
       except:
         traceback.print_exc()
-
-    if camera is None or not camera.isOpened():
-        raise RuntimeError('Cannot open camera')
-
-    none_reads_count = 0
-    while True:
-
-      _, img = camera.read()
-      # img = cv2.resize(img, resolution)
+      metrics.observe('capture_wait', t1 - t0)
+      metrics.observe('decode', time.perf_counter() - t1)
 
       if img is None:
-        none_reads_count += 1
+        if supervisor.frame_failed():
+          await publish_camera_placeholder(supervisor, None)
         await asyncio.sleep(frame_delay_s) # allow other tasks to run
-        if none_reads_count > 3:
-          # This indicates we need to re-boot ourselves
-          subprocess.run([
-            'sudo', 'systemctl', 'restart', 'webserver.service'
-          ], check=False)
-          raise Exception(f'Read None from camera {none_reads_count} times!')
         continue
 
-      # img is not None, reset count
-      none_reads_count = 0
+      supervisor.frame_ok(img)
+      img = compositor.place_frame(img)
 
       rounded_frame_num = last_video_frame_num % 1000
 
@@ -722,33 +738,53 @@ async def read_video_t():
       #cv2.putText(img, f'{rounded_frame_num}', (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (240, 240, 240), 2, cv2.LINE_AA) # White text
 
       # Lower-left
-      cv2.putText(img, f'{rounded_frame_num}', (10, img_w-180), cv2.FONT_HERSHEY_SIMPLEX, 1, (10, 10, 10), 3, cv2.LINE_AA) # black outline
-      cv2.putText(img, f'{rounded_frame_num}', (10, img_w-180), cv2.FONT_HERSHEY_SIMPLEX, 1, (240, 240, 240), 2, cv2.LINE_AA) # White text
+      cv2.putText(img, f'{rounded_frame_num}', (10, img_h-20), cv2.FONT_HERSHEY_SIMPLEX, 1, (10, 10, 10), 3, cv2.LINE_AA) # black outline
+      cv2.putText(img, f'{rounded_frame_num}', (10, img_h-20), cv2.FONT_HERSHEY_SIMPLEX, 1, (240, 240, 240), 2, cv2.LINE_AA) # White text
 
-      # last_video_frame = cv2.imencode('.jpg', img)[1].tobytes()
       rail_px_diff = None
       debug_img = img
+      analysis_ok = False
       try:
         rail_px_diff, debug_img = await do_image_analysis_processing(img)
+        analysis_ok = True
       except:
         traceback.print_exc()
 
-      # Finally ensure debug_img is the same WIDTH as img
-      debug_img = cv2.resize(debug_img, (640, 380))
-
-      # combine images for a single output stream
-      combined_img = cv2.vconcat([img, debug_img])
-      combined_img_h, combined_img_w, combined_img_channels = combined_img.shape
+      if extra_cameras is not None:
+        # Automove acts on every camera's estimate, see multi_camera.fuse(). The main camera's is the template-aware
+        # one from analyse_rails(), stamped when it was analysed: a frame the static-scene gate skipped does not
+        # make it fresh again.
+        main_estimate = last_main_estimate if analysis_ok else None
+        rail_px_diff = extra_cameras.fuse_main(main_estimate, rail_detector_backend.geometry.max_allowed_rail_offset, img)
 
-      if os.path.exists('/tmp/gpio_motor_last_active_mtime'):
-        last_s_when_gpio_motor_is_active = max(last_s_when_gpio_motor_is_active, os.path.getmtime('/tmp/gpio_motor_last_active_mtime'))
+      # Finally resize debug_img to the frame WIDTH into the canvas under img, giving a single output frame
+      compositor.place_debug(debug_img)
 
-      seconds_since_last_table_move = time.time() - last_s_when_gpio_motor_is_active
-      if seconds_since_last_table_move > 9.0:
+      if observe_motion() > AUTOMOVE_WINDOW_S:
         # Green box around BOTH images
-        cv2.rectangle(combined_img, (1, 1), (combined_img_w-2, combined_img_h-2), color=(0,255,0), thickness=4)
-
-      last_video_frame = cv2.imencode('.jpg', combined_img)[1].tobytes()
+        compositor.draw_border((0,255,0))
+
+      t0 = time.perf_counter()
+      last_video_part = compositor.encode()
+      metrics.observe('jpeg_encode', time.perf_counter() - t0)
+
+      # Copy the ROI + results into the flight recorder before frame_done() clears this frame's timings
+      recorder = frame_recorder
+      recorder_slot = None
+      if recorder is not None and analysis_ok:
+        try:
+          # last_detection belongs to an earlier frame when the gate skipped this one
+          frame_detection = last_detection if last_frame_was_analysed else None
+          recorder_slot = recorder.record(last_video_frame_num, img, frame_detection, last_frame_was_analysed, rail_px_diff, metrics.last_stage_s)
+        except:
+          traceback.print_exc()
+      if shared_frame_ring is not None:
+        shared_frame_ring.publish(last_video_frame_num, img, last_video_part, last_detection if analysis_ok else None, last_frame_was_analysed, rail_px_diff, metrics.last_stage_s)
+      metrics.frame_done()
+
+      if not 'first_frame' in metrics.startup_s:
+        metrics.startup_s['first_frame'] = time.monotonic() - webserver_started_s
+        print(f'First frame {metrics.startup_s["first_frame"]:.2f}s after start')
 
       # Signal to other thread images are ready!
       last_video_frame_s = time.time()
@@ -756,28 +792,140 @@ async def read_video_t():
 
       # Fork off do_automove_with_rail_px_diff to it's own thread,
       # I'd prefer it be as far away from image processing as possible
-      # We also do not do automove on the first 4 frames on the assumption the
+      # We also do not do automove on the first 4 frames after (re)opening on the assumption the
       # camera may be stabalizing itself, and the image we get will be washed out
       # and unusable for targeting.
-      if last_video_frame_num > 4:
-        asyncio.create_task(do_automove_with_rail_px_diff(rail_px_diff))
+      if supervisor.frames_since_open > 4:
+        asyncio.create_task(do_automove_with_rail_px_diff(rail_px_diff, recorder, recorder_slot))
 
       await asyncio.sleep(frame_delay_s) # allow other tasks to run
 
   except:
     traceback.print_exc()
   finally:
+    if supervisor is not None:
+      supervisor.release()
+    if extra_cameras is not None:
+      extra_cameras.stop()
+      extra_cameras = None
     last_video_frame_num = 0
     last_video_frame_s = 0
-    last_video_frame = None
+    last_video_part = None
+
+# --vision-process (or VISION_PROCESS=1) moves read_video_t into a separate worker process, so capture,
+# detection and JPEG encoding no longer compete with HTTP for this interpreter's GIL.
+# The worker publishes every frame into a frame_ring.SharedFrameRing; this process only serves them.
+vision_process_enabled = os.environ.get('VISION_PROCESS', '0') == '1'
+shared_frame_ring = None # in both processes when enabled
+vision_process = None # the worker's multiprocessing.Process, in the HTTP process
+vision_process_restarts = 0
+last_vision_frame = None # newest frame dict read from the ring, for /status
+async def read_vision_process_t():
+  global frame_ring, shared_frame_ring, vision_process, vision_process_restarts, last_vision_frame
+  global last_video_frame_num, last_video_frame_s, last_video_part
+  try:
+    if frame_ring is None:
+      frame_ring = importlib.import_module('frame_ring')
+    if shared_frame_ring is None:
+      shared_frame_ring = frame_ring.SharedFrameRing.create()
+    restart_delay_s = 1.0
+    vision_process_started_s = 0.0
+    last_seq = shared_frame_ring.latest_seq()
+    last_automove_count = shared_frame_ring.automove_count()
+    while True:
+      hung = vision_process is not None and vision_process.is_alive() and \
+        time.time() - max(shared_frame_ring.writer_heartbeat_s(), vision_process_started_s) > VISION_PROCESS_HUNG_S
+      if hung:
+        print(f'Vision process {vision_process.pid} has not published for {VISION_PROCESS_HUNG_S:.0f}s, killing it')
+        vision_process.kill()
+        await asyncio.sleep(0.5)
+
+      if vision_process is None or not vision_process.is_alive():
+        if vision_process is not None:
+          vision_process_restarts += 1
+          print(f'Vision process {vision_process.pid} exited with {vision_process.exitcode}, restarting in {restart_delay_s:.0f}s')
+          await asyncio.sleep(restart_delay_s)
+          restart_delay_s = min(30.0, restart_delay_s * 2.0)
+        vision_process = multiprocessing.get_context('spawn').Process(
+          target=vision_process_main, args=(shared_frame_ring.name, frame_source_spec, os.getpid(), sorted(cpu_layout_manager.allowed_cpus)), name='vision', daemon=True
+        )
+        vision_process.start()
+        vision_process_started_s = time.time()
+        print(f'Started vision process {vision_process.pid} writing to shared memory {shared_frame_ring.name}')
+
+      automove_count = shared_frame_ring.automove_count()
+      if automove_count != last_automove_count:
+        if position_log is not None:
+          position_log.note_automove((automove_count - last_automove_count) & 0xffffffff)
+        last_automove_count = automove_count
+
+      seq = shared_frame_ring.latest_seq()
+      if seq != last_seq:
+        frame = shared_frame_ring.read(seq)
+        if frame is not None:
+          last_seq = seq
+          restart_delay_s = 1.0
+          last_vision_frame = frame
+          last_video_part = frame['part']
+          last_video_frame_s = time.time()
+          last_video_frame_num = frame['frame_num']
+          if not frame['placeholder']:
+            # The worker timed its stages; observe them here so /metrics looks the same in both modes
+            for stage, seconds in frame['stage_s'].items():
+              if seconds > 0.0:
+                metrics.observe(stage, seconds)
+            metrics.frame_done()
+            if not 'first_frame' in metrics.startup_s:
+              metrics.startup_s['first_frame'] = time.monotonic() - webserver_started_s
+              print(f'First frame {metrics.startup_s["first_frame"]:.2f}s after start')
+
+      await asyncio.sleep(VISION_PROCESS_POLL_S)
+  except:
+    traceback.print_exc()
+
+def vision_process_main(ring_name, source_spec, parent_pid, allowed_cpus):
+  # Entry point of the worker; it is spawned, so this module has just been imported fresh
+  global frame_ring, shared_frame_ring, frame_source_spec
+  frame_source_spec = source_spec
+  # Spawned from the event loop thread, so this starts out on the 'http' cores; resolve 'vision' and
+  # the extra cameras' 'camera' against the parent's cores instead (python cpu_layout.py --check-spawn)
+  cpu_layout_manager.adopt(allowed_cpus)
+  cpu_layout_manager.apply('vision')
+  frame_ring = importlib.import_module('frame_ring')
+  shared_frame_ring = frame_ring.SharedFrameRing.attach(ring_name)
+  shared_frame_ring.heartbeat()
+  asyncio.run(vision_process_loop(parent_pid))
+
+async def vision_process_loop(parent_pid):
+  # kill -USR2 on the webserver is forwarded here, where the flight recorder lives
+  asyncio.get_running_loop().add_signal_handler(signal.SIGUSR2, on_sigusr2)
+  reader = asyncio.create_task(read_video_t())
+  while not reader.done():
+    if os.getppid() != parent_pid:
+      print(f'Webserver {parent_pid} went away, vision process exiting')
+      break
+    await asyncio.sleep(1.0)
+
+def vision_process_stats_s():
+  s = f'vision process pid {vision_process.pid if vision_process is not None else None}, restarts {vision_process_restarts}'
+  if last_vision_frame is not None:
+    s += f', frame {last_vision_frame["frame_num"]} rail_px_diff {last_vision_frame["rail_px_diff"]} analysed {last_vision_frame["analysed"]}'
+    if last_vision_frame['placeholder']:
+      s += ' (CAMERA RECONNECTING)'
+  return s
 
 AUTOMOVE_RESET_PERIOD_S = 20
 AUTOMOVE_ADJUSTMENTS_ALLOWED = 28
 last_automove_reset_s = 0
 automove_remaining_adjustments_allowed = 0
-last_s_when_gpio_motor_is_active = 0
-async def do_automove_with_rail_px_diff(rail_px_diff):
-  global last_automove_reset_s, automove_remaining_adjustments_allowed, last_s_when_gpio_motor_is_active
+async def do_automove_with_rail_px_diff(rail_px_diff, recorder=None, recorder_slot=None):
+  decision = await decide_and_do_automove(rail_px_diff)
+  if recorder is not None and recorder_slot is not None:
+    recorder.set_automove(recorder_slot, decision)
+
+async def decide_and_do_automove(rail_px_diff):
+  # Returns one of flight_recorder.AUTOMOVE_DECISIONS
+  global last_automove_reset_s, automove_remaining_adjustments_allowed
   try:
     # If we have not reset our safety limit, reset it
     if time.time() - last_automove_reset_s > AUTOMOVE_RESET_PERIOD_S:
@@ -789,27 +937,23 @@ async def do_automove_with_rail_px_diff(rail_px_diff):
       if automove_remaining_adjustments_allowed > -1:
         print(f'automove_remaining_adjustments_allowed = {automove_remaining_adjustments_allowed}, leaving b/c < 1')
         automove_remaining_adjustments_allowed = -1 # to silence many errors!
-      return
+      return 'limit'
 
     # No rail detected, leave
     if rail_px_diff is None:
-      return
-
-    # Table is moving, leave
-    if os.path.exists('/tmp/gpio_motor_is_active'):
-      last_s_when_gpio_motor_is_active = time.time()
-      print(f'/tmp/gpio_motor_is_active, not performing automove!')
-      return
+      return 'no-rail'
 
-    # Do the faster decay checl using the mtime on /tmp/gpio_motor_last_active_mtime
-    if os.path.exists('/tmp/gpio_motor_last_active_mtime'):
-      last_s_when_gpio_motor_is_active = os.path.getmtime('/tmp/gpio_motor_last_active_mtime')
+    # Table is moving, or a move we sent has not finished yet, leave
+    seconds_since_last_table_move = observe_motion()
+    if motion_tracker.moving():
+      eta_s = motion_tracker.eta_s()
+      print(f'Table is moving{f" (done in {eta_s:.1f}s)" if eta_s is not None else ""}, not performing automove!')
+      return 'moving'
 
-    # We also refuse to move IF it has been >6s since last_s_when_gpio_motor_is_active
-    seconds_since_last_table_move = time.time() - last_s_when_gpio_motor_is_active
-    if seconds_since_last_table_move > 9.0:
-      print(f'seconds_since_last_table_move ({int(seconds_since_last_table_move)}) > 6.0, not performing automove!')
-      return
+    # We also refuse to move IF the table stopped more than AUTOMOVE_WINDOW_S ago
+    if seconds_since_last_table_move > AUTOMOVE_WINDOW_S:
+      print(f'seconds_since_last_table_move ({int(seconds_since_last_table_move)}) > {AUTOMOVE_WINDOW_S}, not performing automove!')
+      return 'settled'
 
 
     # Book keeping
@@ -824,33 +968,38 @@ async def do_automove_with_rail_px_diff(rail_px_diff):
 
     if os.path.exists('/tmp/no-automove.txt'):
       print(f'Refusing to write {input_file_keycode_s} to controller b/c /tmp/no-automove.txt exists!')
-      return
+      return 'disabled'
 
-    # Find first non-existent file under GPIO_MOTOR_KEYS_IN_DIR
-    for _ in range(0, 100):
-      input_num = random.randrange(1000, 9000)
-      input_f_name = os.path.join(GPIO_MOTOR_KEYS_IN_DIR, f'{input_num}.txt')
-      if os.path.exists(input_f_name):
-        continue
-      with open(input_f_name, 'w') as fd:
-        fd.write(input_file_keycode_s)
-
-      print(f'AutoMove Wrote "{input_file_keycode_s}" to {input_f_name}')
-
-      break
+    input_f_name = write_to_gpio_motor_keys_in(input_file_keycode_s)
+    print(f'AutoMove Wrote "{input_file_keycode_s}" to {input_f_name}')
+    if position_log is not None:
+      position_log.note_automove()
+    elif shared_frame_ring is not None:
+      shared_frame_ring.count_automove() # in the vision worker; the HTTP process logs it
+    return f'move-{input_file_keycode_s}'
 
   except:
     traceback.print_exc()
+  return 'error'
 
+video_reader_task = None
+video_reader_started_s = 0
 async def ensure_video_is_being_read():
-  global last_video_frame_num, last_video_frame_s, last_video_frame
-  last_frame_age = time.time() - last_video_frame_s
-  if last_frame_age > 90.0:
-    asyncio.create_task(read_video_t())
+  global last_video_frame_num, last_video_frame_s, last_video_part, video_reader_task, video_reader_started_s
+  # A reader that is still importing cv2 or probing cameras has no frames yet, give it the same 90s
+  last_frame_age = time.time() - max(last_video_frame_s, video_reader_started_s)
+  if vision_process_enabled:
+    # read_vision_process_t restarts its own worker, never run two of them
+    if video_reader_task is None or video_reader_task.done():
+      video_reader_started_s = time.time()
+      video_reader_task = asyncio.create_task(read_vision_process_t())
+  elif video_reader_task is None or video_reader_task.done() or last_frame_age > 90.0:
+    video_reader_started_s = time.time()
+    video_reader_task = asyncio.create_task(read_video_t())
 
 
 async def video_handle(request):
-  global last_video_frame_num, last_video_frame_s, last_video_frame
+  global last_video_frame_num, last_video_frame_s, last_video_part
 
   asyncio.create_task(ensure_video_is_being_read())
 
@@ -860,60 +1009,249 @@ async def video_handle(request):
   await response.prepare(request)
 
   last_read_frame_num = 0
-  while True:
-    if last_video_frame is not None and last_read_frame_num != last_video_frame:
-      await response.write(
-        b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'+last_video_frame+b'\r\n'
-      )
-    await asyncio.sleep(FRAME_HANDLE_DELAY_S)
+  metrics.connected_clients += 1
+  try:
+    while True:
+      if last_video_part is not None and last_read_frame_num != last_video_part:
+        t0 = time.perf_counter()
+        frame_part = last_video_part
+        await response.write(frame_part)
+        metrics.observe('broadcast', time.perf_counter() - t0)
+        metrics.bytes_sent_total += len(frame_part)
+      await asyncio.sleep(FRAME_HANDLE_DELAY_S)
+  finally:
+    metrics.connected_clients -= 1
+
+  return response
+
+async def camera_video_handle(request):
+  # /video/<camera> for one extra camera, /video/combined for all of them side by side
+  name = request.match_info['camera']
+  if name == 'main':
+    return await video_handle(request)
+  cameras = extra_cameras
+  if cameras is None or not (name == 'combined' or name in cameras.workers):
+    # With --vision-process the extra cameras run in the worker, which only shares the main stream
+    raise aiohttp.web.HTTPNotFound(text=f'No camera "{name}" in this process')
+
+  response = aiohttp.web.StreamResponse()
+  response.content_type = 'multipart/x-mixed-replace; boundary=frame'
+  await response.prepare(request)
+
+  last_part = None
+  cameras.add_viewer(name)
+  metrics.connected_clients += 1
+  try:
+    while True:
+      if name == 'combined':
+        part = await asyncio.get_running_loop().run_in_executor(None, cameras.combined)
+      else:
+        part = cameras.latest_part(name)
+      if part is not None and part is not last_part:
+        await response.write(part)
+        metrics.bytes_sent_total += len(part)
+        last_part = part
+      await asyncio.sleep(FRAME_HANDLE_DELAY_S)
+  finally:
+    cameras.add_viewer(name, -1)
+    metrics.connected_clients -= 1
 
   return response
 
+position_log = None
+async def position_history_t():
+  global position_log
+  history = position_history.PositionHistory(log_dir=POSITION_HISTORY_DIR)
+  try:
+    loop = asyncio.get_running_loop()
+    try:
+      num_loaded = await loop.run_in_executor(None, history.load_log)
+      print(f'Loaded {num_loaded} position history samples from {POSITION_HISTORY_DIR}')
+    except:
+      traceback.print_exc()
+      print(f'Cannot read {POSITION_HISTORY_DIR}, position history is kept in memory only')
+      history.log_dir = None
+    position_log = history
+    while True:
+      history.sample(PMEM_FILE)
+      if history.flush_due():
+        try:
+          await loop.run_in_executor(None, history.flush_log)
+        except:
+          traceback.print_exc()
+          print(f'Cannot write {POSITION_HISTORY_DIR}, position history is kept in memory only')
+          history.log_dir = None
+      await asyncio.sleep(position_history.SAMPLE_S)
+  except asyncio.CancelledError:
+    pass
+  except:
+    traceback.print_exc()
+
+async def history_handle(request):
+  if position_log is None:
+    return aiohttp.web.Response(text='Position history is still loading', status=503, content_type='text/plain')
+  try:
+    to_t = float(request.query.get('to', time.time()))
+    from_t = float(request.query.get('from', to_t - 3600.0))
+    points = int(request.query.get('points', position_history.DEFAULT_POINTS))
+  except ValueError:
+    return aiohttp.web.Response(text='from and to are unix seconds, points an integer', status=400, content_type='text/plain')
+  result = position_log.downsample(from_t, to_t, points)
+  return aiohttp.web.Response(text=json.dumps(result, separators=(',', ':')), content_type='application/json')
+
+async def metrics_handle(request):
+  metrics_text = metrics.render_prometheus()
+  if event_loop_monitor is not None:
+    metrics_text += event_loop_monitor.render_prometheus()
+  if camera_supervisor is not None:
+    metrics_text += camera_supervisor.render_prometheus(pipeline_metrics.METRIC_PREFIX)
+  metrics_text += dial_jogs.render_prometheus(pipeline_metrics.METRIC_PREFIX)
+  if extra_cameras is not None:
+    metrics_text += extra_cameras.render_prometheus(pipeline_metrics.METRIC_PREFIX)
+  metrics_text += cpu_layout_manager.render_prometheus(pipeline_metrics.METRIC_PREFIX)
+  return aiohttp.web.Response(text=metrics_text, content_type='text/plain')
+
+async def admin_loop_handle(request):
+  auth_resp = await maybe_redirect_for_auth(request)
+  if auth_resp is not None:
+    return auth_resp
+  if event_loop_monitor is None:
+    return aiohttp.web.Response(text='Loop monitor disabled (LOOP_MONITOR=0)', content_type='text/plain')
+  return aiohttp.web.Response(text=json.dumps(event_loop_monitor.snapshot(), indent=2), content_type='application/json')
+
+async def dump_flight_recorder(path=None):
+  # The snapshot copy is quick and happens on the loop so it is consistent; compression goes to a thread
+  if frame_recorder is None:
+    return None
+  snapshot = frame_recorder.snapshot()
+  return await asyncio.get_running_loop().run_in_executor(None, flight_recorder.write_snapshot, snapshot, path)
+
+async def admin_flight_recorder_handle(request):
+  auth_resp = await maybe_redirect_for_auth(request)
+  if auth_resp is not None:
+    return auth_resp
+  if vision_process is not None and vision_process.is_alive():
+    os.kill(vision_process.pid, signal.SIGUSR2)
+    return aiohttp.web.Response(text=f'Asked vision process {vision_process.pid} to dump its flight recorder to {flight_recorder_dump_dir()}\n', content_type='text/plain')
+  dump_path = await dump_flight_recorder()
+  if dump_path is None:
+    return aiohttp.web.Response(text='Flight recorder disabled (FLIGHT_RECORDER_FRAMES=0)', content_type='text/plain')
+  return aiohttp.web.Response(text=f'Dumped to {dump_path}\nReplay with: python flight_recorder.py {dump_path}\n', content_type='text/plain')
+
+def flight_recorder_dump_dir():
+  return flight_recorder.DUMP_DIR if flight_recorder is not None else '/tmp'
+
+def on_sigusr2():
+  if vision_process is not None and vision_process.is_alive():
+    os.kill(vision_process.pid, signal.SIGUSR2)
+    return
+  asyncio.create_task(dump_flight_recorder())
+
 async def on_app_shutdown(app):
-  global app_is_shutting_down, video_p
+  global app_is_shutting_down, video_p, shared_frame_ring
   app_is_shutting_down = True
   print(f'app_is_shutting_down = {app_is_shutting_down}!')
   #if video_p is not None:
   #  video_p.kill()
+  if vision_process is not None and vision_process.is_alive():
+    vision_process.terminate()
+    vision_process.join(timeout=2.0)
+  if shared_frame_ring is not None:
+    shared_frame_ring.close()
+    shared_frame_ring = None
+  if position_log is not None:
+    try:
+      position_log.flush_log()
+    except:
+      traceback.print_exc()
+
+event_loop_monitor = None
+midi_port_match = None
+async def on_app_startup(app):
+  global event_loop_monitor, midi_control
+  if os.environ.get('LOOP_MONITOR', '1') != '0':
+    event_loop_monitor = loop_monitor.LoopMonitor().install(asyncio.get_running_loop())
+
+  # Executor threads (camera probing, log flushes, module imports) run on the 'executor' role, not the event loop's core
+  asyncio.get_running_loop().set_default_executor(concurrent.futures.ThreadPoolExecutor(
+    thread_name_prefix='executor', initializer=cpu_layout_manager.thread_initializer('executor')
+  ))
+
+  # kill -USR2 <pid> dumps the last FLIGHT_RECORDER_FRAMES frames to /tmp
+  asyncio.get_running_loop().add_signal_handler(signal.SIGUSR2, on_sigusr2)
+
+  # Open the camera at boot rather than on the first viewer; cv2 is imported in the background by read_video_t
+  asyncio.create_task(ensure_video_is_being_read())
+
+  asyncio.create_task(position_history_t())
+
+  if midi_port_match is not None:
+    midi_control = midi_bridge.MidiBridge(on_midi_command, midi_table_state, port_match=midi_port_match)
+    asyncio.create_task(midi_control.run())
+
+def on_listening(message):
+  # run_app() calls this once the port is bound
+  metrics.startup_s['listen'] = time.monotonic() - webserver_started_s
+  print(message)
+  print(f'Listening {metrics.startup_s["listen"]:.2f}s after start')
 
 def build_app():
+  # The page, status page, CSS and JS are built (and compressed) once here, see static_assets.py
+  pages = {'/': 'index.html', '/index.html': 'index.html', '/status': 'status.html'}
+  ui_assets = static_assets.StaticAssets().build(pages=pages, substitutions={'PASSWORD_FILE': PASSWORD_FILE})
   app = aiohttp.web.Application()
+  app.add_routes(ui_assets.routes())
   app.add_routes([
-    aiohttp.web.get('/', index_handle),
-    aiohttp.web.get('/index.html', index_handle),
     aiohttp.web.get('/video', video_handle),
-    aiohttp.web.get('/status', status_handle),
+    aiohttp.web.get('/video/{camera}', camera_video_handle),
+    aiohttp.web.get('/status.json', status_json_handle),
+    aiohttp.web.get('/metrics', metrics_handle),
+    aiohttp.web.get('/history', history_handle),
+    aiohttp.web.get('/motion', motion_handle),
+    aiohttp.web.get('/admin/loop', admin_loop_handle),
+    aiohttp.web.get('/admin/flight-recorder', admin_flight_recorder_handle),
     aiohttp.web.post('/input', input_handle),
     aiohttp.web.post('/set-control-password', set_control_password_handle)
   ])
+  app.on_startup.append(on_app_startup)
   app.on_cleanup.append(on_app_shutdown)
   return app
 
-def try_to_use_core_2_excl():
+def apply_cpu_layout():
+  # Keep every thread off gpio-motor-control's core, then give this (the event loop) thread its role:
+  # 'http' when the vision worker does capture + detection, else 'combined', which keeps the vision cores.
+  # Threads started later inherit it unless they apply their own role, see cpu_layout.py
   try:
-    pid = os.getpid()
-    subprocess.run([
-      'taskset', '-cp', '0,1,2', str(pid)
-    ])
+    cpu_layout_manager.apply_process()
+    cpu_layout_manager.apply('http' if vision_process_enabled else 'combined')
   except:
     traceback.print_exc()
 
 def main(args=sys.argv):
+  global frame_source_spec, vision_process_enabled, midi_port_match
   if len(os.environ.get('DEBUG', '')) > 0:
     logging.basicConfig(level=logging.DEBUG)
 
-  try_to_use_core_2_excl()
+  port = 80 if os.geteuid() == 0 else 8080
+  for arg in args[1:]:
+    if arg.startswith('--frame-source='):
+      frame_source_spec = arg.split('=', 1)[1]
+    elif arg.startswith('--port='):
+      port = int(arg.split('=', 1)[1])
+    elif arg == '--vision-process':
+      vision_process_enabled = True
+    elif arg == '--midi':
+      midi_port_match = MIDI_PORT_MATCH
+    elif arg.startswith('--midi='):
+      midi_port_match = arg.split('=', 1)[1]
+
+  apply_cpu_layout()
 
   local_ip = get_loc_ip()
   hostname = socket.gethostname()
-  if os.geteuid() == 0:
-    print(f'Running on http://{local_ip}/')
-    print(f'Running on http://{hostname}/')
-    aiohttp.web.run_app(build_app(), port=80)
-  else:
-    print(f'Running on http://{local_ip}:8080/')
-    print(f'Running on http://{hostname}.local:8080/')
-    aiohttp.web.run_app(build_app(), port=8080)
+  print(f'Running on http://{local_ip}:{port}/')
+  print(f'Running on http://{hostname}.local:{port}/')
+  aiohttp.web.run_app(build_app(), port=port, print=on_listening)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+# Load test for webserver.py: N /video readers, /status.json pollers and /input posters at once,
+# reporting the frame rate each client actually got, server CPU + RSS, and /input latency
+# (e-stop separately) while the streams run.
+#
+# By default this starts its own webserver.py on a spare port with a synthetic frame source,
+# and points GPIO_MOTOR_KEYS_IN_DIR at a temp dir so no keypresses reach a real controller.
+#
+#   python webserver_loadtest.py --video-clients 4 --duration 30
+#   python webserver_loadtest.py --frame-source replay:research-photos --output before.json
+#   python webserver_loadtest.py --vision-process --output after.json              # capture/vision in a worker process
+#   python webserver_loadtest.py --url http://192.168.0.2/ --password hunter2   # a running server, no CPU/RSS
+#
+
+import os
+import sys
+import time
+import json
+import zlib
+import socket
+import base64
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import traceback
+
+py_env_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.py-env')
+os.makedirs(py_env_dir, exist_ok=True)
+sys.path.insert(0, py_env_dir)
+
+try:
+  import aiohttp
+except:
+  subprocess.run([
+    sys.executable, '-m', 'pip', 'install', f'--target={py_env_dir}', 'aiohttp'
+  ])
+  import aiohttp
+
+try:
+  import psutil
+except:
+  subprocess.run([
+    sys.executable, '-m', 'pip', 'install', f'--target={py_env_dir}', 'psutil'
+  ])
+  import psutil
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+FRAME_BOUNDARY = b'--frame\r\n'
+
+
+def percentiles_ms(latencies_s):
+  if len(latencies_s) < 1:
+    return {'n': 0}
+  v = sorted(latencies_s)
+  pick = lambda q: v[min(len(v) - 1, int(round(q * (len(v) - 1))))] * 1000.0
+  return {'n': len(v), 'p50_ms': pick(0.5), 'p99_ms': pick(0.99), 'max_ms': v[-1] * 1000.0}
+
+def find_free_port():
+  with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+    s.bind(('127.0.0.1', 0))
+    return s.getsockname()[1]
+
+
+async def video_client(session, url, stop_at, stats):
+  # Counts multipart parts written to us, and how many of them were a different frame than the last
+  stats.update({'parts': 0, 'unique_frames': 0, 'bytes': 0, 'error': None})
+  buf = b''
+  last_crc = None
+  try:
+    async with session.get(url + 'video') as resp:
+      async for chunk in resp.content.iter_any():
+        stats['bytes'] += len(chunk)
+        buf += chunk
+        parts = buf.split(FRAME_BOUNDARY)
+        buf = parts.pop() # may be incomplete
+        for part in parts:
+          if len(part) < 1:
+            continue
+          stats['parts'] += 1
+          crc = zlib.crc32(part)
+          if crc != last_crc:
+            stats['unique_frames'] += 1
+            last_crc = crc
+        if time.monotonic() >= stop_at:
+          break
+  except:
+    stats['error'] = traceback.format_exc(limit=1)
+
+async def status_poller(session, url, stop_at, interval_s, latencies_s):
+  while time.monotonic() < stop_at:
+    t0 = time.perf_counter()
+    try:
+      async with session.get(url + 'status.json') as resp:
+        await resp.read()
+      latencies_s.append(time.perf_counter() - t0)
+    except:
+      traceback.print_exc()
+    await asyncio.sleep(interval_s)
+
+async def input_poster(session, url, stop_at, interval_s, estop_every, latencies_s, estop_latencies_s):
+  n = 0
+  while time.monotonic() < stop_at:
+    n += 1
+    is_estop = estop_every > 0 and n % estop_every == 0
+    number = '!!!' if is_estop else ('r' if n % 2 == 0 else 'l')
+    t0 = time.perf_counter()
+    try:
+      async with session.post(url + 'input', data={'number': number}) as resp:
+        await resp.read()
+      (estop_latencies_s if is_estop else latencies_s).append(time.perf_counter() - t0)
+    except:
+      traceback.print_exc()
+    await asyncio.sleep(interval_s)
+
+async def sample_server(pid, stop_at, samples):
+  # Server CPU + RSS summed over its child processes too (the --vision-process worker)
+  try:
+    server = psutil.Process(pid)
+    procs = {}
+    while time.monotonic() < stop_at:
+      for proc in [server] + server.children(recursive=True):
+        if not proc.pid in procs:
+          procs[proc.pid] = proc
+          proc.cpu_percent(None)
+      await asyncio.sleep(1.0)
+      cpu_percent = 0.0
+      rss_bytes = 0
+      for proc_pid, proc in list(procs.items()):
+        try:
+          with proc.oneshot():
+            cpu_percent += proc.cpu_percent(None)
+            rss_bytes += proc.memory_info().rss
+        except psutil.NoSuchProcess:
+          del procs[proc_pid]
+      samples.append({'cpu_percent': cpu_percent, 'rss_bytes': rss_bytes, 'processes': len(procs)})
+  except psutil.NoSuchProcess:
+    pass
+
+async def wait_for_server(url, timeout_s):
+  deadline = time.monotonic() + timeout_s
+  async with aiohttp.ClientSession() as session:
+    while time.monotonic() < deadline:
+      try:
+        async with session.get(url + 'metrics') as resp:
+          if resp.status == 200:
+            return True
+      except aiohttp.ClientError:
+        pass
+      await asyncio.sleep(0.25)
+  return False
+
+async def run_load(opts, url, server_pid):
+  headers = {}
+  if opts.password:
+    headers['Authorization'] = 'Basic ' + base64.b64encode(f'loadtest:{opts.password}'.encode('utf-8')).decode('utf-8')
+
+  # Let the capture task start and settle before the clock runs
+  async with aiohttp.ClientSession(headers=headers) as warm_session:
+    await video_client(warm_session, url, time.monotonic() + opts.warmup, {})
+
+  start = time.monotonic()
+  stop_at = start + opts.duration
+  video_stats = [{} for _ in range(0, opts.video_clients)]
+  status_latencies_s = []
+  input_latencies_s = []
+  estop_latencies_s = []
+  server_samples = []
+
+  timeout = aiohttp.ClientTimeout(total=None, sock_read=10)
+  connector = aiohttp.TCPConnector(limit=0)
+  async with aiohttp.ClientSession(headers=headers, timeout=timeout, connector=connector) as session:
+    tasks = []
+    for i in range(0, opts.video_clients):
+      tasks.append(video_client(session, url, stop_at, video_stats[i]))
+    for _ in range(0, opts.status_pollers):
+      tasks.append(status_poller(session, url, stop_at, opts.status_interval, status_latencies_s))
+    for _ in range(0, opts.input_posters):
+      tasks.append(input_poster(session, url, stop_at, opts.input_interval, opts.estop_every, input_latencies_s, estop_latencies_s))
+    if server_pid is not None:
+      tasks.append(sample_server(server_pid, stop_at, server_samples))
+    await asyncio.gather(*tasks)
+  elapsed_s = time.monotonic() - start
+
+  for s in video_stats:
+    s['parts_per_s'] = s['parts'] / elapsed_s
+    s['fps'] = s['unique_frames'] / elapsed_s
+    s['mbit_per_s'] = (s['bytes'] * 8.0) / elapsed_s / 1e6
+
+  report = {
+    'url': url,
+    'duration_s': elapsed_s,
+    'video_clients': video_stats,
+    'status_latency': percentiles_ms(status_latencies_s),
+    'input_latency': percentiles_ms(input_latencies_s),
+    'estop_latency': percentiles_ms(estop_latencies_s),
+  }
+  if len(server_samples) > 0:
+    report['server'] = {
+      'cpu_percent_avg': sum(s['cpu_percent'] for s in server_samples) / len(server_samples),
+      'cpu_percent_max': max(s['cpu_percent'] for s in server_samples),
+      'rss_bytes_max': max(s['rss_bytes'] for s in server_samples),
+      'rss_bytes_last': server_samples[-1]['rss_bytes'],
+    }
+  return report
+
+
+def main(args=sys.argv):
+  parser = argparse.ArgumentParser(description='Load test webserver.py')
+  parser.add_argument('--url', default=None, help='Test an already-running server instead of starting one')
+  parser.add_argument('--frame-source', default='synthetic:offset=6,noise=4', help='FRAME_SOURCE for the server we start')
+  parser.add_argument('--vision-process', action='store_true', help='Start the server with --vision-process')
+  parser.add_argument('--video-clients', type=int, default=4)
+  parser.add_argument('--status-pollers', type=int, default=4)
+  parser.add_argument('--status-interval', type=float, default=6.0, help='The status page polls /status.json every 6s')
+  parser.add_argument('--input-posters', type=int, default=1)
+  parser.add_argument('--input-interval', type=float, default=1.0)
+  parser.add_argument('--estop-every', type=int, default=5, help='Every Nth /input post is an e-stop')
+  parser.add_argument('--duration', type=float, default=20.0)
+  parser.add_argument('--warmup', type=float, default=3.0)
+  parser.add_argument('--password', default=None)
+  parser.add_argument('--output', default=None)
+  opts = parser.parse_args(args[1:])
+
+  server = None
+  server_pid = None
+  spool_dir = None
+  url = opts.url
+  if url is None:
+    port = find_free_port()
+    spool_dir = tempfile.TemporaryDirectory(prefix='loadtest_keys_in_')
+    env = dict(os.environ)
+    env['GPIO_MOTOR_KEYS_IN_DIR'] = spool_dir.name
+    env['POSITION_HISTORY_DIR'] = os.path.join(spool_dir.name, 'position-history')
+    server_args = [sys.executable, os.path.join(REPO_DIR, 'webserver.py'), f'--frame-source={opts.frame_source}', f'--port={port}']
+    if opts.vision_process:
+      server_args.append('--vision-process')
+    server = subprocess.Popen(server_args, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    server_pid = server.pid
+    url = f'http://127.0.0.1:{port}/'
+  if not url.endswith('/'):
+    url += '/'
+
+  try:
+    if not asyncio.run(wait_for_server(url, 60.0)):
+      print(f'Server at {url} never answered /metrics', file=sys.stderr)
+      return 1
+    report = asyncio.run(run_load(opts, url, server_pid))
+    if spool_dir is not None:
+      report['spool_files_written'] = len(os.listdir(spool_dir.name))
+  finally:
+    if server is not None:
+      server.terminate()
+      try:
+        server.wait(timeout=5)
+      except subprocess.TimeoutExpired:
+        server.kill()
+    if spool_dir is not None:
+      spool_dir.cleanup()
+
+  report_s = json.dumps(report, indent=2)
+  if opts.output:
+    with open(opts.output, 'w') as fd:
+      fd.write(report_s + '\n')
+  else:
+    print(report_s)
+
+  fps_s = ', '.join(f'{s["fps"]:.1f}' for s in report['video_clients'])
+  print(f'fps per client: {fps_s}', file=sys.stderr)
+  print(f'/input p99 {report["input_latency"].get("p99_ms", 0):.1f}ms, e-stop p99 {report["estop_latency"].get("p99_ms", 0):.1f}ms', file=sys.stderr)
+  if 'server' in report:
+    print(f'server cpu avg {report["server"]["cpu_percent_avg"]:.0f}%, rss max {report["server"]["rss_bytes_max"]/1e6:.1f}MB', file=sys.stderr)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,37 @@
+function submitInputForm() {
+   console.log('submitInputForm');
+   var frm = document.getElementById('inputForm');
+   frm.submit();
+   setTimeout(function() { frm.reset(); }, 4600);
+   return false;
+}
+function submitStop() {
+   console.log('submitStop');
+   document.getElementById('number').value = '!!!';
+   var frm = document.getElementById('inputForm');
+   frm.submit();
+   setTimeout(function() { frm.reset(); }, 4600);
+   return false;
+}
+function pollMotion() {
+   fetch('/motion').then(function(r) { return r.json(); }).then(function(m) {
+     var s = '';
+     if (m.eta_s != null) {
+       s = 'Moving, done in '+m.eta_s.toFixed(1)+'s';
+     } else if (m.moving) {
+       s = 'Moving';
+     } else if (m.seconds_since_move_end < 86400) {
+       s = 'Stopped '+m.seconds_since_move_end.toFixed(0)+'s ago';
+     } else {
+       s = 'Stopped';
+     }
+     document.getElementById('motion_status').textContent = s;
+   }).catch(function(e) { console.log(e); });
+}
+setInterval(pollMotion, 1000);
+function submitSetPasswordForm() {
+   var frm = document.getElementById('setPasswordForm');
+   frm.submit();
+   frm.reset();
+   return false;
+}
@@ -0,0 +1,38 @@
+// Renders /status.json the way the server-side status page used to, refreshed every 6s
+function renderStatus(st) {
+  var nl = '\n';
+  var s = '';
+  if (st.pmem != null) {
+    s += '================================='+nl;
+    s += 'logical_position = '+st.pmem.logical_position+nl;
+    s += 'step_position = '+st.pmem.step_position+nl;
+    s += '================================='+nl;
+    st.pmem.positions.forEach(function(p, i) {
+      s += 'Position '+(i+1)+' step_position = '+p+nl;
+    });
+    s += '================================='+nl;
+    s += '==== Zero position init code ===='+nl;
+    st.pmem.positions.forEach(function(p, i) {
+      s += 'pmem.positions['+i+'].step_position = '+p+';'+nl;
+    });
+    s += nl;
+  } else {
+    s += 'ERROR FETCHING TABLE POSITIONS';
+  }
+  st.sections.forEach(function(section) {
+    s += '==== '+section[0]+' ===='+nl;
+    s += section[1]+nl;
+  });
+  if (st.error != null) {
+    s += nl+st.error;
+  }
+  return s;
+}
+function pollStatus() {
+  fetch('/status.json').then(function(r) { return r.json(); }).then(function(st) {
+    document.getElementById('status_time').textContent = 'Status at '+st.time;
+    document.getElementById('track_data').textContent = renderStatus(st);
+  }).catch(function(e) { console.log(e); });
+}
+window.addEventListener('load', pollStatus);
+setInterval(pollStatus, 6000);